@@ -0,0 +1,55 @@
+import time
+import argparse
+import logging
+from handlers.mysql_data_fetch.fetch import fetch_data_from_mysql, fetch_data_partitioned
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+def benchmark_fetch(partition_counts, repeats=3):
+    """
+    Measure full-fetch throughput (rows/sec) for each partition count.
+
+    Partition count 1 runs the original single-connection query as the baseline.
+
+    :param partition_counts: Iterable of partition counts to benchmark
+    :param repeats: Number of runs per partition count; the best run is reported
+    :return: List of result dictionaries
+    """
+    results = []
+
+    for partitions in partition_counts:
+        best_seconds = None
+        rows = 0
+
+        for _ in range(repeats):
+            start = time.perf_counter()
+            listings = fetch_data_partitioned(partitions) if partitions > 1 else fetch_data_from_mysql()
+            elapsed = time.perf_counter() - start
+
+            rows = len(listings)
+            best_seconds = elapsed if best_seconds is None else min(best_seconds, elapsed)
+
+        results.append({
+            'partitions': partitions,
+            'rows': rows,
+            'seconds': best_seconds,
+            'rows_per_sec': rows / best_seconds if best_seconds else 0.0
+        })
+
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark partitioned MySQL listing fetches.")
+    parser.add_argument('--partitions', type=int, nargs='+', default=[1, 2, 4, 8], help="Partition counts to compare")
+    parser.add_argument('--repeats', type=int, default=3, help="Runs per partition count (best is reported)")
+    args = parser.parse_args()
+
+    results = benchmark_fetch(args.partitions, args.repeats)
+
+    print(f"\n{'partitions':>10} {'rows':>10} {'seconds':>10} {'rows/sec':>12}")
+    for result in results:
+        print(f"{result['partitions']:>10} {result['rows']:>10} {result['seconds']:>10.3f} {result['rows_per_sec']:>12.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+import time
+import random
+import decimal
+import argparse
+import datetime
+import logging
+from handlers.data_handling.data_handling import format_data, format_data_rowwise
+
+# Configure logging
+logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(levelname)s - %(message)s")
+
+def synthetic_listings(count, seed=0):
+    """Generate `count` listing dictionaries shaped like the rows returned by fetch.py"""
+    rng = random.Random(seed)
+    amenity_types = ['Internal Amenities', 'External Amenities', 'Nearby Amenities']
+    amenity_names = ['swimming pool', 'gym', 'balcony', 'borehole', 'school', 'hospital', 'mall', 'garden']
+    listings = []
+
+    for listing_id in range(1, count + 1):
+        has_complex = rng.random() < 0.6
+        listings.append({
+            'id': listing_id,
+            'name': f"Listing {listing_id}",
+            'ref': f"ref{listing_id:08d}",
+            'category': rng.choice(['Sale', 'Rent']),
+            'county': rng.choice(['Nairobi County', 'Mombasa County', 'Kisumu County']),
+            'county_specific': rng.choice(['Kilimani', 'Westlands', 'Karen']),
+            'longitude': decimal.Decimal(f"{rng.uniform(36.7, 36.9):.6f}"),
+            'latitude': decimal.Decimal(f"{rng.uniform(-1.4, -1.2):.6f}"),
+            'listing_type': rng.choice(['Apartment', 'Villa', 'Studio']),
+            'listing_class': rng.choice(['Luxury', 'Regular', 'Affordable']),
+            'furnishing': rng.choice(['Furnished', 'Unfurnished', None]),
+            'bedrooms': rng.choice([1, 2, 3, 4, None]),
+            'bathrooms': rng.choice([1, 2, 3, None]),
+            'sq_area': rng.choice([800, 1200, 2500, None]),
+            'amount': rng.randint(50000, 50000000),
+            'viewing_fee': rng.choice([0, 1000, 2000]),
+            'currency': rng.choice(['KES', 'USD']),
+            'complex_id': 33 if has_complex else None,
+            'complex_title': 'Skyline Heights' if has_complex else None,
+            'complex_type': 'Apartment' if has_complex else None,
+            'complex_class': 'Luxury' if has_complex else None,
+            'complex_description': 'A gated community.' if has_complex else None,
+            'created_at': datetime.datetime(2025, 1, 1),
+            'updated_at': datetime.datetime(2025, 1, 2),
+            'first_name': 'Jane',
+            'last_name': 'Doe',
+            'business_name': 'Acme Realty',
+            'business_email': 'info@acme.test',
+            'amenities': '; '.join(
+                f"{rng.choice(amenity_types)}: {rng.choice(amenity_names)}" for _ in range(rng.randint(0, 12))
+            ) or None,
+        })
+
+    return listings
+
+def benchmark_format(count, repeats=3):
+    """
+    Compare the row-wise and column-batch narrative builders.
+
+    :param count: Number of synthetic listings
+    :param repeats: Runs per implementation; the best run is reported
+    :return: Dictionary of rows/sec per implementation and whether outputs are identical
+    """
+    listings = synthetic_listings(count)
+    results = {'rows': count}
+
+    for label, formatter in (('rowwise', format_data_rowwise), ('batched', format_data)):
+        best_seconds = None
+        for _ in range(repeats):
+            start = time.perf_counter()
+            narratives, _ = formatter(listings)
+            elapsed = time.perf_counter() - start
+            best_seconds = elapsed if best_seconds is None else min(best_seconds, elapsed)
+        results[label] = {'seconds': best_seconds, 'rows_per_sec': count / best_seconds, 'narratives': narratives}
+
+    results['identical'] = results['rowwise'].pop('narratives') == results['batched'].pop('narratives')
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark narrative generation in format_data.")
+    parser.add_argument('--rows', type=int, default=100000, help="Number of synthetic listings")
+    parser.add_argument('--repeats', type=int, default=3, help="Runs per implementation (best is reported)")
+    args = parser.parse_args()
+
+    results = benchmark_format(args.rows, args.repeats)
+
+    print(f"\n{'implementation':>15} {'seconds':>10} {'rows/sec':>12}")
+    for label in ('rowwise', 'batched'):
+        print(f"{label:>15} {results[label]['seconds']:>10.3f} {results[label]['rows_per_sec']:>12.1f}")
+    print(f"\nSpeedup: {results['rowwise']['seconds'] / results['batched']['seconds']:.2f}x")
+    print(f"Byte-identical output: {results['identical']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+import sys
+import argparse
+import subprocess
+
+# Entry points that used to load the model at import: main.py option 4 and the DB watcher
+DEFAULT_MODULES = ['pipeline.update_pipeline', 'utils.watcher']
+
+# Run in a fresh interpreter so every measurement is a cold start
+PROBE = """
+import time
+start = time.perf_counter()
+import {module}
+imported = time.perf_counter() - start
+loaded = None
+if {load_model}:
+    from handlers.embeddings_generation.generate_embeddings import get_model
+    get_model()
+    loaded = time.perf_counter() - start
+print(imported, loaded)
+"""
+
+def measure(module, load_model):
+    """Cold-start seconds to import `module`, and to import it and load the model"""
+    output = subprocess.run(
+        [sys.executable, '-c', PROBE.format(module=module, load_model=load_model)],
+        check=True, capture_output=True, text=True
+    ).stdout.splitlines()[-1].split()  # the probe prints its timings last
+    return float(output[0]), (float(output[1]) if output[1] != 'None' else None)
+
+def benchmark_imports(modules, repeats=3):
+    """
+    Compare cold import time with the import + model load every import used to pay.
+
+    :param modules: Module names to import
+    :param repeats: Cold starts per module; the best run is reported
+    :return: List of result dictionaries
+    """
+    results = []
+
+    for module in modules:
+        import_seconds = min(measure(module, False)[0] for _ in range(repeats))
+        eager_seconds = min(measure(module, True)[1] for _ in range(repeats))
+        results.append({
+            'module': module,
+            'import_seconds': import_seconds,
+            'eager_seconds': eager_seconds,
+            'saved_seconds': eager_seconds - import_seconds
+        })
+
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark cold-start import time of the embedding entry points.")
+    parser.add_argument('--modules', nargs='+', default=DEFAULT_MODULES, help="Modules to import")
+    parser.add_argument('--repeats', type=int, default=3, help="Cold starts per module (best is reported)")
+    args = parser.parse_args()
+
+    results = benchmark_imports(args.modules, args.repeats)
+
+    print(f"\n{'module':>25} {'lazy import':>12} {'import+load':>12} {'saved':>10}")
+    for result in results:
+        print(
+            f"{result['module']:>25} {result['import_seconds']:>12.3f} "
+            f"{result['eager_seconds']:>12.3f} {result['saved_seconds']:>10.3f}"
+        )
+
+if __name__ == "__main__":
+    main()
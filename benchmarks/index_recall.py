@@ -0,0 +1,161 @@
+import json
+import time
+import argparse
+import logging
+import faiss
+import numpy as np
+from handlers.embeddings_storage.embeddings_storage import choose_index_factory, default_nlist, pq_subquantizers
+
+# Configure logging
+logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(levelname)s - %(message)s")
+
+def synthetic_corpus(rows, dimension, clusters=50, seed=0):
+    """Normalized vectors drawn around random centres, a stand-in for sentence embeddings"""
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((clusters, dimension)).astype('float32')
+    vectors = centres[rng.integers(clusters, size=rows)] + 0.5 * rng.standard_normal((rows, dimension)).astype('float32')
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def load_corpus(args):
+    """Vectors from an export (.npz), the vector store of an index, or a synthetic corpus"""
+    if args.vectors:
+        return np.load(args.vectors)['vectors'].astype('float32')
+    if args.index_file:
+        from handlers.vector_store.vector_store import get_vector_store
+        return get_vector_store(args.index_file).load_all()[1]
+    return synthetic_corpus(args.rows, args.dimension)
+
+def split_queries(corpus, count, seed=0):
+    """Hold `count` random vectors out of the corpus to use as queries"""
+    rng = np.random.default_rng(seed)
+    held_out = np.zeros(len(corpus), dtype=bool)
+    held_out[rng.choice(len(corpus), size=min(count, len(corpus) // 10), replace=False)] = True
+    return corpus[~held_out], corpus[held_out]
+
+def recall_at_k(found, truth):
+    """Fraction of the true top-k neighbours found in the returned top-k"""
+    k = truth.shape[1]
+    return float(np.mean([len(set(row_found[:k]) & set(row_truth)) / k for row_found, row_truth in zip(found, truth)]))
+
+def default_factories(rows, dimension):
+    """The configurations `choose_index_factory` can pick, sized for the corpus, plus HNSW"""
+    nlist, m = default_nlist(rows), pq_subquantizers(dimension)
+    return [
+        "Flat",
+        f"IVF{nlist},Flat",
+        f"IVF{nlist},SQ8",
+        f"IVF{nlist},PQ{m}",
+        f"OPQ{m},IVF{nlist},PQ{m}",
+        "HNSW32,Flat",
+    ]
+
+def search_params(factory, nprobes, ef_searches):
+    """Search parameter settings to sweep for an index type"""
+    if 'HNSW' in factory:
+        return [{'efSearch': ef_search} for ef_search in ef_searches]
+    if 'IVF' in factory:
+        return [{'nprobe': nprobe} for nprobe in nprobes]
+    return [{}]
+
+def benchmark_factory(factory, database, queries, truth, k, params_list, latency_queries):
+    """
+    Build one index and measure it under each search parameter setting.
+
+    :return: List of result dictionaries, one per setting
+    """
+    start = time.perf_counter()
+    index = faiss.index_factory(database.shape[1], factory)
+    if not index.is_trained:
+        index.train(database)
+    index.add(database)
+    build_seconds = time.perf_counter() - start
+    index_bytes = int(faiss.serialize_index(index).nbytes)
+
+    results = []
+    parameter_space = faiss.ParameterSpace()
+    for params in params_list:
+        for name, value in params.items():
+            parameter_space.set_index_parameter(index, name, value)
+
+        start = time.perf_counter()
+        _, found = index.search(queries, k)
+        batch_seconds = time.perf_counter() - start
+
+        latencies = []
+        for query in queries[:latency_queries]:
+            start = time.perf_counter()
+            index.search(query.reshape(1, -1), k)
+            latencies.append(time.perf_counter() - start)
+
+        results.append({
+            'factory': factory,
+            'params': params,
+            'recall': recall_at_k(found, truth),
+            'qps': len(queries) / batch_seconds,
+            'p50_ms': float(np.percentile(latencies, 50) * 1000),
+            'p99_ms': float(np.percentile(latencies, 99) * 1000),
+            'build_seconds': build_seconds,
+            'index_bytes': index_bytes
+        })
+
+    return results
+
+def benchmark_indices(corpus, factories, k=10, query_count=1000, nprobes=(1, 4, 16, 64), ef_searches=(16, 64, 256), latency_queries=200):
+    """
+    Sweep index configurations and search parameters against exact ground truth.
+
+    :param corpus: 2-D float32 array of vectors; some are held out as queries
+    :param factories: FAISS factory strings to build
+    :param k: Neighbours per query
+    :param query_count: Number of held-out query vectors
+    :param nprobes: nprobe values swept for IVF indices
+    :param ef_searches: efSearch values swept for HNSW indices
+    :param latency_queries: Queries searched one at a time for the latency percentiles
+    :return: List of result dictionaries
+    """
+    database, queries = split_queries(corpus, query_count)
+    ground_truth = faiss.IndexFlatL2(database.shape[1])
+    ground_truth.add(database)
+    _, truth = ground_truth.search(queries, k)
+
+    results = []
+    for factory in factories:
+        results.extend(benchmark_factory(factory, database, queries, truth, k, search_params(factory, nprobes, ef_searches), latency_queries))
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark FAISS index recall, latency and size.")
+    parser.add_argument('--vectors', help="Vectors exported from a vector store (.npz) to use as the corpus")
+    parser.add_argument('--index-file', help="Use the vector store of this index as the corpus")
+    parser.add_argument('--rows', type=int, default=50000, help="Synthetic corpus size")
+    parser.add_argument('--dimension', type=int, default=384, help="Synthetic vector dimension")
+    parser.add_argument('--factories', nargs='+', help="Factory strings to compare ('auto' for the configured policy)")
+    parser.add_argument('--k', type=int, default=10, help="Neighbours per query (recall@k)")
+    parser.add_argument('--queries', type=int, default=1000, help="Held-out query vectors")
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 4, 16, 64], help="nprobe values for IVF indices")
+    parser.add_argument('--ef-search', type=int, nargs='+', default=[16, 64, 256], help="efSearch values for HNSW indices")
+    parser.add_argument('--json', help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args)
+    rows, dimension = corpus.shape
+    factories = [
+        choose_index_factory(rows, dimension, 'auto') if factory == 'auto' else factory
+        for factory in (args.factories or default_factories(rows, dimension))
+    ]
+    results = benchmark_indices(corpus, factories, args.k, args.queries, args.nprobe, args.ef_search)
+
+    print(f"\n{'factory':>24} {'params':>14} {'recall@' + str(args.k):>10} {'qps':>10} {'p50 ms':>8} {'p99 ms':>8} {'build s':>8} {'MB':>8}")
+    for result in results:
+        params = ','.join(f"{name}={value}" for name, value in result['params'].items()) or '-'
+        print(
+            f"{result['factory']:>24} {params:>14} {result['recall']:>10.4f} {result['qps']:>10.1f} "
+            f"{result['p50_ms']:>8.3f} {result['p99_ms']:>8.3f} {result['build_seconds']:>8.2f} {result['index_bytes'] / 2**20:>8.1f}"
+        )
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'rows': rows, 'dimension': dimension, 'k': args.k, 'results': results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import time
+import argparse
+import logging
+import numpy as np
+from benchmarks.format_data import synthetic_listings
+from handlers.data_handling.data_handling import format_data
+from handlers.embeddings_generation.generate_embeddings import MODEL_NAME
+from handlers.embeddings_generation.encoding_pool import load_encoder
+
+# Configure logging
+logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(levelname)s - %(message)s")
+
+def time_encode(encoder, texts, batch_size, repeats):
+    """Best-of-`repeats` encode of `texts`; returns (embeddings, seconds)"""
+    best_seconds = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        embeddings = encoder.encode(texts, batch_size=batch_size, convert_to_numpy=True, normalize_embeddings=True, show_progress_bar=False)
+        elapsed = time.perf_counter() - start
+        best_seconds = elapsed if best_seconds is None else min(best_seconds, elapsed)
+    return np.asarray(embeddings, dtype=np.float32), best_seconds
+
+def benchmark_backends(model_name, count, batch_size=64, repeats=3):
+    """
+    Compare ONNX Runtime encoders (fp32 and int8) with the PyTorch SentenceTransformer.
+
+    Parity is the cosine similarity of each ONNX vector with the PyTorch vector of the
+    same narrative (vectors are normalized, so this is their dot product).
+
+    :param model_name: SentenceTransformer model name or path
+    :param count: Number of synthetic narratives to encode
+    :param batch_size: Narratives per encode call
+    :param repeats: Runs per backend; the best run is reported
+    :return: List of result dictionaries
+    """
+    narratives, _ = format_data(synthetic_listings(count))
+    texts = [narrative[1] for narrative in narratives]
+    results = []
+    reference = None
+
+    for label, backend, quantize in (('torch', 'torch', False), ('onnx', 'onnx', False), ('onnx-int8', 'onnx', True)):
+        encoder = load_encoder(model_name, backend, quantize)
+        time_encode(encoder, texts[:batch_size], batch_size, 1)  # warm up
+        embeddings, seconds = time_encode(encoder, texts, batch_size, repeats)
+
+        if reference is None:
+            reference = embeddings
+        cosine = np.einsum('ij,ij->i', embeddings, reference)
+        results.append({
+            'backend': label,
+            'seconds': seconds,
+            'narratives_per_sec': count / seconds,
+            'min_cosine': float(cosine.min()),
+            'mean_cosine': float(cosine.mean())
+        })
+
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ONNX Runtime encoders against PyTorch.")
+    parser.add_argument('--model', default=MODEL_NAME, help="SentenceTransformer model name or path")
+    parser.add_argument('--rows', type=int, default=2000, help="Number of synthetic narratives")
+    parser.add_argument('--batch-size', type=int, default=64, help="Narratives per encode call")
+    parser.add_argument('--repeats', type=int, default=3, help="Runs per backend (best is reported)")
+    args = parser.parse_args()
+
+    results = benchmark_backends(args.model, args.rows, args.batch_size, args.repeats)
+
+    print(f"\n{'backend':>10} {'seconds':>10} {'narr/sec':>10} {'min cos':>9} {'mean cos':>9}")
+    for result in results:
+        print(
+            f"{result['backend']:>10} {result['seconds']:>10.3f} {result['narratives_per_sec']:>10.1f} "
+            f"{result['min_cosine']:>9.4f} {result['mean_cosine']:>9.4f}"
+        )
+
+if __name__ == "__main__":
+    main()
@@ -13,5 +13,88 @@ MYSQL_CONFIG = {
     'port': int(os.getenv('SQL_PORT', 3306))
 }
 
+# MySQL connection pool shared by the pipelines and watcher
+MYSQL_POOL_CONFIG = {
+    'size': int(os.getenv('SQL_POOL_SIZE', 5)),
+    'pre_ping': os.getenv('SQL_POOL_PRE_PING', 'true').lower() == 'true',
+    'recycle': int(os.getenv('SQL_POOL_RECYCLE', 3600))  # seconds before a connection is replaced
+}
+
 # Base logs directory
 BASE_LOG_DIR = "logs"
+
+# Fetch Configuration
+# Stream listings through a server-side cursor instead of loading them all at once
+FETCH_STREAM = os.getenv('FETCH_STREAM', 'false').lower() == 'true'
+FETCH_CHUNK_SIZE = int(os.getenv('FETCH_CHUNK_SIZE', 1000))
+# Split the initial full fetch into this many id ranges fetched concurrently
+FETCH_PARTITIONS = int(os.getenv('FETCH_PARTITIONS', 1))
+# Fetch amenities as a separate flat query and join them in Python instead of GROUP_CONCAT
+FETCH_CLIENT_AMENITIES = os.getenv('FETCH_CLIENT_AMENITIES', 'false').lower() == 'true'
+# Seconds re-read before the refresh cursor, since DATETIME columns only resolve whole seconds
+REFRESH_OVERLAP_SECONDS = int(os.getenv('REFRESH_OVERLAP_SECONDS', 1))
+
+# Snapshot Configuration
+# Cache fetched listings in a local columnar snapshot reused while the catalogue is unchanged
+FETCH_SNAPSHOT = os.getenv('FETCH_SNAPSHOT', 'false').lower() == 'true'
+# Reuse the latest snapshot without checking the database for changes
+SNAPSHOT_OFFLINE = os.getenv('SNAPSHOT_OFFLINE', 'false').lower() == 'true'
+SNAPSHOT_KEEP = int(os.getenv('SNAPSHOT_KEEP', 2))
+
+# Embedding Configuration
+# Reuse embeddings of unchanged narratives from an on-disk cache keyed by model and content hash
+EMBED_CACHE = os.getenv('EMBED_CACHE', 'true').lower() == 'true'
+EMBED_CACHE_MAX_MB = int(os.getenv('EMBED_CACHE_MAX_MB', 512))  # oldest entries are evicted beyond this
+# Narratives encoded per model call (sorted by token length so batches pad evenly)
+EMBED_BATCH_SIZE = int(os.getenv('EMBED_BATCH_SIZE', 64))
+# Encoding processes, each with its own model replica (1 = encode in-process, 0 = one per CPU core)
+EMBED_WORKERS = int(os.getenv('EMBED_WORKERS', 1))
+# Torch intra-op threads per encoding process
+EMBED_TORCH_THREADS = int(os.getenv('EMBED_TORCH_THREADS', 1))
+# Encoder backend: 'torch' (SentenceTransformer) or 'onnx' (ONNX Runtime, exported on first use)
+EMBED_BACKEND = os.getenv('EMBED_BACKEND', 'torch').lower()
+# Run the ONNX backend with int8 dynamically quantized weights
+EMBED_ONNX_QUANTIZE = os.getenv('EMBED_ONNX_QUANTIZE', 'false').lower() == 'true'
+# Send encode requests to a running encoder daemon (main.py option 5) instead of loading the model
+EMBED_DAEMON = os.getenv('EMBED_DAEMON', 'true').lower() == 'true'
+EMBED_DAEMON_SOCKET = os.getenv('EMBED_DAEMON_SOCKET', 'storage/encoder.sock')
+
+# Streaming Configuration
+# Micro-batches (FETCH_CHUNK_SIZE listings each) waiting between two streaming stages
+STREAM_QUEUE_DEPTH = int(os.getenv('STREAM_QUEUE_DEPTH', 4))
+# Vectors buffered to train a new index before streamed batches are added to it
+STREAM_TRAIN_SIZE = int(os.getenv('STREAM_TRAIN_SIZE', 10000))
+
+# Index Configuration
+# Precision of the exact vectors kept next to each index for retraining, reranking and export
+VECTOR_STORE_DTYPE = os.getenv('VECTOR_STORE_DTYPE', 'float32').lower()
+# Search fetches k * factor candidates from the index and reranks them by exact distance (1 = off)
+SEARCH_RERANK_FACTOR = int(os.getenv('SEARCH_RERANK_FACTOR', 4))
+# FAISS index factory string (e.g. "IVF1024,SQ8", "HNSW32,Flat"), or 'auto' to choose by dataset size
+FAISS_INDEX_FACTORY = os.getenv('FAISS_INDEX_FACTORY', 'auto')
+# 'auto' uses exact Flat search below FAISS_FLAT_MAX vectors, IVF-Flat below FAISS_IVF_FLAT_MAX,
+# IVF-SQ8 below FAISS_IVF_SQ8_MAX and OPQ+IVF-PQ beyond
+FAISS_FLAT_MAX = int(os.getenv('FAISS_FLAT_MAX', 20000))
+FAISS_IVF_FLAT_MAX = int(os.getenv('FAISS_IVF_FLAT_MAX', 200000))
+FAISS_IVF_SQ8_MAX = int(os.getenv('FAISS_IVF_SQ8_MAX', 2000000))
+# Memory-map indices read-only when searching, so query processes share one copy through the page cache
+SEARCH_MMAP = os.getenv('SEARCH_MMAP', 'true').lower() == 'true'
+# Retrain indices on a background thread and swap the result in, instead of blocking ingestion
+RETRAIN_IN_BACKGROUND = os.getenv('RETRAIN_IN_BACKGROUND', 'true').lower() == 'true'
+# Seconds a process waits at exit for a running background retrain before dropping it
+RETRAIN_EXIT_WAIT_SECONDS = int(os.getenv('RETRAIN_EXIT_WAIT_SECONDS', 60))
+# Shard indices by these listing columns (comma-separated, e.g. 'county' or 'category,county'); empty for one index
+SHARD_KEY = os.getenv('SHARD_KEY', '')
+# Shards searched in parallel by a fan-out search
+SHARD_SEARCH_WORKERS = int(os.getenv('SHARD_SEARCH_WORKERS', 4))
+# Search parameters (nprobe / efSearch) are tuned after each (re)train to the cheapest reaching this recall@k
+SEARCH_RECALL_TARGET = float(os.getenv('SEARCH_RECALL_TARGET', 0.95))
+SEARCH_TUNE_K = int(os.getenv('SEARCH_TUNE_K', 10))
+# Stored vectors used as tuning queries
+SEARCH_TUNE_QUERIES = int(os.getenv('SEARCH_TUNE_QUERIES', 500))
+# Deleted listings are hidden from searches by a tombstone list until they exceed this fraction of an index, then removed
+TOMBSTONE_COMPACT_FRACTION = float(os.getenv('TOMBSTONE_COMPACT_FRACTION', 0.1))
+# Indices are trained on a stratified sample of at most this many vectors per centroid (k-means and PQ codebooks; FAISS wants at least 39)
+TRAIN_POINTS_PER_CENTROID = int(os.getenv('TRAIN_POINTS_PER_CENTROID', 256))
+# Vectors read from the vector store at a time when filling or tuning an index
+INDEX_ADD_CHUNK = int(os.getenv('INDEX_ADD_CHUNK', 100000))
@@ -8,7 +8,7 @@ import asyncio
 import signal
 from datetime import datetime, timedelta
 from transformers import GPT2LMHeadModel, GPT2Tokenizer
-import mysql.connector
+import pymysql
 from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
 import torch
 from dotenv import load_dotenv
@@ -240,7 +240,7 @@ except Exception as e:
 # Graceful exit handler
 class GracefulExit:
     def __init__(self):
-        self.pool = None
+        self.conn = None
         self.should_exit = False
         self.loop = None
         self.models = []  # Track loaded models
@@ -255,9 +255,9 @@ class GracefulExit:
                 if task is not asyncio.current_task():
                     task.cancel()
             
-        # Close database connections
-        if self.pool:
-            self.pool._remove_connections()
+        # Close database connection
+        if self.conn and self.conn.open:
+            self.conn.close()
             
         # Release GPU memory
         if torch.cuda.is_available():
@@ -434,10 +434,10 @@ def random_date(start, end):
 def create_mysql_connection():
     try:
         print("Connecting to MySQL database...")
-        conn = mysql.connector.connect(**MYSQL_CONFIG)
+        conn = pymysql.connect(**MYSQL_CONFIG)
         print("Connected to MySQL database successfully!")
         return conn
-    except mysql.connector.Error as e:
+    except pymysql.MySQLError as e:
         print(f"Error connecting to MySQL database: {e}")
         sys.exit(1)
 
@@ -480,7 +480,7 @@ def create_table(conn):
         ''')
         conn.commit()
         print("Table 'listings_datasets' created or already exists.")
-    except mysql.connector.Error as e:
+    except pymysql.MySQLError as e:
         print(f"Error creating table: {e}")
         sys.exit(1)
 
@@ -545,7 +545,7 @@ def insert_listing(conn, listing):
         last_id = cursor.lastrowid
         conn.commit()
         return last_id
-    except mysql.connector.Error as e:
+    except pymysql.MySQLError as e:
         print(f"Error inserting listing: {e}")
         conn.rollback()
         return None
@@ -904,14 +904,10 @@ async def generate_dataset(num_listings=5, batch_size=50):
     print(f"Starting dataset generation for {num_listings} listings...")
     start_time = datetime.now()
     
-    # Create connection pool
-    pool = mysql.connector.pooling.MySQLConnectionPool(
-        pool_name="listing_pool",
-        pool_size=5,
-        **MYSQL_CONFIG
-    )
+    # Batches are inserted one after another, so a single connection is reused for all of them
+    conn = create_mysql_connection()
 
-    exit_handler.pool = pool
+    exit_handler.conn = conn
 
     # Prepare static data and dates
     static_data = prepare_static_data()
@@ -946,8 +942,9 @@ async def generate_dataset(num_listings=5, batch_size=50):
             
             # Batch insert into database
             if valid_listings:
-                conn = pool.get_connection()
                 try:
+                    # Reconnect if the server dropped the connection while the batch was generated
+                    conn.ping(reconnect=True)
                     # Insert first listing to get ID
                     first_id = insert_listing(conn, valid_listings[0])
                     if first_id is None:
@@ -965,8 +962,6 @@ async def generate_dataset(num_listings=5, batch_size=50):
                         
                 except Exception as e:
                     print(f"Database error: {e}")
-                finally:
-                    conn.close()
             
             print(f"\nProcessed {len(valid_listings)} listings in current batch")
             
@@ -977,8 +972,8 @@ async def generate_dataset(num_listings=5, batch_size=50):
     except Exception as e:
         print(f"Error during dataset generation: {e}")
     finally:
-        if pool:
-            pool._remove_connections()
+        if conn.open:
+            conn.close()
 
         if not exit_handler.should_exit:
             end_time = datetime.now()
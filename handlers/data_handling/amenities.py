@@ -0,0 +1,6 @@
+# Map amenities_dataset.type labels to the keys of the structured amenities dict
+AMENITY_TYPES = {
+    'Internal Amenities': 'internal',
+    'External Amenities': 'external',
+    'Nearby Amenities': 'nearby'
+}
@@ -1,9 +1,185 @@
+import hashlib
 import logging
 import numpy as np
+from operator import itemgetter
+from itertools import starmap
+from handlers.data_handling.amenities import AMENITY_TYPES
+
+def narrative_hash(narrative):
+    """Stable content hash of a narrative (hex digest), used to key cached embeddings"""
+    return hashlib.blake2b(narrative.encode('utf-8'), digest_size=16).hexdigest()
+
+def iter_amenities(amenities):
+    """
+    Yield (kind, detail) pairs, where kind is 'internal', 'external' or 'nearby'.
+
+    Accepts either the structured dict built by client-side amenity joins or the
+    'Type: amenity; Type: amenity' string produced by GROUP_CONCAT.
+    """
+    if isinstance(amenities, dict):
+        for kind in AMENITY_TYPES.values():
+            for detail in amenities.get(kind, []):
+                yield kind, detail
+        return
+
+    for amenity in amenities.split('; '):
+        amenity_type, amenity_detail = amenity.split(': ')
+        yield AMENITY_TYPES.get(amenity_type), amenity_detail
+
+# Amenity sentence templates by amenity kind
+AMENITY_SENTENCES = {
+    'nearby': "Enjoy the convenience of {} just a short distance away.",
+    'external': "Take advantage of {} right on the property's grounds.",
+    'internal': "Inside, you'll find {} for your comfort and enjoyment.",
+}
+
+# Rendered sentence per raw 'Type: amenity' token; the vocabulary of amenities is small
+_amenity_sentence_cache = {}
+
+def _amenity_sentence(kind, detail):
+    """Render one amenity sentence, or None for unknown amenity kinds"""
+    template = AMENITY_SENTENCES.get(kind)
+    return template.format(detail) if template else None
+
+def _render_amenities(amenities):
+    """Render all amenity sentences of one listing ('' if there are none)"""
+    if not amenities:
+        return ''
+
+    if isinstance(amenities, dict):
+        sentences = [_amenity_sentence(kind, detail) for kind, detail in iter_amenities(amenities)]
+    else:
+        tokens = amenities.split('; ')
+        try:
+            sentences = [_amenity_sentence_cache[token] for token in tokens]
+        except KeyError:
+            for token in tokens:
+                if token not in _amenity_sentence_cache:
+                    (kind, detail), = iter_amenities(token)
+                    _amenity_sentence_cache[token] = _amenity_sentence(kind, detail) or ''
+            sentences = [_amenity_sentence_cache[token] for token in tokens]
+
+    return ' '.join(filter(None, sentences))
+
+# Listing fields a narrative is rendered from, in the order `render_narrative` takes them
+NARRATIVE_FIELDS = [
+    'name', 'ref', 'listing_type', 'listing_class', 'business_name', 'first_name', 'last_name', 'business_email',
+    'category', 'county_specific', 'county', 'longitude', 'latitude', 'complex_description',
+    'bedrooms', 'bathrooms', 'furnishing', 'sq_area', 'complex_id', 'complex_class', 'complex_title', 'complex_type',
+    'amenities', 'currency', 'amount', 'viewing_fee'
+]
+
+def render_narrative(name, ref, listing_type, listing_class, business_name, first_name, last_name, business_email,
+                     category, county_specific, county, longitude, latitude, complex_description,
+                     bedrooms, bathrooms, furnishing, sq_area, complex_id, complex_class, complex_title, complex_type,
+                     amenities, currency, amount, viewing_fee):
+    """Render the narrative of one listing from its NARRATIVE_FIELDS"""
+    # Combine key details into a single text entry per listing
+    combined_text = [
+        f"Property Name: {name} Property Ref: {ref} Type: {listing_type},\n"
+        f"Property Manager: {business_name} under User:{first_name} {last_name} Contact Email: {business_email}"
+    ]
+
+    if listing_class == 'Luxury':
+        combined_text.append(f"This is a high end {listing_class} {listing_type}.")
+
+    combined_text.append(
+        f"Category: {category},\n"
+        f"Location: {county_specific}, {county}\n"
+        f"Coordinates: Longitude {longitude}, Latitude {latitude}\n"
+        f"Details: {complex_description}"
+    )
+
+    # Bedrooms and Bathrooms
+    if bedrooms:
+        combined_text.append(f"It features {bedrooms} {'bedroom' if bedrooms == '1' else 'bedrooms'}.")
+    if bathrooms:
+        combined_text.append(f"And includes {bathrooms} {'bathroom' if bathrooms == 1 else 'bathrooms'}.")
+
+    # Furnishing
+    if furnishing:
+        combined_text.append(f"The property is {furnishing.lower()}.")
+
+    # Square Area
+    if sq_area:
+        combined_text.append(f"With a total area of {sq_area} sq. ft., it offers ample space.")
+
+    # Complex Information
+    if complex_id:
+        combined_text.append(f"{name} is part of the prestigious {complex_class} : {complex_title} complex of Type: {complex_type}")
+    else:
+        combined_text.append(f"{name} stands as an independent property.")
+
+    amenity_sentences = _render_amenities(amenities)
+    if amenity_sentences:
+        combined_text.append(amenity_sentences)
+
+    # Category
+    if category.lower() == 'rent':
+        combined_text.append(f"This property is available for rent at {currency} {amount} per month.")
+    else:
+        combined_text.append(f"This property is up for sale at {currency} {amount}.")
+
+    # Viewing Fee
+    if viewing_fee:
+        combined_text.append(f"A viewing fee of {viewing_fee} is required to schedule a visit.")
+
+    # Combine all parts into a single narrative
+    return ' '.join(combined_text)
+
+def render_narratives(columns):
+    """Render the narratives of a column batch ({field: column} holding every NARRATIVE_FIELDS column)"""
+    return list(starmap(render_narrative, zip(*[columns[field] for field in NARRATIVE_FIELDS])))
+
+# Columns transposed out of each batch: the listing id and the narrative fields
+_COLUMN_FIELDS = ['id'] + NARRATIVE_FIELDS
+_column_row_getter = itemgetter(*_COLUMN_FIELDS)
+
+def format_data_rowwise(listings):
+    """
+    Generate narratives for multiple property listings, one listing dictionary at a time.
+
+    Renders through the same `render_narrative` as `format_data`, without transposing the
+    listings into columns; kept as the baseline of benchmarks/format_data.py.
+    """
+    if not listings:
+        logging.warning("No listings found to generate narratives.")
+        return None
+
+    listing_ids = []
+    narratives = []
+    logging.info("Loading data formatter...")
+
+    for listing in listings:
+        listing_id = listing.get('id')
+        full_narrative = render_narrative(*[listing.get(field) for field in NARRATIVE_FIELDS])
+
+        listing_ids.append(listing_id)  # Keep track of listing IDs
+        narratives.append((listing_id, full_narrative, narrative_hash(full_narrative)))
+
+    logging.info(f"Generated narratives for {len(narratives)} rows.")
 
-def format_data(listings):
-    """Generate narratives for multiple property listings."""
+    return narratives, np.array(listing_ids)
 
+def _to_columns(batch):
+    """Transpose a batch of listing dictionaries into {field: column} for the narrative fields"""
+    try:
+        return dict(zip(_COLUMN_FIELDS, zip(*map(_column_row_getter, batch))))
+    except KeyError:
+        # Listings missing some fields render them as None, like dict.get
+        return {field: [listing.get(field) for listing in batch] for field in _COLUMN_FIELDS}
+
+def format_data(listings, batch_size=10000):
+    """
+    Generate narratives for multiple property listings.
+
+    Listings are transposed into column batches with one itemgetter pass and each
+    batch is rendered by mapping `render_narrative` over its zipped columns.
+
+    :param listings: List of listing dictionaries
+    :param batch_size: Number of listings rendered per column batch
+    :return: Tuple of (list of (listing_id, narrative, hash), numpy array of listing ids), or None
+    """
     if not listings:
         logging.warning("No listings found to generate narratives.")
         return None
@@ -12,96 +188,15 @@ def format_data(listings):
     narratives = []
     logging.info("Loading data formatter...")
 
-    for listing in listings:
-        # Define the keys you want to unpack in the order you want them
-        keys = [
-            'id', 'name', 'ref', 'slug', 'category', 'county', 'county_specific', 'longitude', 'latitude', 'location_description',
-            'listing_type', 'listing_class', 'furnishing', 'bedrooms', 'bathrooms', 'sq_area', 'amount', 'viewing_fee',
-            'property_description', 'status', 'availability', 'subscription_status', 'complex_id', 'user_id',
-            'created_at', 'updated_at', 'link', 'currency', 'amenities', 'complex_title', 'complex_slug', 'complex_email', 'complex_mobile', 'complex_description',
-            'complex_type', 'complex_class', 'complex_county', 'complex_county_specific', 'complex_longitude',
-            'complex_latitude', 'complex_location_description', 'complex_available', 
-            'first_name', 'last_name', 'business_name', 'account_type', 'business_email'
-        ]
-
-        # Unpack the values from the dictionary into variables
-        id, name, ref, slug, category, county, county_specific, longitude, latitude, location_description, \
-        listing_type, listing_class, furnishing, bedrooms, bathrooms, sq_area, amount, viewing_fee, \
-        property_description, status, availability, subscription_status, complex_id, user_id, \
-        created_at, updated_at, link, currency, amenities, complex_title, complex_slug, complex_email, complex_mobile, complex_description, \
-        complex_type, complex_class, complex_county, complex_county_specific, complex_longitude, \
-        complex_latitude, complex_location_description, complex_available, \
-        first_name, last_name, business_name, account_type, business_email = [listing.get(key, None) for key in keys]
-
-        # Now you can use these variables directly
-        combined_text = []
-
-        # Combine key details into a single text entry per listing
-        combined_text.append(
-            f"Property Name: {name} Property Ref: {ref} Type: {listing_type},\n"
-            f"Property Manager: {business_name} under User:{first_name} {last_name} Contact Email: {business_email}"
-        )
-
-        if listing_class == 'Luxury':
-            combined_text.append(f"This is a high end {listing_class} {listing_type}.")
-        
-        combined_text.append(
-            f"Category: {category},\n"
-            f"Location: {county_specific}, {county}\n"
-            f"Coordinates: Longitude {longitude}, Latitude {latitude}\n"
-            f"Details: {complex_description}"
-        )
-
-        # Bedrooms and Bathrooms
-        if bedrooms:
-            combined_text.append(f"It features {bedrooms} {'bedroom' if bedrooms == '1' else 'bedrooms'}.")
-        if bathrooms:
-            combined_text.append(f"And includes {bathrooms} {'bathroom' if bathrooms == 1 else 'bathrooms'}.")
-
-        # Furnishing
-        if furnishing:
-            combined_text.append(f"The property is {furnishing.lower()}.")
-
-        # Square Area
-        if sq_area:
-            combined_text.append(f"With a total area of {sq_area} sq. ft., it offers ample space.")
-
-        # Complex Information
-        if complex_id:
-            combined_text.append(f"{name} is part of the prestigious {complex_class} : {complex_title} complex of Type: {complex_type}")
-        else:
-            combined_text.append(f"{name} stands as an independent property.")
-
-        if amenities:
-            amenity_list = amenities.split('; ')
-            for amenity in amenity_list:
-                amenity_type, amenity_detail = amenity.split(': ')
-                if amenity_type == 'Nearby Amenities':
-                    combined_text.append(f"Enjoy the convenience of {amenity_detail} just a short distance away.")
-                elif amenity_type == 'External Amenities':
-                    combined_text.append(f"Take advantage of {amenity_detail} right on the property's grounds.")
-                elif amenity_type == 'Internal Amenities':
-                    combined_text.append(f"Inside, you'll find {amenity_detail} for your comfort and enjoyment.")
-
-        # Category
-        if category.lower() == 'rent':
-            combined_text.append(f"This property is available for rent at {currency} {amount} per month.")
-        else:
-            combined_text.append(f"This property is up for sale at {currency} {amount}.")
-
-        # Viewing Fee
-        if viewing_fee:
-            combined_text.append(f"A viewing fee of {viewing_fee} is required to schedule a visit.")
-        
-        listing_ids.append(id)  # Keep track of listing IDs
-
-        # Combine all parts into a single narrative
-        full_narrative = ' '.join(combined_text)
-        
-        # Append the generated narrative to the list of narratives
-        narratives.append((id, full_narrative))
+    for start in range(0, len(listings), batch_size):
+        batch = listings[start:start + batch_size]
+        columns = _to_columns(batch)
+
+        texts = render_narratives(columns)
+
+        listing_ids.extend(columns['id'])
+        narratives.extend(zip(columns['id'], texts, map(narrative_hash, texts)))
 
     logging.info(f"Generated narratives for {len(narratives)} rows.")
 
     return narratives, np.array(listing_ids)
-    
@@ -0,0 +1,164 @@
+import re
+import json
+import fcntl
+import logging
+import threading
+import numpy as np
+from pathlib import Path
+from contextlib import contextmanager
+from config import EMBED_CACHE_MAX_MB
+
+# Create embedding cache directory
+CACHE_DIR = Path("storage/embedding_cache")
+CACHE_DIR.mkdir(parents=True, exist_ok=True)
+
+# Width of the stored narrative hashes (hex digest of `narrative_hash`)
+HASH_DTYPE = 'S32'
+
+def cache_path(model_name):
+    """Directory of the embedding cache of a model"""
+    return CACHE_DIR / re.sub(r'[^A-Za-z0-9_.-]+', '_', model_name)
+
+def cached_dimension(model_name):
+    """Embedding dimension recorded by an existing cache of a model, or None if there is none"""
+    meta_file = cache_path(model_name) / "meta.json"
+    if not meta_file.exists():
+        return None
+    with open(meta_file, 'r') as f:
+        meta = json.load(f)
+    return meta.get('dimension') if meta.get('model') == model_name else None
+
+class EmbeddingCache:
+    """
+    On-disk cache of narrative embeddings for one model, keyed by narrative content hash.
+
+    Vectors live in a memory-mapped float32 matrix used as a ring buffer of `capacity`
+    slots, with the hash stored in each slot alongside. Once the cache is full the
+    oldest entries are overwritten first, which bounds its size on disk.
+
+    Several processes (e.g. the watcher and a manual update) may share the files: writes
+    hold an exclusive file lock and continue from the ring position on disk, reads hold
+    a shared one, and a slot is only trusted while it still holds the expected hash.
+    """
+
+    def __init__(self, model_name, dimension, max_mb=EMBED_CACHE_MAX_MB):
+        self.model_name = model_name
+        self.dimension = dimension
+        self.capacity = max(1, int(max_mb * 1024 * 1024) // (dimension * 4))
+        self.path = cache_path(model_name)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        with self._file_lock(exclusive=True):
+            self._open()
+
+    @contextmanager
+    def _file_lock(self, exclusive):
+        """Lock the cache against other processes: shared for reads, exclusive for writes"""
+        with open(self.path / "lock", 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read_meta(self):
+        meta_file = self.path / "meta.json"
+        if not meta_file.exists():
+            return None
+        with open(meta_file, 'r') as f:
+            return json.load(f)
+
+    def _open(self):
+        """Map the cache files, starting an empty cache if they are missing or were built differently"""
+        meta = self._read_meta()
+
+        expected = {'model': self.model_name, 'dimension': self.dimension, 'capacity': self.capacity}
+        if meta is not None and all(meta.get(key) == value for key, value in expected.items()):
+            self.vectors = np.load(self.path / "vectors.npy", mmap_mode='r+')
+            self.hashes = np.load(self.path / "hashes.npy", mmap_mode='r+')
+            self.next_slot = meta['next_slot']
+        else:
+            if meta is not None:
+                logging.info(f"Embedding cache settings changed; starting a new cache in {self.path}")
+            self.vectors = np.lib.format.open_memmap(
+                self.path / "vectors.npy", mode='w+', dtype=np.float32, shape=(self.capacity, self.dimension)
+            )
+            self.hashes = np.lib.format.open_memmap(
+                self.path / "hashes.npy", mode='w+', dtype=HASH_DTYPE, shape=(self.capacity,)
+            )
+            self.next_slot = 0
+            self._save_meta()
+
+        self.slots = {digest: slot for slot, digest in enumerate(self.hashes.tolist()) if digest}
+        logging.info(f"Loaded embedding cache for {self.model_name} with {len(self.slots)} entries")
+
+    def _save_meta(self):
+        with open(self.path / "meta.json", 'w') as f:
+            json.dump({
+                'model': self.model_name,
+                'dimension': self.dimension,
+                'capacity': self.capacity,
+                'next_slot': self.next_slot
+            }, f)
+
+    def __len__(self):
+        return len(self.slots)
+
+    def get_many(self, hashes):
+        """
+        Look up cached embeddings.
+
+        :param hashes: Sequence of narrative hashes
+        :return: Tuple of (float32 matrix with cached rows filled in, list of positions that missed)
+        """
+        embeddings = np.zeros((len(hashes), self.dimension), dtype=np.float32)
+        digests = [digest.encode('ascii') for digest in hashes]
+
+        with self._lock, self._file_lock(exclusive=False):
+            slots = np.array([self.slots.get(digest, -1) for digest in digests], dtype=np.int64)
+            hit = slots >= 0
+            # Another process may have overwritten a slot since this one recorded it
+            stale = np.flatnonzero(hit)[self.hashes[slots[hit]] != np.array(digests, dtype=HASH_DTYPE)[hit]]
+            for position in stale:
+                del self.slots[digests[position]]
+            hit[stale] = False
+
+            hit_positions = np.flatnonzero(hit)
+            if len(hit_positions):
+                embeddings[hit_positions] = self.vectors[slots[hit_positions]]
+
+        return embeddings, np.flatnonzero(~hit).tolist()
+
+    def put_many(self, hashes, embeddings):
+        """
+        Store embeddings under their narrative hashes, evicting the oldest entries when full.
+
+        :param hashes: Sequence of narrative hashes
+        :param embeddings: Matrix of embeddings, one row per hash
+        """
+        with self._lock, self._file_lock(exclusive=True):
+            # Continue from where the last writer, in whichever process, stopped
+            meta = self._read_meta()
+            if meta is not None:
+                self.next_slot = meta['next_slot']
+
+            for digest, embedding in zip(hashes, embeddings):
+                digest = digest.encode('ascii')
+                slot = self.slots.get(digest)
+                if slot is not None and self.hashes[slot] == digest:
+                    continue
+
+                slot = self.next_slot
+                evicted = self.hashes[slot]
+                if evicted and self.slots.get(evicted) == slot:
+                    del self.slots[evicted]
+
+                self.vectors[slot] = embedding
+                self.hashes[slot] = digest
+                self.slots[digest] = slot
+                self.next_slot = (slot + 1) % self.capacity
+
+            # Vectors are flushed before the hashes that point at them
+            self.vectors.flush()
+            self.hashes.flush()
+            self._save_meta()
@@ -0,0 +1,176 @@
+import os
+import json
+import time
+import socket
+import struct
+import logging
+import threading
+import socketserver
+import numpy as np
+from config import EMBED_DAEMON_SOCKET
+
+# Frame header: 4-byte big-endian length of the JSON that follows
+FRAME_HEADER = struct.Struct('!I')
+
+def _recv_exact(sock, size):
+    """Read exactly `size` bytes from a socket"""
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:])
+        if not count:
+            raise ConnectionError("Encoder daemon connection closed mid-message")
+        received += count
+    return bytes(buffer)
+
+def _send_message(sock, header, payload=b''):
+    """Send a JSON header frame followed by an optional raw payload"""
+    encoded = json.dumps(header).encode('utf-8')
+    sock.sendall(FRAME_HEADER.pack(len(encoded)) + encoded + payload)
+
+def _recv_header(sock):
+    """Receive one JSON header frame"""
+    (length,) = FRAME_HEADER.unpack(_recv_exact(sock, FRAME_HEADER.size))
+    return json.loads(_recv_exact(sock, length).decode('utf-8'))
+
+class EncoderClient:
+    """
+    Client of a running encoder daemon.
+
+    Requests are a JSON header frame; encode responses carry the embeddings as raw
+    float32 bytes after the header, so no vectors are serialized as JSON.
+    """
+
+    def __init__(self, socket_path=EMBED_DAEMON_SOCKET, timeout=None):
+        self.socket_path = str(socket_path)
+        self.timeout = timeout
+
+    def _request(self, header, timeout=None):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout if timeout is not None else self.timeout)
+            sock.connect(self.socket_path)
+            _send_message(sock, header)
+            response = _recv_header(sock)
+            if not response.get('ok'):
+                raise RuntimeError(f"Encoder daemon error: {response.get('error')}")
+
+            payload = None
+            if 'shape' in response:
+                rows, dimension = response['shape']
+                payload = _recv_exact(sock, rows * dimension * 4)
+            return response, payload
+
+    def info(self, timeout=None):
+        """Return {'encoder': name, 'dimension': int} describing the daemon's model"""
+        response, _ = self._request({'op': 'info'}, timeout)
+        return {'encoder': response['encoder'], 'dimension': response['dimension']}
+
+    def encode(self, texts, batch_size=None):
+        """Encode texts on the daemon; returns a float32 matrix in the order of `texts`"""
+        response, payload = self._request({'op': 'encode', 'texts': list(texts), 'batch_size': batch_size})
+        return np.frombuffer(payload, dtype=np.float32).reshape(response['shape']).copy()
+
+_client = None
+_client_info = None
+_client_lock = threading.Lock()
+
+def get_encoder_client(socket_path=EMBED_DAEMON_SOCKET):
+    """
+    Return a client of the encoder daemon if one is listening on `socket_path`, else None.
+
+    The check costs one connection attempt, so a daemon started or stopped between runs
+    (or between watcher polls) is picked up without restarting the caller.
+    """
+    global _client, _client_info
+    if not os.path.exists(socket_path):
+        return None
+
+    with _client_lock:
+        client = _client if _client is not None and _client.socket_path == str(socket_path) else EncoderClient(socket_path)
+        try:
+            _client_info = client.info(timeout=1.0)
+        except (OSError, RuntimeError, ValueError):
+            return None
+        _client = client
+    return client
+
+def get_encoder_client_info():
+    """Info reported by the daemon at the last successful `get_encoder_client` call"""
+    return _client_info
+
+class _EncoderRequestHandler(socketserver.BaseRequestHandler):
+    """Serve one request per connection"""
+
+    def handle(self):
+        server = self.server
+        try:
+            request = _recv_header(self.request)
+            if request.get('op') == 'info':
+                _send_message(self.request, {'ok': True, 'encoder': server.encoder, 'dimension': server.dimension})
+            elif request.get('op') == 'encode':
+                texts = request['texts']
+                batch_size = request.get('batch_size') or server.batch_size
+                start_time = time.perf_counter()
+                with server.encode_lock:
+                    embeddings = server.encode(texts, batch_size)
+                embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+                _send_message(self.request, {'ok': True, 'shape': list(embeddings.shape)}, embeddings.tobytes())
+                logging.info(f"Encoded {len(texts)} narratives for a client in {time.perf_counter() - start_time:.3f}s")
+            else:
+                _send_message(self.request, {'ok': False, 'error': f"Unknown op: {request.get('op')}"})
+        except Exception as e:
+            logging.error(f"Error serving encoder request: {e}")
+            try:
+                _send_message(self.request, {'ok': False, 'error': str(e)})
+            except OSError:
+                pass
+
+class EncoderServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Unix socket server keeping one warm model for all clients"""
+    daemon_threads = True
+
+    def __init__(self, socket_path, encode, encoder, dimension, batch_size):
+        self.encode = encode
+        self.encoder = encoder
+        self.dimension = dimension
+        self.batch_size = batch_size
+        # One request encodes at a time; the model already uses every core
+        self.encode_lock = threading.Lock()
+        super().__init__(str(socket_path), _EncoderRequestHandler)
+
+def serve_encoder(socket_path=EMBED_DAEMON_SOCKET):
+    """
+    Run the encoder daemon in the foreground until interrupted.
+
+    :param socket_path: Unix socket path to listen on
+    """
+    from handlers.embeddings_generation.generate_embeddings import (
+        get_model, warm_up, encoder_name, encode_narratives, EMBED_BATCH_SIZE
+    )
+
+    if os.path.exists(socket_path):
+        if get_encoder_client(socket_path) is not None:
+            logging.error(f"An encoder daemon is already listening on {socket_path}")
+            return
+        os.unlink(socket_path)  # stale socket left by a daemon that did not shut down cleanly
+
+    warm_up()
+    server = EncoderServer(
+        socket_path,
+        lambda texts, batch_size: encode_narratives(texts, batch_size=batch_size, use_daemon=False),
+        encoder_name(),
+        get_model().get_sentence_embedding_dimension(),
+        EMBED_BATCH_SIZE
+    )
+    logging.info(f"Encoder daemon for {encoder_name()} listening on {socket_path}")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logging.info("Shutting down encoder daemon...")
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        logging.info("Encoder daemon stopped")
@@ -0,0 +1,131 @@
+import os
+import time
+import logging
+import numpy as np
+import multiprocessing
+from multiprocessing import shared_memory
+
+# Model replica of a pool worker, loaded once by `_init_worker`
+_worker_model = None
+
+def load_encoder(model_name, backend='torch', quantize=False, threads=None):
+    """
+    Load the encoder for a backend.
+
+    :param model_name: SentenceTransformer model name or path
+    :param backend: 'torch' for SentenceTransformer, 'onnx' for ONNX Runtime
+    :param quantize: Use the int8 dynamically quantized ONNX model
+    :param threads: Intra-op threads, or None for the library default
+    :return: Object with the SentenceTransformer `encode` interface
+    """
+    if backend == 'onnx':
+        from handlers.embeddings_generation.onnx_encoder import OnnxEncoder
+        return OnnxEncoder(model_name, quantize=quantize, threads=threads)
+    if backend != 'torch':
+        raise ValueError(f"Unknown embedding backend: {backend}")
+
+    from sentence_transformers import SentenceTransformer
+    if threads:
+        import torch
+        torch.set_num_threads(threads)
+    return SentenceTransformer(model_name)
+
+def _init_worker(model_name, torch_threads, backend, quantize):
+    """Load one model replica per worker and cap its intra-op threads"""
+    global _worker_model
+    _worker_model = load_encoder(model_name, backend, quantize, threads=torch_threads)
+
+def _worker_dimension():
+    """Embedding dimension of the worker's model replica"""
+    return _worker_model.get_sentence_embedding_dimension()
+
+def _encode_into(shm_name, shape, positions, texts):
+    """Encode one batch in a worker and write its rows into the shared output matrix"""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        output = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+        output[positions] = _worker_model.encode(
+            texts,
+            batch_size=len(texts),
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False
+        )
+        del output
+    finally:
+        shm.close()
+    return len(texts)
+
+class EncodingPool:
+    """
+    Pool of spawned worker processes, each holding its own model replica.
+
+    Batches are handed out dynamically and every worker writes its embeddings straight
+    into one shared-memory matrix, so only texts and row positions cross process
+    boundaries. The parent process never loads the model.
+    """
+
+    def __init__(self, model_name, workers=None, torch_threads=1, backend='torch', quantize=False):
+        self.model_name = model_name
+        self.workers = workers or os.cpu_count() or 1
+        self.torch_threads = torch_threads
+        self._dimension = None
+
+        logging.info(f"Starting {self.workers} encoding workers ({torch_threads} torch threads each) for {model_name}")
+        context = multiprocessing.get_context('spawn')
+        self._pool = context.Pool(
+            processes=self.workers,
+            initializer=_init_worker,
+            initargs=(model_name, torch_threads, backend, quantize)
+        )
+
+    @property
+    def dimension(self):
+        """Embedding dimension of the model, asked of a worker on first use"""
+        if self._dimension is None:
+            self._dimension = self._pool.apply(_worker_dimension)
+        return self._dimension
+
+    def encode(self, texts, batch_size):
+        """
+        Encode texts across the workers.
+
+        Texts are ordered by length (longest first) so batches pad evenly and the
+        largest batches are scheduled before the small ones.
+
+        :param texts: List of narrative strings
+        :param batch_size: Number of narratives per worker task
+        :return: float32 matrix of normalized embeddings in the order of `texts`
+        """
+        shape = (len(texts), self.dimension)
+        if not texts:
+            return np.empty(shape, dtype=np.float32)
+
+        start_time = time.perf_counter()
+        order = np.argsort(-np.array([len(text) for text in texts]), kind='stable')
+
+        shm = shared_memory.SharedMemory(create=True, size=len(texts) * self.dimension * 4)
+        try:
+            tasks = []
+            for start in range(0, len(order), batch_size):
+                positions = order[start:start + batch_size]
+                tasks.append((shm.name, shape, positions, [texts[position] for position in positions]))
+
+            self._pool.starmap(_encode_into, tasks, chunksize=1)
+
+            embeddings = np.ndarray(shape, dtype=np.float32, buffer=shm.buf).copy()
+        finally:
+            shm.close()
+            shm.unlink()
+
+        elapsed = time.perf_counter() - start_time
+        logging.info(
+            f"Encoded {len(texts)} narratives on {self.workers} workers in {elapsed:.2f}s "
+            f"({len(texts) / elapsed:.1f} narratives/sec)"
+        )
+        return embeddings
+
+    def close(self):
+        """Stop the worker processes"""
+        self._pool.terminate()
+        self._pool.join()
@@ -1,21 +1,158 @@
-from sentence_transformers import SentenceTransformer
 import numpy as np
 import logging
+import atexit
+import threading
+import time
+from config import EMBED_CACHE, EMBED_BATCH_SIZE, EMBED_WORKERS, EMBED_TORCH_THREADS, EMBED_BACKEND, EMBED_ONNX_QUANTIZE, EMBED_DAEMON
+from handlers.data_handling.data_handling import narrative_hash
+from handlers.embeddings_cache.embedding_cache import EmbeddingCache, cached_dimension
+from handlers.embeddings_generation.encoding_pool import EncodingPool, load_encoder
+from handlers.embeddings_generation.encoder_daemon import get_encoder_client, get_encoder_client_info
 
-# Load SBERT model
+# SBERT model, loaded on first use so importing this module stays cheap
 MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
-logging.info(f"Loading BERT model: {MODEL_NAME}")
-model = SentenceTransformer(MODEL_NAME)
+_model = None
+_model_lock = threading.Lock()
 
-def generate_embeddings(narratives):
-    """Generate BERT embeddings for multiple property listings."""
+# Embedding cache for MODEL_NAME and multi-process encoding pools by worker count (when EMBED_WORKERS != 1), opened on first use
+_cache = None
+_pools = {}
+_lock = threading.Lock()
 
-    all_embeddings = []  # To store all embeddings
+def encoder_name():
+    """Name of the model and backend producing the vectors, used to key the embedding cache"""
+    if EMBED_BACKEND == 'onnx':
+        return f"{MODEL_NAME}@onnx-int8" if EMBED_ONNX_QUANTIZE else f"{MODEL_NAME}@onnx"
+    return MODEL_NAME
 
-    for narrative in narratives:
-        # Compute embeddings for each narrative
-        embedding = model.encode(narrative[1], convert_to_numpy=True, normalize_embeddings=True)
-        all_embeddings.append(embedding)
+def get_model():
+    """Return the SBERT model for EMBED_BACKEND, loading it on first use (thread-safe)"""
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                start_time = time.perf_counter()
+                logging.info(f"Loading BERT model: {encoder_name()}")
+                _model = load_encoder(MODEL_NAME, EMBED_BACKEND, EMBED_ONNX_QUANTIZE)
+                logging.info(f"Loaded BERT model in {time.perf_counter() - start_time:.2f}s")
+    return _model
 
-    # Convert to numpy array after collecting all embeddings
-    return np.array(all_embeddings)
\ No newline at end of file
+def warm_up():
+    """Load the model and run one encode so the first real request does not pay for it"""
+    get_model().encode("warm up", convert_to_numpy=True, normalize_embeddings=True, show_progress_bar=False)
+
+def get_embedding_cache():
+    """
+    Return the embedding cache of the model producing the vectors (the daemon's, if one is running).
+
+    The dimension of an existing cache is read from its metadata, so a run whose
+    narratives are all cached never loads the model.
+    """
+    global _cache
+    with _lock:
+        if _cache is None:
+            if EMBED_DAEMON and get_encoder_client() is not None:
+                info = get_encoder_client_info()
+                _cache = EmbeddingCache(info['encoder'], info['dimension'])
+            else:
+                dimension = cached_dimension(encoder_name()) or get_model().get_sentence_embedding_dimension()
+                _cache = EmbeddingCache(encoder_name(), dimension)
+    return _cache
+
+def get_encoding_pool(workers=EMBED_WORKERS):
+    """Return the multi-process encoding pool of `workers` workers (0 = one per core), starting it on first use"""
+    with _lock:
+        if workers not in _pools:
+            _pools[workers] = EncodingPool(
+                MODEL_NAME, workers=workers or None, torch_threads=EMBED_TORCH_THREADS,
+                backend=EMBED_BACKEND, quantize=EMBED_ONNX_QUANTIZE
+            )
+            atexit.register(_pools[workers].close)
+        return _pools[workers]
+
+def token_lengths(texts):
+    """Token count of each text as the model will see it (truncated to its max sequence length)"""
+    model = get_model()
+    encoded = model.tokenizer(texts, add_special_tokens=True, truncation=True, max_length=model.max_seq_length)
+    return np.array([len(input_ids) for input_ids in encoded['input_ids']])
+
+def encode_narratives(texts, batch_size=EMBED_BATCH_SIZE, workers=EMBED_WORKERS, use_daemon=EMBED_DAEMON):
+    """
+    Encode narrative texts with the loaded model into a float32 matrix.
+
+    Texts are sorted by token length (longest first) so each batch pads to a similar
+    length, encoded batch by batch, and written straight into a preallocated matrix
+    at their original positions. With more than one worker (0 = one per core), inputs
+    larger than a single batch are spread over the multi-process encoding pool.
+
+    When an encoder daemon is running, texts are sent to it instead and no model is
+    loaded in this process.
+
+    :param texts: List of narrative strings
+    :param batch_size: Number of narratives encoded per model call
+    :param workers: Number of encoding processes; 1 encodes in this process
+    :param use_daemon: Use the encoder daemon if one is listening
+    :return: float32 matrix of normalized embeddings in the order of `texts`
+    """
+    client = get_encoder_client() if use_daemon and texts else None
+    if client is not None:
+        try:
+            start_time = time.perf_counter()
+            embeddings = client.encode(texts, batch_size)
+            elapsed = time.perf_counter() - start_time
+            logging.info(f"Encoded {len(texts)} narratives on the encoder daemon in {elapsed:.2f}s ({len(texts) / elapsed:.1f} narratives/sec)")
+            return embeddings
+        except (OSError, RuntimeError) as e:
+            logging.warning(f"Encoder daemon unavailable ({e}); encoding locally.")
+
+    # The pool's workers hold their own replicas, so this process only loads the model to encode itself
+    if workers != 1 and len(texts) > batch_size:
+        return get_encoding_pool(workers).encode(texts, batch_size)
+
+    model = get_model()
+    embeddings = np.empty((len(texts), model.get_sentence_embedding_dimension()), dtype=np.float32)
+    if not texts:
+        return embeddings
+
+    start_time = time.perf_counter()
+    order = np.argsort(-token_lengths(texts), kind='stable')
+
+    for start in range(0, len(order), batch_size):
+        batch_positions = order[start:start + batch_size]
+        embeddings[batch_positions] = model.encode(
+            [texts[position] for position in batch_positions],
+            batch_size=len(batch_positions),
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False
+        )
+
+    elapsed = time.perf_counter() - start_time
+    logging.info(f"Encoded {len(texts)} narratives in {elapsed:.2f}s ({len(texts) / elapsed:.1f} narratives/sec)")
+    return embeddings
+
+def generate_embeddings(narratives, use_cache=EMBED_CACHE):
+    """
+    Generate BERT embeddings for multiple property listings.
+
+    Narratives whose content hash is already in the embedding cache are not re-encoded.
+
+    :param narratives: List of (listing_id, narrative, hash) tuples from `format_data`
+    :param use_cache: Consult and fill the on-disk embedding cache
+    :return: numpy array of embeddings, one row per narrative
+    """
+    texts = [narrative[1] for narrative in narratives]
+    if not use_cache:
+        return encode_narratives(texts)
+
+    hashes = [narrative[2] if len(narrative) > 2 else narrative_hash(narrative[1]) for narrative in narratives]
+    cache = get_embedding_cache()
+    embeddings, missing = cache.get_many(hashes)
+    logging.info(f"Embedding cache hits: {len(narratives) - len(missing)}/{len(narratives)}")
+
+    if missing:
+        encoded = encode_narratives([texts[position] for position in missing])
+        embeddings[missing] = encoded
+        cache.put_many([hashes[position] for position in missing], encoded)
+
+    return embeddings
@@ -0,0 +1,147 @@
+import re
+import json
+import time
+import logging
+import numpy as np
+from pathlib import Path
+
+# Create exported model directory
+ONNX_DIR = Path("storage/onnx_models")
+ONNX_DIR.mkdir(parents=True, exist_ok=True)
+
+def export_onnx_model(model_name, export_dir):
+    """
+    Export the transformer of a SentenceTransformer model to ONNX, with its tokenizer.
+
+    Only the transformer is exported; mean pooling and normalization are applied by
+    `OnnxEncoder`, as the model's own pooling layers do.
+
+    :param model_name: SentenceTransformer model name or path
+    :param export_dir: Directory receiving model.onnx, the tokenizer and meta.json
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    start_time = time.perf_counter()
+    logging.info(f"Exporting {model_name} to ONNX in {export_dir}")
+    export_dir.mkdir(parents=True, exist_ok=True)
+
+    sentence_model = SentenceTransformer(model_name, device='cpu')
+    transformer = sentence_model[0].auto_model.eval()
+    tokenizer = sentence_model.tokenizer
+
+    sample = tokenizer(["warm up"], return_tensors='pt')
+    input_names = [name for name in ('input_ids', 'attention_mask', 'token_type_ids') if name in sample]
+
+    class LastHiddenState(torch.nn.Module):
+        """Expose only the token embeddings, with inputs passed by keyword"""
+
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, *inputs):
+            return self.model(**dict(zip(input_names, inputs)))[0]
+
+    dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in input_names + ['last_hidden_state']}
+    with torch.no_grad():
+        torch.onnx.export(
+            LastHiddenState(transformer),
+            tuple(sample[name] for name in input_names),
+            str(export_dir / "model.onnx"),
+            input_names=input_names,
+            output_names=['last_hidden_state'],
+            dynamic_axes=dynamic_axes,
+            opset_version=14,
+            dynamo=False
+        )
+
+    tokenizer.save_pretrained(str(export_dir))
+    with open(export_dir / "meta.json", 'w') as f:
+        json.dump({
+            'model': model_name,
+            'dimension': sentence_model.get_sentence_embedding_dimension(),
+            'max_seq_length': sentence_model.max_seq_length
+        }, f)
+
+    logging.info(f"Exported {model_name} to ONNX in {time.perf_counter() - start_time:.2f}s")
+
+def quantize_onnx_model(export_dir):
+    """Write model.int8.onnx next to an exported model, with int8 dynamically quantized weights"""
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    logging.info(f"Quantizing ONNX model in {export_dir} to int8")
+    quantize_dynamic(str(export_dir / "model.onnx"), str(export_dir / "model.int8.onnx"), weight_type=QuantType.QInt8)
+
+class OnnxEncoder:
+    """
+    ONNX Runtime encoder for a mean-pooled SentenceTransformer model.
+
+    Exposes the subset of the SentenceTransformer interface used by generate_embeddings
+    (`encode`, `tokenizer`, `max_seq_length`, `get_sentence_embedding_dimension`), so it
+    can stand in for the PyTorch model. The model is exported on first use and the
+    export is reused afterwards, so loading does not need torch.
+    """
+
+    def __init__(self, model_name, quantize=False, threads=None):
+        import onnxruntime
+        from transformers import AutoTokenizer
+
+        self.model_name = model_name
+        self.quantize = quantize
+        export_dir = ONNX_DIR / re.sub(r'[^A-Za-z0-9_.-]+', '_', model_name)
+        if not (export_dir / "model.onnx").exists():
+            export_onnx_model(model_name, export_dir)
+        model_file = export_dir / ("model.int8.onnx" if quantize else "model.onnx")
+        if not model_file.exists():
+            quantize_onnx_model(export_dir)
+
+        with open(export_dir / "meta.json", 'r') as f:
+            meta = json.load(f)
+        self.dimension = meta['dimension']
+        self.max_seq_length = meta['max_seq_length']
+        self.tokenizer = AutoTokenizer.from_pretrained(str(export_dir))
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(str(model_file), options, providers=['CPUExecutionProvider'])
+        self.input_names = [model_input.name for model_input in self.session.get_inputs()]
+        logging.info(f"Loaded ONNX encoder {model_file}")
+
+    def get_sentence_embedding_dimension(self):
+        return self.dimension
+
+    def encode(self, sentences, batch_size=32, convert_to_numpy=True, normalize_embeddings=False, show_progress_bar=False):
+        """
+        Encode sentences into mean-pooled embeddings.
+
+        :param sentences: A string or list of strings
+        :param batch_size: Number of sentences per ONNX Runtime call
+        :param normalize_embeddings: Scale embeddings to unit length
+        :return: float32 matrix (or vector for a single string) of embeddings
+        """
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        embeddings = np.empty((len(texts), self.dimension), dtype=np.float32)
+
+        # Like SentenceTransformer, batch texts of similar length together to limit padding
+        order = np.argsort([-len(text) for text in texts], kind='stable')
+
+        for start in range(0, len(texts), batch_size):
+            positions = order[start:start + batch_size]
+            encoded = self.tokenizer(
+                [texts[position] for position in positions], padding=True, truncation=True,
+                max_length=self.max_seq_length, return_tensors='np'
+            )
+            inputs = {name: encoded[name].astype(np.int64) for name in self.input_names}
+            token_embeddings = self.session.run(None, inputs)[0]
+
+            mask = encoded['attention_mask'][..., None].astype(np.float32)
+            pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            if normalize_embeddings:
+                pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            embeddings[positions] = pooled
+
+        return embeddings[0] if single else embeddings
@@ -0,0 +1,164 @@
+import time
+import atexit
+import logging
+import threading
+import numpy as np
+from handlers.vector_store.vector_store import get_vector_store
+from handlers.embeddings_storage.search_tuning import tune_search_params
+from config import RETRAIN_EXIT_WAIT_SECONDS
+
+class BackgroundRetrainer:
+    """
+    Rebuild the index of one index file on a worker thread while ingestion continues.
+
+    The worker trains a shadow index on a stratified sample of a snapshot of the vector
+    store, fills it from the snapshot a chunk at a time and tunes its search parameters. The writer adopts the shadow on its
+    next store: listings added, replaced or deleted since the snapshot are replayed from
+    the vector store, and the shadow is saved over the index file (write to a temporary
+    file, then rename) under a new version number. If another process published a new version in the meantime the
+    shadow is discarded instead.
+    """
+
+    def __init__(self, index_file):
+        self.index_file = index_file
+        self.thread = None
+        self.shadow = None
+        self.lock = threading.Lock()
+
+    def pending(self):
+        """Whether a rebuild is running or waiting to be adopted"""
+        with self.lock:
+            return self.shadow is not None or (self.thread is not None and self.thread.is_alive())
+
+    def start(self):
+        """Start a rebuild unless one is already pending"""
+        with self.lock:
+            if self.shadow is not None or (self.thread is not None and self.thread.is_alive()):
+                return
+            # A daemon thread, so exiting never waits on a rebuild longer than `_adopt_on_exit` allows
+            self.thread = threading.Thread(target=self._build, name=f"retrain-{self.index_file}", daemon=True)
+            self.thread.start()
+
+    def _build(self):
+        from handlers.embeddings_storage.embeddings_storage import (
+            build_faiss_index, add_from_vector_store, choose_index_factory, training_sample_size, read_index_metadata
+        )
+
+        vector_store = get_vector_store(self.index_file)
+        base_version = read_index_metadata(self.index_file).get('version', 0)
+        listing_ids, rows, row_count = vector_store.snapshot()
+        try:
+            start_time = time.perf_counter()
+            factory = choose_index_factory(len(listing_ids), vector_store.dimension)
+            sample = vector_store.sample(training_sample_size(factory), rows)
+            index, factory, trained_points = build_faiss_index(sample, factory, num_points=len(listing_ids))
+            add_from_vector_store(index, vector_store, listing_ids, rows)
+            search_params, recall = tune_search_params(index, vector_store, listing_ids, rows)
+            logging.info(f"Built shadow {factory} index of {len(listing_ids)} vectors in {time.perf_counter() - start_time:.2f}s")
+        except Exception as e:
+            logging.error(f"Error retraining FAISS index in the background: {e}")
+            vector_store.unpin()
+            return
+
+        with self.lock:
+            self.shadow = {
+                'index': index,
+                'factory': factory,
+                'trained_points': trained_points,
+                'listing_ids': listing_ids,
+                'row_count': row_count,
+                'base_version': base_version,
+                'search_params': search_params,
+                'tuned_recall': recall
+            }
+
+    def adopt(self, index):
+        """
+        Swap in the shadow index if it is ready.
+
+        :param index: The index currently in use
+        :return: The shadow index, caught up and published, or `index` if none is ready
+        """
+        with self.lock:
+            shadow, self.shadow = self.shadow, None
+        if shadow is None:
+            return index
+
+        from handlers.embeddings_storage.embeddings_storage import (
+            publish_index, read_index_metadata, write_index_metadata, remove_vectors
+        )
+
+        vector_store = get_vector_store(self.index_file)
+        try:
+            version = read_index_metadata(self.index_file).get('version', 0)
+            if version != shadow['base_version']:
+                logging.warning(
+                    f"Discarding background retrain of {self.index_file}: version {version} was published "
+                    f"since it started from version {shadow['base_version']}"
+                )
+                return index
+
+            # Replay what changed while the shadow was being built; listings new since the snapshot are not in it
+            changed, deleted = vector_store.changes_since(shadow['listing_ids'], shadow['row_count'])
+            retrained = shadow['index']
+            stale = np.concatenate((changed[np.isin(changed, shadow['listing_ids'])], deleted))
+            if len(stale):
+                remove_vectors(retrained, stale, self.index_file)
+            if len(changed):
+                retrained.add_with_ids(vector_store.get(changed), changed)
+
+            version = publish_index(retrained, self.index_file, shadow['factory'], shadow['trained_points'], len(shadow['listing_ids']))
+            write_index_metadata(
+                self.index_file,
+                search_params=shadow['search_params'],
+                tuned_recall=shadow['tuned_recall'],
+                tuned_version=version
+            )
+            logging.info(f"Swapped in retrained index after replaying {len(changed)} updates and {len(deleted)} deletions")
+            return retrained
+        finally:
+            vector_store.unpin()
+
+_retrainers = {}
+_retrainers_lock = threading.Lock()
+
+def _retrainer(index_file):
+    with _retrainers_lock:
+        if index_file not in _retrainers:
+            _retrainers[index_file] = BackgroundRetrainer(index_file)
+        return _retrainers[index_file]
+
+def start_background_retrain(index_file="faiss_index_ivfpq.bin"):
+    """Start rebuilding an index in the background (no-op if a rebuild is pending)"""
+    _retrainer(index_file).start()
+
+def retrain_pending(index_file="faiss_index_ivfpq.bin"):
+    """Whether a background rebuild of an index is running or awaiting adoption"""
+    return _retrainer(index_file).pending()
+
+def adopt_retrained_index(index, index_file="faiss_index_ivfpq.bin", wait=False, timeout=None):
+    """
+    Return the background-rebuilt index if it is ready, else `index`.
+
+    :param index: The index currently in use
+    :param index_file: Index file name
+    :param wait: Wait for a running rebuild to finish first
+    :param timeout: Seconds to wait at most, or None to wait until it finishes
+    """
+    retrainer = _retrainer(index_file)
+    thread = retrainer.thread
+    if wait and thread is not None:
+        thread.join(timeout)
+    return retrainer.adopt(index)
+
+@atexit.register
+def _adopt_on_exit():
+    """Publish rebuilds that finish within RETRAIN_EXIT_WAIT_SECONDS of exit; drop the rest"""
+    for index_file in list(_retrainers):
+        adopt_retrained_index(None, index_file, wait=True, timeout=RETRAIN_EXIT_WAIT_SECONDS)
+        thread = _retrainers[index_file].thread
+        if thread is not None and thread.is_alive():
+            logging.warning(
+                f"Dropping unfinished background retrain of {index_file} at exit; "
+                f"the next store retrains it again if it is still needed"
+            )
@@ -1,159 +1,693 @@
+import os
+import re
+import json
+import math
 import logging
 import faiss
 import numpy as np
 from pathlib import Path
+from datetime import datetime
+from config import (
+    FAISS_INDEX_FACTORY, FAISS_FLAT_MAX, FAISS_IVF_FLAT_MAX, FAISS_IVF_SQ8_MAX, RETRAIN_IN_BACKGROUND, TOMBSTONE_COMPACT_FRACTION,
+    TRAIN_POINTS_PER_CENTROID, INDEX_ADD_CHUNK
+)
 from handlers.listings_tracker.tracker import ListingsTracker
+from handlers.vector_store.vector_store import get_vector_store, stratified_sample
+from handlers.embeddings_storage.background_retrain import start_background_retrain, adopt_retrained_index, retrain_pending
+from handlers.embeddings_storage.search_tuning import tune_search_params, apply_search_params
 
 RETRAIN_THRESHOLD = 0.5  # If new embeddings are ≥ 50% of stored ones, retrain
 # Create storage directory
 INDEX_DIR = Path("storage/faiss_indices")
 INDEX_DIR.mkdir(parents=True, exist_ok=True)
+# Zero-copy mmap of the whole index file where supported (FAISS >= 1.10), else of the IVF lists only
+MMAP_FLAGS = getattr(faiss, 'IO_FLAG_MMAP_IFC', faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
 
-def get_all_existing_embeddings(index_file):
+def index_path(index_file):
+    """Location of an index file inside INDEX_DIR"""
+    return INDEX_DIR / Path(index_file).name
+
+def metadata_path(index_file):
+    """Location of the JSON metadata written next to an index file"""
+    return index_path(index_file).with_suffix('.json')
+
+def read_index_metadata(index_file="faiss_index_ivfpq.bin"):
     """
-    Retrieve all stored embeddings from the FAISS index.
+    Read the metadata of an index (factory string, dimension, size, ...).
 
-    :param index_file: Path to FAISS index file
-    :return: numpy array of stored embeddings
+    :param index_file: Index file name
+    :return: Metadata dictionary, empty for indices written before metadata was kept
     """
-    index = faiss.read_index(index_file)
-    stored_embeddings = np.zeros((index.ntotal, index.d), dtype='float32')
-    
-    # Retrieve stored embeddings
-    for i in range(index.ntotal):
-        stored_embeddings[i] = index.reconstruct(i)
+    path = metadata_path(index_file)
+    if not path.exists():
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def write_index_metadata(index_file="faiss_index_ivfpq.bin", **fields):
+    """Merge `fields` into the metadata of an index"""
+    metadata = read_index_metadata(index_file)
+    metadata.update(fields)
+    with open(metadata_path(index_file), 'w') as f:
+        json.dump(metadata, f, indent=2)
+    return metadata
+
+def tombstones_path(index_file):
+    """Path of the tombstone list of an index, e.g. storage/faiss_indices/faiss_index_ivfpq.tombstones.npy"""
+    return index_path(index_file).with_suffix('.tombstones.npy')
+
+def read_tombstones(index_file="faiss_index_ivfpq.bin"):
+    """
+    Listing ids deleted from an index but still physically in it.
+
+    :return: Sorted numpy int64 array of listing ids (empty if there are none)
+    """
+    path = tombstones_path(index_file)
+    if not path.exists():
+        return np.empty(0, dtype='int64')
+    return np.load(path).astype('int64')
+
+def write_tombstones(index_file, listing_ids):
+    """Replace the tombstone list of an index (written to a temporary file, then renamed)"""
+    listing_ids = np.unique(np.asarray(listing_ids, dtype='int64'))
+    path = tombstones_path(index_file)
+    if not len(listing_ids):
+        path.unlink(missing_ok=True)
+        return listing_ids
+    temp_path = path.with_name(path.name + '.tmp')
+    with open(temp_path, 'wb') as f:
+        np.save(f, listing_ids)
+    os.replace(temp_path, path)
+    return listing_ids
+
+def live_count(index, index_file="faiss_index_ivfpq.bin"):
+    """Number of listings an index serves: its vectors less the tombstoned ones"""
+    return index.ntotal - len(read_tombstones(index_file))
+
+def save_index(index, index_file="faiss_index_ivfpq.bin"):
+    """
+    Write a FAISS index to INDEX_DIR and record its size in the metadata.
+
+    The index is written to a temporary file and renamed over the old one, so processes
+    that memory-mapped the old file keep a consistent copy until they reload.
+    """
+    path = index_path(index_file)
+    temp_path = path.with_name(path.name + '.tmp')
+    faiss.write_index(index, str(temp_path))
+    os.replace(temp_path, path)
+    write_index_metadata(index_file, ntotal=int(index.ntotal), saved_at=datetime.now().isoformat())
+
+def load_index(index_file="faiss_index_ivfpq.bin", tracker=None, read_only=False):
+    """
+    Read a FAISS index from INDEX_DIR.
+
+    Indices written to the working directory by older versions are still found, and
+    indices whose ids are FAISS positions (per the tracker's legacy position map) are
+    migrated to listing ids and saved to INDEX_DIR.
+
+    With `read_only`, the index file is memory-mapped instead of copied onto the heap:
+    loading is near-instant and processes searching the same index share its pages
+    through the page cache. A read-only index must not be added to or removed from.
+
+    :param index_file: Index file name
+    :param tracker: ListingsTracker, consulted for a legacy position map
+    :param read_only: Memory-map the index for searching only
+    :return: FAISS index whose ids are listing ids
+    """
+    path = index_path(index_file)
+    if not path.exists() and Path(index_file).exists():
+        logging.info(f"Loading FAISS index from legacy location {index_file}")
+        path = Path(index_file)
+
+    if read_only:
+        if tracker is not None and tracker.legacy_positions:
+            raise ValueError("An index still keyed by FAISS positions must be migrated before it is loaded read-only.")
+        index = faiss.read_index(str(path), MMAP_FLAGS)
+    else:
+        index = faiss.read_index(str(path))
+    metadata = read_index_metadata(index_file)
+    apply_search_params(index, metadata.get('search_params'))
+    mode = " (memory-mapped, read-only)" if read_only else ""
+    logging.info(
+        f"Loaded {metadata.get('factory', 'IVF,PQ')} index with {index.ntotal} vectors from {path}{mode}, "
+        f"search parameters {metadata.get('search_params') or 'default'}"
+    )
+
+    if tracker is not None and tracker.legacy_positions:
+        index = migrate_positions_to_ids(index, tracker)
+        save_index(index, index_file)
+
+    return index
+
+def _is_ivf(index):
+    """Whether an index is (or wraps) an IVF index"""
+    try:
+        faiss.extract_index_ivf(index)
+        return True
+    except RuntimeError:
+        return False
+
+def with_listing_ids(index):
+    """
+    Return an index that accepts listing ids through `add_with_ids`.
+
+    IVF indices store ids natively; other indices (e.g. flat ones) are wrapped in an
+    IndexIDMap2, which also supports `reconstruct` by id.
+    """
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)) or _is_ivf(index):
+        return index
+    if index.ntotal:
+        raise ValueError("Cannot assign listing ids to an index that already holds vectors.")
+    return faiss.IndexIDMap2(index)
+
+def _enable_reconstruct(index):
+    """Give IVF indices the id -> entry map `reconstruct` needs; a hashtable tolerates sparse ids"""
+    try:
+        ivf_index = faiss.extract_index_ivf(index)
+        if ivf_index.direct_map.type != faiss.DirectMap.Hashtable:
+            ivf_index.set_direct_map_type(faiss.DirectMap.Hashtable)
+    except RuntimeError:
+        pass
+
+def stored_ids(index):
+    """
+    Listing ids stored in a FAISS index.
+
+    :param index: FAISS index built by this module
+    :return: numpy int64 array of ids
+    """
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        return faiss.vector_to_array(index.id_map).astype('int64')
+
+    try:
+        invlists = faiss.extract_index_ivf(index).invlists
+    except RuntimeError:
+        return np.arange(index.ntotal, dtype='int64')
+
+    id_chunks = []
+    for list_no in range(invlists.nlist):
+        list_size = invlists.list_size(list_no)
+        if list_size:
+            id_chunks.append(faiss.rev_swig_ptr(invlists.get_ids(list_no), list_size).copy())
+    return np.concatenate(id_chunks).astype('int64') if id_chunks else np.empty(0, dtype='int64')
+
+def live_ids(index, index_file="faiss_index_ivfpq.bin"):
+    """Listing ids stored in a FAISS index that are not tombstoned"""
+    return np.setdiff1d(stored_ids(index), read_tombstones(index_file), assume_unique=True)
+
+def reconstruct_embeddings(index, listing_ids):
+    """
+    Reconstruct the vectors stored under the given ids.
+
+    :param index: FAISS index holding the vectors
+    :param listing_ids: Iterable of ids to reconstruct
+    :return: numpy array of reconstructed embeddings
+    """
+    _enable_reconstruct(index)
+
+    listing_ids = list(listing_ids)
+    stored_embeddings = np.zeros((len(listing_ids), index.d), dtype='float32')
+    for i, listing_id in enumerate(listing_ids):
+        stored_embeddings[i] = index.reconstruct(int(listing_id))
 
     return stored_embeddings
 
-def train_faiss_index(embeddings, nlist=100, m=8, index_file="faiss_index_ivfpq.bin"):
+def backfill_vector_store(index, listing_ids, index_file="faiss_index_ivfpq.bin"):
+    """
+    Add reconstructed vectors to the vector store for indexed listings it lacks.
+
+    Listings indexed before the vector store existed have no exact vector; their (lossy)
+    reconstruction from the index is stored once instead.
+
+    :param index: FAISS index holding the listings
+    :param listing_ids: Listing ids that must be in the vector store
+    :param index_file: Index file name, which names the vector store
+    :return: The vector store
+    """
+    vector_store = get_vector_store(index_file)
+    listing_ids = np.asarray(listing_ids, dtype='int64')
+    missing = np.array([listing_id not in vector_store for listing_id in listing_ids.tolist()], dtype=bool)
+
+    if missing.any():
+        logging.warning(f"{int(missing.sum())} listings have no exact vector stored; reconstructing them from the index")
+        vector_store.append(listing_ids[missing], reconstruct_embeddings(index, listing_ids[missing]))
+
+    return vector_store
+
+def exact_embeddings(index, listing_ids, index_file="faiss_index_ivfpq.bin"):
+    """
+    Exact vectors of indexed listings, read from the index's vector store.
+
+    :param index: FAISS index holding the listings
+    :param listing_ids: Listing ids to retrieve
+    :param index_file: Index file name, which names the vector store
+    :return: numpy array of embeddings, one row per listing id
+    """
+    return backfill_vector_store(index, listing_ids, index_file).get(listing_ids)
+
+def get_all_existing_embeddings(index_file, listing_ids=None):
+    """
+    Retrieve stored embeddings of a FAISS index from its vector store.
+
+    :param index_file: FAISS index file name
+    :param listing_ids: Listing ids to retrieve (defaults to every stored listing)
+    :return: Tuple of (numpy array of listing ids, numpy array of stored embeddings)
+    """
+    index = load_index(index_file)
+    if listing_ids is None:
+        listing_ids = live_ids(index, index_file)
+
+    return np.asarray(listing_ids, dtype='int64'), exact_embeddings(index, listing_ids, index_file)
+
+def migrate_positions_to_ids(index, tracker):
     """
-    Train a FAISS index using IVF+PQ method.
+    Re-key an index written with FAISS positions as ids to use listing ids.
+
+    :param index: FAISS index whose ids are positions
+    :param tracker: ListingsTracker holding the legacy position -> listing id map
+    :return: The same index, now keyed by listing id
+    """
+    positions = np.array(sorted(tracker.legacy_positions), dtype='int64')
+    logging.warning(f"Migrating {len(positions)} FAISS entries from positions to listing ids")
+
+    embeddings = reconstruct_embeddings(index, positions)
+    listing_ids = np.array([tracker.legacy_positions[position] for position in positions], dtype='int64')
+    index.reset()
+    index = with_listing_ids(index)
+    index.add_with_ids(embeddings, listing_ids)
+
+    tracker.initialize_mappings(listing_ids)
+    return index
+
+def default_nlist(num_points):
+    """IVF list count for a dataset: ~4 * sqrt(n), keeping at least 39 training points per centroid"""
+    return max(1, min(int(4 * math.sqrt(num_points)), num_points // 39))
+
+def pq_subquantizers(dimension):
+    """Largest PQ subquantizer count up to 64 that divides the dimension"""
+    return max(m for m in range(1, min(64, dimension) + 1) if dimension % m == 0)
+
+def choose_index_factory(num_points, dimension, factory=FAISS_INDEX_FACTORY):
+    """
+    Pick a FAISS index factory string for a dataset.
+
+    An explicit `factory` (e.g. "HNSW32,Flat") is used as-is. With 'auto' the index type
+    follows the dataset size: exact Flat search below FAISS_FLAT_MAX points, IVF-Flat below
+    FAISS_IVF_FLAT_MAX, IVF-SQ8 below FAISS_IVF_SQ8_MAX and OPQ-rotated IVF-PQ beyond.
+    HNSW is never chosen automatically, since it cannot remove (or replace) vectors.
+
+    :param num_points: Number of vectors the index will hold
+    :param dimension: Embedding dimension
+    :param factory: Factory string, or 'auto'
+    :return: Factory string
+    """
+    if factory.lower() != 'auto':
+        return factory
+
+    if num_points < FAISS_FLAT_MAX:
+        return "Flat"
+
+    nlist = default_nlist(num_points)
+    if num_points < FAISS_IVF_FLAT_MAX:
+        return f"IVF{nlist},Flat"
+    if num_points < FAISS_IVF_SQ8_MAX:
+        return f"IVF{nlist},SQ8"
+
+    m = pq_subquantizers(dimension)
+    return f"OPQ{m},IVF{nlist},PQ{m}"
+
+def index_family(factory):
+    """Factory string without its sizes, e.g. 'IVF1024,SQ8' -> 'IVF,SQ8'"""
+    return re.sub(r'\d+', '', factory)
+
+def training_sample_size(factory, points_per_centroid=TRAIN_POINTS_PER_CENTROID):
+    """
+    Number of vectors to train an index type on.
+
+    Training learns at most max(nlist, 256) centroids (the IVF lists, or the 256 codes of
+    each PQ / SQ codebook); beyond `points_per_centroid` per centroid, more vectors only
+    slow k-means down. Indices that need no training (Flat, HNSW) take none.
+
+    :param factory: Factory string
+    :param points_per_centroid: Training vectors per centroid
+    :return: Sample size
+    """
+    if 'IVF' not in factory and 'PQ' not in factory and 'SQ' not in factory:
+        return 0
+    nlist = re.search(r'IVF(\d+)', factory)
+    return max(int(nlist.group(1)) if nlist else 1, 256) * points_per_centroid
+
+def build_faiss_index(embeddings, factory=FAISS_INDEX_FACTORY, num_points=None):
+    """
+    Build and train an empty FAISS index, without saving it.
+
+    Training uses a stratified sample of at most `training_sample_size` of the embeddings,
+    so its time and memory stay bounded however large the catalogue grows.
+
+    :param embeddings: numpy array of embeddings to train on (a sample of the corpus will do)
+    :param factory: Factory string, or 'auto' to choose one by dataset size
+    :param num_points: Size of the corpus the index will hold (defaults to len(embeddings))
+    :return: Tuple of (trained, empty index that accepts listing ids, factory string used, training points)
+    """
+    num_points = num_points if num_points is not None else len(embeddings)
+    dimension = embeddings.shape[1]
+    factory = choose_index_factory(num_points, dimension, factory)
+
+    logging.info(f"Building {factory} index for {num_points} points of dimension {dimension}")
+    index = faiss.index_factory(dimension, factory)
+
+    trained_points = 0
+    if not index.is_trained:
+        sample = embeddings[stratified_sample(len(embeddings), training_sample_size(factory))]
+        trained_points = len(sample)
+        logging.info(f"Training FAISS index on {trained_points} of {len(embeddings)} vectors...")
+        index.train(np.ascontiguousarray(sample, dtype='float32'))
+    return with_listing_ids(index), factory, trained_points
+
+def add_from_vector_store(index, vector_store, listing_ids=None, rows=None, chunk_size=INDEX_ADD_CHUNK):
+    """
+    Add vectors from a vector store to an index a chunk at a time, so the corpus is never
+    held in memory at once.
+
+    :param index: Trained FAISS index that accepts listing ids
+    :param vector_store: VectorStore to read from
+    :param listing_ids: Listing ids to add (defaults to every live listing of the store)
+    :param rows: Vector store rows of `listing_ids`, e.g. from a snapshot
+    :param chunk_size: Vectors added at a time
+    :return: Number of vectors added
+    """
+    added = 0
+    for chunk_ids, chunk in vector_store.iter_chunks(chunk_size, listing_ids, rows):
+        index.add_with_ids(chunk, chunk_ids)
+        added += len(chunk_ids)
+    return added
+
+def publish_index(index, index_file, factory, trained_points, trained_for=None):
+    """
+    Save a newly trained index over `index_file` and bump the version in its metadata.
+
+    A newly trained index is filled from the vector store, which holds no deleted
+    listings, so the tombstone list is cleared.
+
+    :param index: The trained index
+    :param index_file: Index file name
+    :param factory: Factory string the index was built from
+    :param trained_points: Number of vectors it was trained on
+    :param trained_for: Number of listings it was sized and trained for, from which its
+                        growth is measured (defaults to `trained_points`)
+    :return: The new index version
+    """
+    save_index(index, index_file)
+    write_tombstones(index_file, [])
+    version = read_index_metadata(index_file).get('version', 0) + 1
+    write_index_metadata(
+        index_file,
+        factory=factory,
+        dimension=index.d,
+        metric='L2',
+        trained_points=trained_points,
+        trained_for=trained_for if trained_for is not None else trained_points,
+        trained_at=datetime.now().isoformat(),
+        version=version
+    )
+    logging.info(f"Index version {version} saved to {index_path(index_file)}")
+    return version
+
+def tune_index(index, index_file="faiss_index_ivfpq.bin", version=None):
+    """
+    Tune the search parameters of a populated index and record them in its metadata,
+    from where `load_index` applies them.
+
+    :param index: FAISS index holding every listing of the vector store
+    :param index_file: Index file name
+    :param version: Index version the parameters were tuned for (defaults to the current one)
+    :return: The tuned parameters, or None if the index has none to tune
+    """
+    listing_ids = live_ids(index, index_file)
+    vector_store = backfill_vector_store(index, listing_ids, index_file)
+    params, recall = tune_search_params(index, vector_store, listing_ids, excluded_ids=read_tombstones(index_file))
+    write_index_metadata(
+        index_file,
+        search_params=params,
+        tuned_recall=recall,
+        tuned_version=version if version is not None else read_index_metadata(index_file).get('version', 0)
+    )
+    return params
+
+def train_faiss_index(embeddings, index_file="faiss_index_ivfpq.bin", factory=FAISS_INDEX_FACTORY, num_points=None):
+    """
+    Build and train a FAISS index for a set of embeddings.
+
+    The index type comes from `choose_index_factory`; the factory string and training
+    details are saved in the index metadata next to the index file.
+
+    :param embeddings: numpy array of embeddings to train on (a sample of the corpus will do)
+    :param index_file: Index file name (saved in INDEX_DIR)
+    :param factory: Factory string, or 'auto' to choose one by dataset size
+    :param num_points: Size of the corpus the index will hold (defaults to len(embeddings))
+    :return: Trained, empty FAISS index that accepts listing ids
     """
     try:
-        embeddings = embeddings.astype('float32')
-        dimension = embeddings.shape[1]
-        num_points = embeddings.shape[0]
-        
-        # Validate data size
-        if num_points < 4000:
-            logging.warning(f"Small dataset ({num_points} points). Adjusting parameters.")
-            nlist = min(nlist, max(int(num_points/40), 4))
-            m = min(m, max(int(dimension/32), 4))
-        
-        logging.info(f"Training with {num_points} points, {nlist} clusters, {m} subquantizers")
-        
-        # Set up index path
-        index_path = INDEX_DIR / index_file
-        
-        # Create quantizer
-        quantizer = faiss.IndexFlatL2(dimension)
-        
-        # Create and train index
-        index = faiss.IndexIVFPQ(quantizer, dimension, nlist, m, 8)
-        
-        if not index.is_trained:
-            logging.info("Training FAISS index...")
-            index.train(embeddings)
-        
-        faiss.write_index(index, str(index_path))
-        logging.info(f"Index saved to {index_path}")
+        index, factory, trained_points = build_faiss_index(embeddings, factory, num_points)
+        publish_index(index, index_file, factory, trained_points, num_points if num_points is not None else len(embeddings))
         return index
-        
+
     except Exception as e:
         logging.error(f"Error training FAISS index: {e}")
         raise
 
-def store_embeddings_in_trained_index(embeddings, index, index_file="faiss_index_ivfpq.bin"):
+def retrain_needed(new_embeddings_count, index, index_file="faiss_index_ivfpq.bin", retrain_threshold=RETRAIN_THRESHOLD):
     """
-    Store embeddings in a trained FAISS index using IVF+PQ method.
+    Decide whether adding embeddings calls for rebuilding an index.
+
+    An index is rebuilt when the dataset grows into a different index family under the
+    factory policy (e.g. Flat -> IVF-Flat), or when an IVF index has grown by
+    `retrain_threshold` since the size it was trained for. Growth is measured against
+    that size rather than per batch, so an index trained early in a stream of small
+    batches is still retrained as the stream fills it. Nothing is rebuilt while a
+    background rebuild of the index is still pending.
 
-    :param embeddings: numpy array of embeddings
+    :param new_embeddings_count: Number of embeddings about to be added
     :param index: The trained FAISS index
-    :param index_file: Name of the file to store the FAISS index
-    :return: None
+    :param index_file: Index file name
+    :param retrain_threshold: Growth, as a fraction of the trained-for size, above which retraining occurs
+    :return: Factory string to rebuild the index as, or None if no rebuild is needed
     """
-    embeddings = embeddings.astype('float32')
-    
-    if not index.is_trained:
-        logging.error("Attempted to add embeddings to an untrained index!")
-        return
+    existing_embeddings_count = live_count(index, index_file)
+    logging.info(f"Existing embeddings: {existing_embeddings_count}, New embeddings: {new_embeddings_count}")
 
-    # Add embeddings to the trained index
-    logging.info(f"Adding {embeddings.shape[0]} embeddings to the FAISS index...")
-    index.add(embeddings)
+    metadata = read_index_metadata(index_file)
+    current_factory = metadata.get('factory', 'IVF,PQ')
+    # Indices published before the trained-for size was recorded measure growth per batch
+    trained_for = metadata.get('trained_for') or existing_embeddings_count
+    total = existing_embeddings_count + new_embeddings_count
+    target_factory = choose_index_factory(total, index.d)
+    family_changed = index_family(target_factory) != index_family(current_factory)
+    grown = _is_ivf(index) and trained_for > 0 and total >= (1 + retrain_threshold) * trained_for
 
-    # Save the index to disk
-    faiss.write_index(index, index_file)
-    logging.info(f"Embeddings have been stored in FAISS IVFPQ index: {index_file}")
+    if existing_embeddings_count == 0 or not (family_changed or grown) or retrain_pending(index_file):
+        return None
 
+    if family_changed:
+        logging.warning(f"Index outgrew {current_factory}. Rebuilding FAISS index as {target_factory}...")
+    else:
+        logging.warning("Significant new data detected. Retraining FAISS index...")
+    return target_factory
 
-def check_and_retrain_index(embeddings, index, index_file="faiss_index_ivfpq.bin", retrain_threshold=0.5):
+def check_and_retrain_index(embeddings, index, index_file="faiss_index_ivfpq.bin", retrain_threshold=RETRAIN_THRESHOLD):
     """
-    Check if retraining is needed based on the amount of new embeddings and retrain if necessary.
+    Check if retraining is needed (see `retrain_needed`) and retrain if necessary.
+
+    The retrained index is trained on a sample of the exact existing vectors from the
+    vector store and the new embeddings, then repopulated with the existing vectors, so
+    repeated retraining does not compound quantization error.
 
     :param embeddings: numpy array of new embeddings
     :param index: The trained FAISS index
     :param index_file: Path to save the updated index
-    :param retrain_threshold: Fraction of existing embeddings above which retraining occurs
+    :param retrain_threshold: Growth, as a fraction of the trained-for size, above which retraining occurs
     :return: Updated FAISS index
     """
-    existing_embeddings_count = index.ntotal  
-    new_embeddings_count = embeddings.shape[0]
+    target_factory = retrain_needed(embeddings.shape[0], index, index_file, retrain_threshold)
+    if target_factory is None:
+        return index
 
-    logging.info(f"Existing embeddings: {existing_embeddings_count}, New embeddings: {new_embeddings_count}")
+    existing_ids = live_ids(index, index_file)
+    vector_store = backfill_vector_store(index, existing_ids, index_file)
 
-    if existing_embeddings_count > 0 and (new_embeddings_count / existing_embeddings_count) >= retrain_threshold:
-        logging.warning("Significant new data detected. Retraining FAISS index...")
-        
-        all_embeddings = np.vstack((get_all_existing_embeddings(index_file), embeddings))
-        index = train_faiss_index(all_embeddings, index_file=index_file)
-        logging.info("Retraining completed.")
+    # Train on a sample split between the stored and the new embeddings in proportion
+    existing_embeddings_count, new_embeddings_count = len(existing_ids), embeddings.shape[0]
+    total = existing_embeddings_count + new_embeddings_count
+    sample_size = min(training_sample_size(target_factory), total)
+    existing_share = round(sample_size * existing_embeddings_count / total)
+    training_sample = np.vstack((
+        vector_store.sample(existing_share, vector_store.rows_of(existing_ids)),
+        embeddings[stratified_sample(new_embeddings_count, sample_size - existing_share)].astype('float32')
+    ))
+    index = train_faiss_index(training_sample, index_file=index_file, num_points=total)
+    add_from_vector_store(index, vector_store, existing_ids)
+    logging.info("Retraining completed.")
 
     return index  # Return the potentially retrained index
 
 
-def store_embeddings_in_trained_index(embeddings, index, listing_ids, index_file="faiss_index_ivfpq.bin"):
+def store_embeddings_in_trained_index(embeddings, index, listing_ids, index_file="faiss_index_ivfpq.bin", tracker=None, persist=True, background=RETRAIN_IN_BACKGROUND):
     """
-    Store embeddings in a trained FAISS index.
+    Store embeddings in a trained FAISS index under their listing ids.
+
+    Listings that are already indexed have their old vector replaced, so the same
+    call handles both new and re-embedded (updated) listings.
 
     :param embeddings: numpy array of new embeddings
     :param index: The trained FAISS index
-    :param index_file: Path to save the updated index
-    :return: None
+    :param listing_ids: Listing ids matching the rows of `embeddings`
+    :param index_file: Index file name (saved in INDEX_DIR)
+    :param tracker: ListingsTracker to record stored listings in (loaded from disk if omitted)
+    :param persist: Write the index and tracker to disk; callers adding many batches
+                    can defer this and save once at the end
+    :param background: Rebuild the index on a worker thread when it needs retraining, and
+                       keep using the current one until `adopt_retrained_index` swaps it in
+    :return: The updated (possibly retrained) index on success, None otherwise
     """
     try:
-        tracker = ListingsTracker()
+        tracker = tracker or ListingsTracker()
         embeddings = embeddings.astype('float32')
+        listing_ids = np.asarray(listing_ids, dtype='int64')
 
         if not index.is_trained:
             logging.error("Attempted to add embeddings to an untrained index!")
             return
 
-        # Get current position before adding
-        current_position = index.ntotal
+        index = with_listing_ids(index)
+        # Switch to an index rebuilt in the background, if one has finished
+        index = adopt_retrained_index(index, index_file)
 
-        # First, check if retraining is needed
-        index = check_and_retrain_index(embeddings, index, index_file)
+        # Drop the stale vectors of listings being re-embedded; only those already indexed
+        # (tracked, stored or tombstoned) have one, so new listings cost no removal
+        vector_store = get_vector_store(index_file)
+        indexed = np.array([tracker.contains(listing_id) or listing_id in vector_store for listing_id in listing_ids.tolist()], dtype=bool)
+        stale = listing_ids[indexed | np.isin(listing_ids, read_tombstones(index_file))]
+        replaced = remove_vectors(index, stale, index_file) if len(stale) else 0
+        if replaced:
+            logging.info(f"Replacing {replaced} existing embeddings")
+        # Listings published again are no longer deleted
+        tombstones = read_tombstones(index_file)
+        if len(tombstones) and np.isin(listing_ids, tombstones).any():
+            write_tombstones(index_file, np.setdiff1d(tombstones, listing_ids))
+
+        # First, check if retraining is needed. A background rebuild only starts once this
+        # batch is in the vector store, so it is sized for and trained on the batch too
+        retrain_in_background = background and retrain_needed(embeddings.shape[0], index, index_file) is not None
+        if not background:
+            index = check_and_retrain_index(embeddings, index, index_file)
 
         logging.info(f"Adding {embeddings.shape[0]} embeddings to FAISS index...")
-        index.add(embeddings)
-
-        # Create position mappings after successful addition
-        position_map = {
-            listing_id: current_position + idx 
-            for idx, listing_id in enumerate(listing_ids)
-        }
-        
-        # Update tracker with new mappings
-        tracker.add_mappings(position_map)
-
-        faiss.write_index(index, index_file)
-        logging.info(f"Updated FAISS index stored at {index_file}")
-        logging.info(f"Added {len(listing_ids)} listings to position mapping")
-        return True
+        index.add_with_ids(embeddings, listing_ids)
+        vector_store.append(listing_ids, embeddings)
+
+        if retrain_in_background:
+            # The worker reads the vector store, which must hold every indexed listing
+            backfill_vector_store(index, live_ids(index, index_file), index_file)
+            start_background_retrain(index_file)
+
+        # Tune the search parameters once per trained index version
+        metadata = read_index_metadata(index_file)
+        if metadata.get('tuned_version') != metadata.get('version', 0):
+            tune_index(index, index_file)
+
+        # Record the stored listings after successful addition
+        tracker.add_listings(listing_ids, save=persist)
+
+        if persist:
+            save_index(index, index_file)
+            logging.info(f"Updated FAISS index stored at {index_path(index_file)}")
+        logging.info(f"Added {len(listing_ids)} listings to FAISS index")
+        return index
     
     except Exception as e:
         logging.error(f"Error storing embeddings: {e}")
-        return False
+        return None
+
+
+def remove_listings_from_index(index, listing_ids, index_file="faiss_index_ivfpq.bin", tracker=None):
+    """
+    Delete listings (e.g. no longer Published) from a FAISS index.
 
+    Deleted listings are tombstoned rather than removed: searches filter them out inside
+    FAISS (see `search_parameters`), so a deletion only rewrites the small tombstone list
+    and not the index. Once the tombstones exceed TOMBSTONE_COMPACT_FRACTION of the
+    index, `compact_index` removes them physically.
+
+    :param index: The FAISS index
+    :param listing_ids: Listing ids to remove
+    :param index_file: Index file name (saved in INDEX_DIR)
+    :param tracker: ListingsTracker recording the stored listings (loaded from disk if omitted)
+    :return: Number of listings deleted
+    """
+    tracker = tracker or ListingsTracker()
+    removed_ids = np.asarray(tracker.remove_listings(listing_ids), dtype='int64')
+    if not len(removed_ids):
+        return 0
+
+    get_vector_store(index_file).delete(removed_ids)
+    tombstones = write_tombstones(index_file, np.concatenate((read_tombstones(index_file), removed_ids)))
+    logging.info(f"Tombstoned {len(removed_ids)} listings in {index_path(index_file)} ({len(tombstones)} in total)")
+
+    if len(tombstones) > TOMBSTONE_COMPACT_FRACTION * index.ntotal:
+        compact_index(index, index_file)
+
+    return len(removed_ids)
+
+def refill_index(index, listing_ids, index_file="faiss_index_ivfpq.bin"):
+    """
+    Empty an index and refill it with listings from the vector store, clearing its
+    tombstones (the way to drop vectors from indices that cannot remove them, e.g. HNSW).
+
+    :param index: The FAISS index, refilled in place
+    :param listing_ids: Listing ids to keep
+    :param index_file: Index file name, which names the vector store
+    :return: Number of vectors in the refilled index
+    """
+    vector_store = backfill_vector_store(index, listing_ids, index_file)
+    index.reset()
+    added = add_from_vector_store(index, vector_store, listing_ids)
+    write_tombstones(index_file, [])
+    return added
+
+def remove_vectors(index, listing_ids, index_file="faiss_index_ivfpq.bin"):
+    """
+    Physically remove the vectors of listings from an index.
+
+    Indices that cannot remove vectors (HNSW) are refilled from the vector store without
+    them instead, which rebuilds the whole index.
+
+    :param index: The FAISS index, modified in place
+    :param listing_ids: Listing ids to remove
+    :param index_file: Index file name, which names the vector store
+    :return: Number of vectors removed
+    """
+    listing_ids = np.asarray(listing_ids, dtype='int64')
+    try:
+        return index.remove_ids(listing_ids)
+    except RuntimeError:
+        logging.info("Index cannot remove vectors; refilling it from the vector store")
+        previous_total = index.ntotal
+        return previous_total - refill_index(index, np.setdiff1d(live_ids(index, index_file), listing_ids), index_file)
+
+def compact_index(index, index_file="faiss_index_ivfpq.bin"):
+    """
+    Physically remove tombstoned listings from an index and clear its tombstone list.
+
+    :param index: The FAISS index, compacted in place
+    :param index_file: Index file name (saved in INDEX_DIR)
+    :return: Number of vectors removed
+    """
+    tombstones = read_tombstones(index_file)
+    if not len(tombstones):
+        return 0
 
+    removed = remove_vectors(index, tombstones, index_file)
+    save_index(index, index_file)
+    write_tombstones(index_file, [])
+    logging.info(f"Compacted {removed} tombstoned listings out of {index_path(index_file)}")
+    return removed
@@ -0,0 +1,140 @@
+import time
+import logging
+import faiss
+import numpy as np
+from config import SEARCH_RECALL_TARGET, SEARCH_TUNE_K, SEARCH_TUNE_QUERIES, INDEX_ADD_CHUNK
+
+# Values tried for each search parameter, cheapest first
+NPROBE_CANDIDATES = [1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048]
+EF_SEARCH_CANDIDATES = [16, 24, 32, 48, 64, 96, 128, 192, 256, 384, 512]
+
+def tunable_parameter(index):
+    """
+    The search parameter trading speed for recall in an index.
+
+    :return: Tuple of (parameter name, candidate values), or None for exhaustive indices
+    """
+    try:
+        nlist = faiss.extract_index_ivf(index).nlist
+        return 'nprobe', [nprobe for nprobe in NPROBE_CANDIDATES if nprobe < nlist] + [nlist]
+    except RuntimeError:
+        pass
+    if 'HNSW' in type(faiss.downcast_index(getattr(index, 'index', index))).__name__:
+        return 'efSearch', EF_SEARCH_CANDIDATES
+    return None
+
+def apply_search_params(index, params):
+    """Set search parameters (e.g. {'nprobe': 16}) on an index, through any IDMap/OPQ wrappers"""
+    parameter_space = faiss.ParameterSpace()
+    for name, value in (params or {}).items():
+        parameter_space.set_index_parameter(index, name, value)
+
+def excluding_selector(listing_ids):
+    """
+    FAISS id selector accepting every id except `listing_ids`, backed by a bitmap over ids.
+
+    The bitmap lives as long as the returned selector, which references it.
+    """
+    listing_ids = np.asarray(listing_ids, dtype='int64')
+    bitmap = np.zeros(int(listing_ids.max()) // 8 + 1, dtype='uint8')
+    np.bitwise_or.at(bitmap, listing_ids >> 3, (1 << (listing_ids & 7)).astype('uint8'))
+    excluded = faiss.IDSelectorBitmap(len(bitmap) * 8, faiss.swig_ptr(bitmap))
+    selector = faiss.IDSelectorNot(excluded)
+    selector.referenced_objects = [excluded, bitmap]
+    return selector
+
+def search_parameters(index, excluded_ids):
+    """
+    Per-search parameters that filter `excluded_ids` out inside FAISS.
+
+    The index's own nprobe / efSearch are carried over, since search parameters replace
+    them for the call.
+
+    :param index: FAISS index to be searched
+    :param excluded_ids: Listing ids that must not be returned
+    :return: SearchParameters to pass to `index.search`, or None if nothing is excluded
+    """
+    if not len(excluded_ids):
+        return None
+    selector = excluding_selector(excluded_ids)
+
+    tunable = tunable_parameter(index)
+    if tunable is not None and tunable[0] == 'nprobe':
+        params = faiss.SearchParametersIVF(sel=selector, nprobe=faiss.extract_index_ivf(index).nprobe)
+    elif tunable is not None:
+        hnsw_index = faiss.downcast_index(getattr(index, 'index', index))
+        params = faiss.SearchParametersHNSW(sel=selector, efSearch=hnsw_index.hnsw.efSearch)
+    else:
+        params = faiss.SearchParameters(sel=selector)
+    params.referenced_objects = [selector]
+    return params
+
+def tune_search_params(index, vector_store, listing_ids=None, rows=None, k=SEARCH_TUNE_K, recall_target=SEARCH_RECALL_TARGET,
+                       query_count=SEARCH_TUNE_QUERIES, excluded_ids=(), chunk_size=INDEX_ADD_CHUNK, seed=0):
+    """
+    Find the cheapest search parameters that reach a recall@k target.
+
+    A sample of the stored vectors is used as queries. Each is compared against exact
+    neighbours over all stored vectors, ignoring the query's own listing so it does not
+    count as a free hit. Candidate values are tried in increasing cost order and the
+    first that reaches `recall_target` is applied; if none does, the most thorough one is.
+    The exact neighbours are found a chunk of the vector store at a time, so memory does
+    not grow with the catalogue.
+
+    :param index: Populated FAISS index keyed by listing id
+    :param vector_store: VectorStore holding the exact vectors of every listing in the index
+    :param listing_ids: Listing ids in the index (defaults to every live listing of the store)
+    :param rows: Vector store rows of `listing_ids`, e.g. from a snapshot
+    :param k: Neighbours per query
+    :param recall_target: Required recall@k
+    :param query_count: Number of stored vectors used as queries
+    :param excluded_ids: Tombstoned listing ids still in the index, filtered out as in searches
+    :param chunk_size: Stored vectors compared against the queries at a time
+    :return: Tuple of ({parameter: value}, measured recall), or (None, None) if nothing is tunable
+    """
+    if listing_ids is None:
+        listing_ids, rows = vector_store.live_rows()
+    elif rows is None:
+        rows = vector_store.rows_of(listing_ids)
+    listing_ids = np.asarray(listing_ids, dtype='int64')
+
+    tunable = tunable_parameter(index)
+    if tunable is None or len(listing_ids) <= k + 1:
+        return None, None
+    name, candidates = tunable
+
+    start = time.perf_counter()
+    rng = np.random.default_rng(seed)
+    sample = np.sort(rng.choice(len(listing_ids), size=min(query_count, len(listing_ids)), replace=False))
+    queries = vector_store.read_rows(rows[sample])
+    query_ids = listing_ids[sample]
+
+    # Exact neighbours, one extra for the query itself
+    heap = faiss.ResultHeap(len(queries), k + 1)
+    for chunk_ids, chunk in vector_store.iter_chunks(chunk_size, listing_ids, rows):
+        distances, positions = faiss.knn(queries, chunk, min(k + 1, len(chunk)))
+        heap.add_result(distances, chunk_ids[positions])
+    heap.finalize()
+    truth = heap.I
+
+    def recall(found):
+        hits = 0
+        for query_id, row_found, row_truth in zip(query_ids, found, truth):
+            expected = [listing_id for listing_id in row_truth if listing_id != query_id][:k]
+            hits += len(set(expected) & set(listing_id for listing_id in row_found if listing_id != query_id))
+        return hits / (len(queries) * k)
+
+    best = None
+    for value in candidates:
+        apply_search_params(index, {name: value})
+        _, found = index.search(queries, k + 1, params=search_parameters(index, excluded_ids))
+        best = ({name: value}, recall(found))
+        if best[1] >= recall_target:
+            break
+
+    apply_search_params(index, best[0])
+    logging.info(
+        f"Tuned {name}={best[0][name]} for recall@{k} {best[1]:.3f} (target {recall_target}) "
+        f"in {time.perf_counter() - start:.2f}s"
+    )
+    return best
@@ -0,0 +1,196 @@
+import re
+import json
+import logging
+import numpy as np
+from pathlib import Path
+from config import SHARD_KEY
+from handlers.listings_tracker.tracker import ListingsTracker
+from handlers.embeddings_storage.embeddings_storage import (
+    INDEX_DIR, index_path, load_index, save_index, train_faiss_index, live_count,
+    store_embeddings_in_trained_index, remove_listings_from_index
+)
+from handlers.embeddings_storage.background_retrain import adopt_retrained_index
+
+def shard_fields(shard_key=SHARD_KEY):
+    """Listing columns that make up the shard key, e.g. 'category,county' -> ['category', 'county']"""
+    return [field.strip() for field in shard_key.split(',') if field.strip()]
+
+def shard_name(listing, shard_key=SHARD_KEY):
+    """
+    Shard of a listing, e.g. 'rent-nairobi-county' for category 'Rent' and county 'Nairobi County'.
+
+    :param listing: Listing dictionary (or any mapping holding the shard key columns)
+    :param shard_key: Comma-separated listing columns to shard by
+    :return: Shard name, safe to use in file names
+    """
+    values = [str(listing.get(field) or 'unknown') for field in shard_fields(shard_key)]
+    return re.sub(r'[^a-z0-9]+', '-', '-'.join(values).lower()).strip('-') or 'unknown'
+
+def listing_shards(listings, listing_ids, shard_key=SHARD_KEY):
+    """Shard names of `listing_ids`, looked up in the fetched `listings`"""
+    shards = {listing['id']: shard_name(listing, shard_key) for listing in listings}
+    return np.array([shards[int(listing_id)] for listing_id in listing_ids], dtype=object)
+
+def shard_index_file(index_file, shard):
+    """Index file name of one shard, e.g. faiss_index_ivfpq.rent-nairobi-county.bin"""
+    path = Path(index_file)
+    return f"{path.stem}.{shard}{path.suffix}"
+
+class ShardedIndex:
+    """
+    A set of FAISS indices, one per shard, that together hold every listing.
+
+    Each shard is an ordinary index file with its own vector store, metadata and
+    retraining, so an update only rewrites the shards it touches. A manifest next to the
+    shard files records the shard key and which shard every listing is stored in.
+    """
+
+    def __init__(self, index_file="faiss_index_ivfpq.bin", tracker=None, shard_key=SHARD_KEY):
+        self.index_file = index_file
+        self.tracker = tracker or ListingsTracker()
+        self.shard_key = shard_key
+        self.manifest_file = INDEX_DIR / f"{Path(index_file).stem}-shards.json"
+        self.listings = {}  # listing_id -> shard
+        self.indices = {}  # shard -> loaded index
+        self.load_manifest()
+
+    def load_manifest(self):
+        if not self.manifest_file.exists():
+            return
+        with open(self.manifest_file, 'r') as f:
+            manifest = json.load(f)
+        if manifest.get('shard_key') != self.shard_key:
+            raise ValueError(
+                f"{self.manifest_file} is sharded by '{manifest.get('shard_key')}', not '{self.shard_key}'; "
+                f"rebuild the shards to change the shard key."
+            )
+        self.listings = {int(listing_id): shard for listing_id, shard in manifest['listings'].items()}
+        logging.info(f"Loaded shard manifest with {len(self.shards())} shards and {len(self.listings)} listings")
+
+    def save_manifest(self):
+        with open(self.manifest_file, 'w') as f:
+            json.dump({'shard_key': self.shard_key, 'listings': self.listings}, f)
+
+    def shards(self):
+        """Names of the shards holding listings"""
+        return sorted(set(self.listings.values()))
+
+    def shard_file(self, shard):
+        return shard_index_file(self.index_file, shard)
+
+    def index(self, shard, embeddings=None):
+        """Load a shard's index, training a new one on `embeddings` if the shard has none yet"""
+        if shard not in self.indices:
+            if index_path(self.shard_file(shard)).exists():
+                self.indices[shard] = load_index(self.shard_file(shard))
+            elif embeddings is not None:
+                self.indices[shard] = train_faiss_index(embeddings, index_file=self.shard_file(shard))
+            else:
+                return None
+        return self.indices[shard]
+
+    @property
+    def ntotal(self):
+        """Number of listings across all shards"""
+        return len(self.listings)
+
+    def store(self, embeddings, listing_ids, shards, persist=True):
+        """
+        Store embeddings in their listings' shards, replacing earlier vectors.
+
+        A listing whose shard changed (e.g. it moved county) is removed from its old shard.
+
+        :param embeddings: numpy array of embeddings
+        :param listing_ids: Listing ids matching the rows of `embeddings`
+        :param shards: Shard name of each listing (see `listing_shards`)
+        :param persist: Write the touched shards, manifest and tracker to disk
+        """
+        listing_ids = np.asarray(listing_ids, dtype='int64')
+        shards = np.asarray(shards, dtype=object)
+
+        moved = {}
+        for listing_id, shard in zip(listing_ids.tolist(), shards):
+            previous = self.listings.get(listing_id)
+            if previous is not None and previous != shard:
+                moved.setdefault(previous, []).append(listing_id)
+        for previous, moved_ids in moved.items():
+            remove_listings_from_index(self.index(previous), moved_ids, self.shard_file(previous), tracker=self.tracker)
+            logging.info(f"Moved {len(moved_ids)} listings out of shard {previous}")
+
+        for shard in sorted(set(shards)):
+            mask = shards == shard
+            index = self.index(shard, embeddings[mask])
+            index = store_embeddings_in_trained_index(
+                embeddings[mask], index, listing_ids[mask], self.shard_file(shard), tracker=self.tracker, persist=persist
+            )
+            if index is None:
+                raise RuntimeError(f"Failed to store embeddings in shard {shard}.")
+            self.indices[shard] = index
+            self.listings.update((listing_id, shard) for listing_id in listing_ids[mask].tolist())
+
+        if persist:
+            self.save_manifest()
+        logging.info(f"Stored {len(listing_ids)} listings in {len(set(shards))} shards")
+
+    def remove(self, listing_ids):
+        """
+        Remove listings from the shards holding them.
+
+        :return: Number of vectors removed
+        """
+        by_shard = {}
+        for listing_id in listing_ids:
+            shard = self.listings.pop(int(listing_id), None)
+            if shard is not None:
+                by_shard.setdefault(shard, []).append(int(listing_id))
+
+        removed = sum(
+            remove_listings_from_index(self.index(shard), shard_ids, self.shard_file(shard), tracker=self.tracker)
+            for shard, shard_ids in by_shard.items()
+        )
+        self.save_manifest()
+        return removed
+
+    def save(self):
+        """Write every loaded shard (once any pending rebuild of it is swapped in), the manifest and the tracker"""
+        for shard, index in self.indices.items():
+            self.indices[shard] = adopt_retrained_index(index, self.shard_file(shard), wait=True)
+            save_index(self.indices[shard], self.shard_file(shard))
+        self.save_manifest()
+        self.tracker.save_mappings()
+
+    def verify(self, sample):
+        """
+        Check the shards on disk hold every tracked listing and can be searched.
+
+        :param sample: An embedding to search for
+        """
+        stored = 0
+        for shard in self.shards():
+            loaded_index = load_index(self.shard_file(shard), read_only=True)
+            loaded_index.search(np.array([sample], dtype='float32'), k=1)
+            stored += live_count(loaded_index, self.shard_file(shard))
+        if stored != self.tracker.total_embeddings:
+            raise ValueError(f"Shards hold {stored} vectors but {self.tracker.total_embeddings} listings are tracked.")
+        logging.info(f"Verified {stored} vectors across {len(self.shards())} shards")
+
+def store_in_shards(embeddings, listing_ids, listings, index_file="faiss_index_ivfpq.bin", tracker=None):
+    """
+    Store embeddings in their shards and verify the result (the sharded counterpart of the
+    pipelines' load, store and verify steps).
+
+    :param embeddings: numpy array of embeddings
+    :param listing_ids: Listing ids matching the rows of `embeddings`
+    :param listings: Fetched listing dictionaries, used to look up each listing's shard
+    :param index_file: Base index file name the shard files are named after
+    :param tracker: ListingsTracker recording the stored listings
+    :return: True on success, None otherwise
+    """
+    try:
+        sharded = ShardedIndex(index_file, tracker)
+        sharded.store(embeddings, listing_ids, listing_shards(listings, listing_ids))
+        sharded.verify(embeddings[0])
+        return True
+    except Exception as e:
+        logging.error(f"Error storing embeddings in shards: {e}")
+        return None
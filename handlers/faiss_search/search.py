@@ -0,0 +1,116 @@
+import heapq
+import logging
+import numpy as np
+from operator import itemgetter
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+from config import SEARCH_RERANK_FACTOR, SEARCH_MMAP, SHARD_SEARCH_WORKERS
+from handlers.embeddings_generation.generate_embeddings import encode_narratives
+from handlers.embeddings_storage.embeddings_storage import load_index, read_tombstones
+from handlers.embeddings_storage.search_tuning import search_parameters
+from handlers.embeddings_storage.sharding import ShardedIndex
+from handlers.vector_store.vector_store import get_vector_store
+
+def rerank(query, candidate_ids, vector_store, k):
+    """
+    Order candidate listings by exact squared L2 distance to the query.
+
+    :param query: 1-D query embedding
+    :param candidate_ids: Candidate listing ids from the index
+    :param vector_store: VectorStore holding the candidates' exact vectors
+    :param k: Number of listings to keep
+    :return: List of (listing_id, distance) tuples, or None if a candidate has no stored vector
+    """
+    candidate_ids = [int(listing_id) for listing_id in candidate_ids if listing_id != -1]
+    if not all(listing_id in vector_store for listing_id in candidate_ids):
+        return None
+
+    vectors = vector_store.get(candidate_ids)
+    distances = ((vectors - query) ** 2).sum(axis=1)
+    order = np.argsort(distances, kind='stable')[:k]
+    return [(candidate_ids[i], float(distances[i])) for i in order]
+
+def search_listings(query, k=10, index=None, index_file="faiss_index_ivfpq.bin", rerank_factor=SEARCH_RERANK_FACTOR):
+    """
+    Find the listings closest to a query.
+
+    The index stores listing ids as its ids, so results need no id translation. With a
+    rerank factor above 1, `k * rerank_factor` candidates are taken from the (compressed)
+    index and reranked by exact distance using the vectors in the index's vector store.
+    Deleted listings still in the index are excluded by an id selector inside FAISS, so
+    they never take up candidate slots.
+
+    :param query: Query text, a single embedding, or a 2-D array of embeddings
+    :param k: Number of listings to return per query
+    :param index: Loaded FAISS index (read from `index_file` if omitted, memory-mapped
+                  read-only when SEARCH_MMAP is set)
+    :param index_file: Index file name in INDEX_DIR
+    :param rerank_factor: Candidates fetched per result for exact reranking (1 = no reranking)
+    :return: List of (listing_id, distance) tuples, or one such list per row for a 2-D query
+    """
+    index = index if index is not None else load_index(index_file, read_only=SEARCH_MMAP)
+
+    if isinstance(query, str):
+        queries = encode_narratives([query])
+    else:
+        queries = np.asarray(query, dtype='float32')
+    single = queries.ndim == 1 or isinstance(query, str)
+    queries = queries.reshape(-1, index.d)
+
+    candidates = k * rerank_factor if rerank_factor > 1 else k
+    params = search_parameters(index, read_tombstones(index_file))
+    distances, listing_ids = index.search(queries, candidates, params=params)
+    vector_store = get_vector_store(index_file) if candidates > k else None
+
+    results = []
+    for query_vector, row_ids, row_distances in zip(queries, listing_ids, distances):
+        reranked = rerank(query_vector, row_ids, vector_store, k) if vector_store is not None else None
+        if reranked is None:
+            reranked = [
+                (int(listing_id), float(distance)) for listing_id, distance in zip(row_ids, row_distances) if listing_id != -1
+            ][:k]
+        results.append(reranked)
+
+    logging.info(f"Searched {len(queries)} queries for the top {k} listings")
+    return results[0] if single else results
+
+def search_shards(query, k=10, shards=None, index_file="faiss_index_ivfpq.bin", rerank_factor=SEARCH_RERANK_FACTOR, workers=SHARD_SEARCH_WORKERS):
+    """
+    Find the listings closest to a query across the shards of a sharded index.
+
+    The selected shards are searched in parallel (FAISS releases the GIL while searching)
+    and their per-shard top-k lists, each sorted by distance, are k-way merged.
+
+    :param query: Query text, a single embedding, or a 2-D array of embeddings
+    :param k: Number of listings to return per query
+    :param shards: Shard names to search (e.g. [shard_name({'category': 'Rent', 'county': 'Nairobi County'})]),
+                   or None for every shard
+    :param index_file: Base index file name the shard files are named after
+    :param rerank_factor: Candidates fetched per result for exact reranking (1 = no reranking)
+    :param workers: Maximum number of shards searched at once
+    :return: List of (listing_id, distance) tuples, or one such list per row for a 2-D query
+    """
+    sharded = ShardedIndex(index_file)
+    available = set(sharded.shards())
+    selected = [shard for shard in (shards or sharded.shards()) if shard in available]
+
+    # Encode a text query once rather than once per shard
+    queries = encode_narratives([query]) if isinstance(query, str) else np.asarray(query, dtype='float32')
+    single = queries.ndim == 1 or isinstance(query, str)
+    queries = queries.reshape(len(queries) if queries.ndim > 1 else 1, -1)
+
+    if not selected:
+        return [] if single else [[] for _ in queries]
+
+    def search_shard(shard):
+        return search_listings(queries, k, index_file=sharded.shard_file(shard), rerank_factor=rerank_factor)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(selected)))) as pool:
+        shard_results = list(pool.map(search_shard, selected))
+
+    results = [
+        list(islice(heapq.merge(*(shard_result[row] for shard_result in shard_results), key=itemgetter(1)), k))
+        for row in range(len(queries))
+    ]
+    logging.info(f"Searched {len(selected)} shards for the top {k} listings")
+    return results[0] if single else results
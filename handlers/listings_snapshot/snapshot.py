@@ -0,0 +1,253 @@
+import os
+import json
+import shutil
+import hashlib
+import logging
+import datetime
+import decimal
+import numpy as np
+from pathlib import Path
+from config import SNAPSHOT_KEEP, SNAPSHOT_OFFLINE, FETCH_CLIENT_AMENITIES
+from handlers.mysql_data_fetch.connection_pool import get_connection
+from handlers.data_handling.data_handling import narrative_hash
+
+# Create snapshot directory
+SNAPSHOT_DIR = Path("storage/snapshots")
+SNAPSHOT_DIR.mkdir(parents=True, exist_ok=True)
+LATEST_FILE = SNAPSHOT_DIR / "latest.json"
+
+# Cheap aggregates that change whenever the published catalogue or its amenities change
+SNAPSHOT_KEY_QUERY = """
+    SELECT
+        (SELECT COUNT(*) FROM listings_datasets WHERE status = 'Published'),
+        (SELECT MAX(id) FROM listings_datasets WHERE status = 'Published'),
+        (SELECT MAX(updated_at) FROM listings_datasets),
+        (SELECT COUNT(*) FROM amenities_dataset),
+        (SELECT MAX(updated_at) FROM amenities_dataset);
+"""
+
+# Column type tags -> (encode to text, decode from text) for columns stored as UTF-8 buffers
+TEXT_CODECS = {
+    'str': (str, str),
+    'decimal': (str, decimal.Decimal),
+    'datetime': (datetime.datetime.isoformat, datetime.datetime.fromisoformat),
+    'date': (datetime.date.isoformat, datetime.date.fromisoformat),
+    'json': (json.dumps, json.loads),
+}
+TYPE_TAGS = {
+    int: 'int',
+    float: 'float',
+    str: 'str',
+    bytes: 'bytes',
+    decimal.Decimal: 'decimal',
+    datetime.datetime: 'datetime',
+    datetime.date: 'date',
+    dict: 'json',
+    list: 'json',
+}
+
+def snapshot_key(client_amenities=False):
+    """
+    Compute the snapshot key for the current state of the catalogue.
+
+    :param client_amenities: Fetch mode the snapshot was built with (changes the amenities shape)
+    :return: Hex digest identifying the catalogue version
+    """
+    with get_connection() as mysql_conn:
+        with mysql_conn.cursor() as cursor:
+            cursor.execute(SNAPSHOT_KEY_QUERY)
+            watermark = cursor.fetchone()
+
+    payload = repr((watermark, bool(client_amenities))).encode('utf-8')
+    return hashlib.sha1(payload).hexdigest()
+
+def _column_tag(values):
+    """Pick the storage type tag of a column from its non-null values"""
+    tags = {TYPE_TAGS.get(type(value), 'str') for value in values if value is not None}
+    if len(tags) == 1:
+        return tags.pop()
+    return 'str' if tags else 'int'
+
+def _write_column(column_dir, name, values):
+    """Write one column as .npy arrays (numeric array, or UTF-8 buffer + offsets) plus a null mask"""
+    tag = _column_tag(values)
+    nulls = np.array([value is None for value in values], dtype=bool)
+    np.save(column_dir / f"{name}.nulls.npy", nulls)
+
+    if tag in ('int', 'float'):
+        dtype = np.int64 if tag == 'int' else np.float64
+        data = np.array([0 if value is None else value for value in values], dtype=dtype)
+        np.save(column_dir / f"{name}.data.npy", data)
+        return tag
+
+    encode = TEXT_CODECS[tag][0] if tag != 'bytes' else bytes
+    encoded = [b'' if value is None else (value if tag == 'bytes' else encode(value).encode('utf-8')) for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(item) for item in encoded], out=offsets[1:])
+    np.save(column_dir / f"{name}.data.npy", np.frombuffer(b''.join(encoded), dtype=np.uint8))
+    np.save(column_dir / f"{name}.offsets.npy", offsets)
+    return tag
+
+def write_snapshot(listings, key, narratives=None):
+    """
+    Write fetched listings to a columnar snapshot directory keyed by `key`.
+
+    Each column is stored as uncompressed .npy arrays so it can be memory-mapped on
+    read; text is packed into one UTF-8 buffer with offsets rather than padded.
+
+    :param listings: List of listing dictionaries
+    :param key: Snapshot key from `snapshot_key`
+    :param narratives: Optional list of (listing_id, narrative, hash) tuples stored alongside
+    :return: Path of the snapshot directory
+    """
+    snapshot_path = SNAPSHOT_DIR / key
+    temp_path = SNAPSHOT_DIR / f".{key}.tmp"
+    shutil.rmtree(temp_path, ignore_errors=True)
+    temp_path.mkdir(parents=True)
+
+    try:
+        column_names = list(listings[0].keys()) if listings else []
+        columns = {name: [listing.get(name) for listing in listings] for name in column_names}
+        if narratives is not None:
+            columns['narrative'] = [narrative[1] for narrative in narratives]
+
+        tags = {name: _write_column(temp_path, name, values) for name, values in columns.items()}
+
+        with open(temp_path / "manifest.json", 'w') as f:
+            json.dump({
+                'key': key,
+                'rows': len(listings),
+                'columns': tags,
+                'created_at': datetime.datetime.now().isoformat()
+            }, f)
+
+        # Publish atomically so readers never see a half-written snapshot
+        shutil.rmtree(snapshot_path, ignore_errors=True)
+        os.replace(temp_path, snapshot_path)
+        with open(LATEST_FILE, 'w') as f:
+            json.dump({'key': key}, f)
+
+        logging.info(f"Wrote snapshot of {len(listings)} listings to {snapshot_path}")
+        prune_snapshots()
+        return snapshot_path
+
+    except Exception as e:
+        shutil.rmtree(temp_path, ignore_errors=True)
+        logging.error(f"Error writing listings snapshot: {e}")
+        raise
+
+def prune_snapshots(keep=SNAPSHOT_KEEP):
+    """Delete all but the `keep` most recent snapshots"""
+    snapshots = sorted(
+        (path for path in SNAPSHOT_DIR.iterdir() if path.is_dir() and not path.name.startswith('.')),
+        key=lambda path: path.stat().st_mtime,
+        reverse=True
+    )
+    for path in snapshots[keep:]:
+        shutil.rmtree(path, ignore_errors=True)
+        logging.info(f"Removed old snapshot {path}")
+
+def _load_array(path):
+    """Memory-map a .npy file (empty arrays cannot be mapped and are read normally)"""
+    try:
+        return np.load(path, mmap_mode='r')
+    except ValueError:
+        return np.load(path)
+
+class ListingsSnapshot:
+    """Read-only, memory-mapped view of a listings snapshot"""
+
+    def __init__(self, snapshot_path):
+        self.path = Path(snapshot_path)
+        with open(self.path / "manifest.json", 'r') as f:
+            manifest = json.load(f)
+        self.key = manifest['key']
+        self.rows = manifest['rows']
+        self.tags = manifest['columns']
+
+    def __len__(self):
+        return self.rows
+
+    def has_column(self, name):
+        return name in self.tags
+
+    def column(self, name, start=0, stop=None):
+        """Decode rows [start, stop) of a column into Python values"""
+        stop = self.rows if stop is None else min(stop, self.rows)
+        tag = self.tags[name]
+        nulls = _load_array(self.path / f"{name}.nulls.npy")[start:stop].tolist()
+        data = _load_array(self.path / f"{name}.data.npy")
+
+        if tag in ('int', 'float'):
+            values = data[start:stop].tolist()
+            return [None if is_null else value for value, is_null in zip(values, nulls)]
+
+        offsets = _load_array(self.path / f"{name}.offsets.npy")
+        buffer = data[offsets[start]:offsets[stop]].tobytes()
+        bounds = (offsets[start:stop + 1] - offsets[start]).tolist()
+
+        if tag == 'bytes':
+            decode = bytes
+        else:
+            text_decode = TEXT_CODECS[tag][1]
+            decode = lambda raw: text_decode(raw.decode('utf-8'))
+
+        return [
+            None if nulls[i] else decode(buffer[bounds[i]:bounds[i + 1]])
+            for i in range(len(nulls))
+        ]
+
+    def to_listings(self, start=0, stop=None):
+        """Rebuild listing dictionaries for rows [start, stop)"""
+        names = [name for name in self.tags if name != 'narrative']
+        columns = [self.column(name, start, stop) for name in names]
+        return [dict(zip(names, row)) for row in zip(*columns)]
+
+    def narratives(self):
+        """Return stored (listing_id, narrative, hash) tuples, or None if none were stored"""
+        if not self.has_column('narrative'):
+            return None
+        texts = self.column('narrative')
+        return list(zip(self.column('id'), texts, map(narrative_hash, texts)))
+
+def load_snapshot(key=None):
+    """
+    Load a snapshot by key, or the most recently written one when `key` is None.
+
+    :return: ListingsSnapshot, or None if no matching snapshot exists
+    """
+    try:
+        if key is None:
+            if not LATEST_FILE.exists():
+                return None
+            with open(LATEST_FILE, 'r') as f:
+                key = json.load(f)['key']
+
+        snapshot_path = SNAPSHOT_DIR / key
+        if not (snapshot_path / "manifest.json").exists():
+            return None
+
+        snapshot = ListingsSnapshot(snapshot_path)
+        logging.info(f"Loaded snapshot of {len(snapshot)} listings from {snapshot_path}")
+        return snapshot
+
+    except Exception as e:
+        logging.error(f"Error loading listings snapshot: {e}")
+        return None
+
+def load_fresh_snapshot(offline=SNAPSHOT_OFFLINE, client_amenities=FETCH_CLIENT_AMENITIES):
+    """
+    Load the snapshot matching the current catalogue.
+
+    :param offline: Use the latest snapshot without querying MySQL for its key
+    :param client_amenities: Fetch mode the snapshot must have been built with
+    :return: Tuple of (ListingsSnapshot or None, key to write a new snapshot under or None)
+    """
+    if offline:
+        snapshot = load_snapshot()
+        if snapshot is not None:
+            return snapshot, snapshot.key
+        logging.warning("No snapshot available for offline use; falling back to MySQL.")
+
+    key = snapshot_key(client_amenities)
+    return load_snapshot(key), key
@@ -2,69 +2,153 @@ import json
 import datetime
 import logging
 from pathlib import Path
+from config import REFRESH_OVERLAP_SECONDS
 
 class ListingsTracker:
+    """
+    Tracks which listings are stored in the FAISS index and the ingest watermark.
+
+    The index stores listing ids as its own ids, so no position mapping is needed;
+    the id set is kept for reporting and to resume from older mapping files.
+    """
+
     def __init__(self, mapping_file="listings_mapping.json"):
         self.mapping_file = Path(mapping_file)
-        self.id_to_position = {}  # listing_id -> faiss_position
-        self.position_to_id = {}  # faiss_position -> listing_id
+        self.listing_ids = set()  # listings stored in the FAISS index
         self.total_embeddings = 0
+        # Last ingested row, refresh cursor and the (listing_id, updated_at) changes already refreshed near it
+        self.watermark = {'id': 0, 'updated_at': None, 'refreshed_at': None, 'refreshed_changes': set()}
+        self.legacy_positions = {}  # faiss_position -> listing_id, from files written before ids were stored in FAISS
         self.load_mappings()
     
     def load_mappings(self):
-        """Load existing ID-position mappings"""
+        """Load the tracked listings and watermark"""
         try:
             if self.mapping_file.exists():
                 with open(self.mapping_file, 'r') as f:
                     data = json.load(f)
-                    mappings = data.get('listings', {})
-                    # Convert string keys to integers
-                    self.id_to_position = {int(k): int(v) for k, v in mappings.items()}
-                    self.position_to_id = {v: k for k, v in self.id_to_position.items()}
-                    self.total_embeddings = data.get('total_embeddings', len(self.id_to_position))
-                logging.info(f"Loaded {len(self.id_to_position)} existing mappings")
+                    listings = data.get('listings', [])
+                    if isinstance(listings, dict):
+                        # Older files map listing_id -> FAISS position; the index must be migrated to listing ids
+                        self.legacy_positions = {int(v): int(k) for k, v in listings.items()}
+                    self.listing_ids = {int(listing_id) for listing_id in listings}
+                    self.total_embeddings = len(self.listing_ids)
+                    self.watermark = self._load_watermark(data.get('watermark'))
+                logging.info(f"Loaded {len(self.listing_ids)} tracked listings")
         except Exception as e:
             logging.error(f"Error loading mappings: {e}")
     
+    def _load_watermark(self, watermark):
+        """Parse a persisted watermark, deriving it from the tracked listings for older files"""
+        if not watermark:
+            # Files written before watermarks existed: resume after the highest tracked id
+            return {'id': max(self.listing_ids, default=0), 'updated_at': None, 'refreshed_at': None, 'refreshed_changes': set()}
+        updated_at = watermark.get('updated_at')
+        # Files written before the refresh cursor existed resume refreshing from the ingest watermark
+        refreshed_at = watermark.get('refreshed_at', updated_at)
+        return {
+            'id': int(watermark.get('id', 0)),
+            'updated_at': datetime.datetime.fromisoformat(updated_at) if updated_at else None,
+            'refreshed_at': datetime.datetime.fromisoformat(refreshed_at) if refreshed_at else None,
+            'refreshed_changes': {
+                (int(listing_id), datetime.datetime.fromisoformat(changed_at))
+                for listing_id, changed_at in watermark.get('refreshed_changes', [])
+            }
+        }
+
     def initialize_mappings(self, listing_ids):
         """Store initial listings after first FAISS creation"""
-        for idx, lid in enumerate(listing_ids):
-            self.id_to_position[lid] = idx
-            self.position_to_id[idx] = lid
-        self.total_embeddings = len(listing_ids)
+        self.listing_ids = {int(listing_id) for listing_id in listing_ids}
+        self.total_embeddings = len(self.listing_ids)
+        self.legacy_positions = {}
         self.save_mappings()
-    
-    def add_mappings(self, new_mappings):
-        """Add new listing ID to FAISS position mappings"""
-        try:
-            for listing_id, position in new_mappings.items():
-                self.id_to_position[listing_id] = position
-                self.position_to_id[position] = listing_id
-            self.total_embeddings += len(new_mappings)
+
+    def add_listings(self, listing_ids, save=True):
+        """Record listings stored in (or replaced in) the index"""
+        self.listing_ids.update(int(listing_id) for listing_id in listing_ids)
+        self.total_embeddings = len(self.listing_ids)
+        if save:
             self.save_mappings()
-            logging.info(f"Added {len(new_mappings)} new mappings")
-        except Exception as e:
-            logging.error(f"Error adding mappings: {e}")
-            raise
+        logging.info(f"Tracked {len(listing_ids)} stored listings")
     
+    def remove_listings(self, listing_ids, save=True):
+        """Forget listings removed from the index and return those that were tracked"""
+        removed_ids = [int(listing_id) for listing_id in listing_ids if int(listing_id) in self.listing_ids]
+        self.listing_ids.difference_update(removed_ids)
+        self.total_embeddings = len(self.listing_ids)
+        if save:
+            self.save_mappings()
+        logging.info(f"Removed {len(removed_ids)} tracked listings")
+        return removed_ids
+
+    def contains(self, listing_id):
+        """Whether a listing is stored in the index"""
+        return int(listing_id) in self.listing_ids
+
+    def advance_watermark(self, listing_id, updated_at=None):
+        """
+        Move the watermark forward to the last ingested listing id / updated_at.
+
+        The first ingest also starts the refresh cursor, since every row it read is
+        embedded as of its current state; after that only `advance_refresh_cursor` moves it.
+        """
+        self.watermark['id'] = max(self.watermark['id'], int(listing_id))
+        if updated_at is not None and (self.watermark['updated_at'] is None or updated_at > self.watermark['updated_at']):
+            self.watermark['updated_at'] = updated_at
+        if self.watermark['refreshed_at'] is None:
+            self.watermark['refreshed_at'] = updated_at
+        self.save_mappings()
+        logging.info(f"Watermark advanced to id={self.watermark['id']}, updated_at={self.watermark['updated_at']}")
+
+    def advance_refresh_cursor(self, changes, overlap_seconds=REFRESH_OVERLAP_SECONDS):
+        """
+        Move the refresh cursor forward to the newest updated_at among the changes a refresh handled.
+
+        The next refresh re-reads the `overlap_seconds` before the cursor, so the changes in
+        that window are remembered and skipped by `fetch_updated_listings` until the cursor
+        moves past them.
+
+        :param changes: (listing_id, updated_at) pairs re-embedded or removed by the refresh
+        """
+        changes = {(int(listing_id), updated_at) for listing_id, updated_at in changes if updated_at is not None}
+        if not changes:
+            return
+
+        refreshed_at = max(updated_at for _, updated_at in changes)
+        if self.watermark['refreshed_at'] is not None:
+            refreshed_at = max(refreshed_at, self.watermark['refreshed_at'])
+        since = refreshed_at - datetime.timedelta(seconds=overlap_seconds)
+        self.watermark['refreshed_at'] = refreshed_at
+        self.watermark['refreshed_changes'] = {
+            change for change in self.watermark['refreshed_changes'] | changes if change[1] >= since
+        }
+        self.save_mappings()
+        logging.info(f"Refresh cursor advanced to updated_at={self.watermark['refreshed_at']}")
+
     def save_mappings(self):
-        """Save current mappings to file"""
+        """Save tracked listings and watermark to file"""
         try:
+            updated_at, refreshed_at = self.watermark['updated_at'], self.watermark['refreshed_at']
+            if self.legacy_positions:
+                # Keep the position map until the index has been migrated to listing ids
+                listings = {listing_id: position for position, listing_id in self.legacy_positions.items()}
+            else:
+                listings = sorted(self.listing_ids)
             with open(self.mapping_file, 'w') as f:
                 json.dump({
-                    'listings': self.id_to_position,
+                    'listings': listings,
                     'total_embeddings': self.total_embeddings,
+                    'watermark': {
+                        'id': self.watermark['id'],
+                        'updated_at': updated_at.isoformat() if updated_at else None,
+                        'refreshed_at': refreshed_at.isoformat() if refreshed_at else None,
+                        'refreshed_changes': sorted(
+                            [listing_id, changed_at.isoformat()] for listing_id, changed_at in self.watermark['refreshed_changes']
+                        )
+                    },
                     'last_updated': datetime.datetime.now().isoformat()
                 }, f)
-            logging.info(f"Saved {len(self.id_to_position)} mappings")
+            logging.info(f"Saved {len(self.listing_ids)} tracked listings")
         except Exception as e:
             logging.error(f"Error saving mappings: {e}")
             raise
-    
-    def get_listing_id(self, faiss_position):
-        """Get listing ID from FAISS position"""
-        return self.position_to_id.get(faiss_position)
-    
-    def get_faiss_position(self, listing_id):
-        """Get FAISS position from listing ID"""
-        return self.id_to_position.get(listing_id)
\ No newline at end of file
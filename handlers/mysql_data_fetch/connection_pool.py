@@ -0,0 +1,126 @@
+import time
+import queue
+import logging
+import threading
+import pymysql
+from contextlib import contextmanager
+from config import MYSQL_CONFIG, MYSQL_POOL_CONFIG
+
+class ConnectionPool:
+    """
+    Thread-safe pool of pymysql connections.
+
+    At most `size` connections are checked out at once. Idle connections are reused
+    most-recently-used first, pinged before reuse when `pre_ping` is set, and
+    replaced once they are older than `recycle` seconds.
+    """
+
+    def __init__(self, size=5, pre_ping=True, recycle=3600, **connect_kwargs):
+        self.size = size
+        self.pre_ping = pre_ping
+        self.recycle = recycle
+        self.connect_kwargs = connect_kwargs
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._created_at = {}  # id(connection) -> creation time
+
+    def _connect(self):
+        """Open a new connection and record when it was created"""
+        conn = pymysql.connect(**self.connect_kwargs)
+        self._created_at[id(conn)] = time.monotonic()
+        return conn
+
+    def _discard(self, conn):
+        """Close a connection that will not be reused"""
+        self._created_at.pop(id(conn), None)
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_reusable(self, conn):
+        """Check an idle connection is young enough and still alive"""
+        created_at = self._created_at.get(id(conn), 0)
+        if self.recycle and time.monotonic() - created_at > self.recycle:
+            return False
+        if self.pre_ping:
+            try:
+                conn.ping(reconnect=False)
+            except Exception:
+                return False
+        return True
+
+    def acquire(self, timeout=None):
+        """
+        Check a connection out of the pool, opening one if no idle connection is usable.
+
+        :param timeout: Seconds to wait for a free slot, or None to wait indefinitely
+        :return: An open pymysql connection
+        """
+        if not self._slots.acquire(timeout=timeout):
+            raise TimeoutError(f"No MySQL connection available within {timeout}s (pool size {self.size})")
+
+        try:
+            while True:
+                try:
+                    conn = self._idle.get_nowait()
+                except queue.Empty:
+                    return self._connect()
+
+                if self._is_reusable(conn):
+                    return conn
+                self._discard(conn)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, conn):
+        """Return a connection to the pool, closing it if it is no longer usable"""
+        try:
+            # End any open transaction so the next user reads a fresh snapshot
+            conn.rollback()
+            self._idle.put_nowait(conn)
+        except Exception as e:
+            logging.warning(f"Discarding pooled MySQL connection: {e}")
+            self._discard(conn)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """Context manager that checks a connection out and returns it afterwards"""
+        conn = self.acquire(timeout)
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        """Close all idle connections"""
+        while True:
+            try:
+                self._discard(self._idle.get_nowait())
+            except queue.Empty:
+                break
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Return the process-wide connection pool, creating it on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            logging.info(f"Creating MySQL connection pool: {MYSQL_POOL_CONFIG}")
+            _pool = ConnectionPool(**MYSQL_POOL_CONFIG, **MYSQL_CONFIG)
+    return _pool
+
+def get_connection(timeout=None):
+    """Check a connection out of the process-wide pool (use as a context manager)"""
+    return get_pool().connection(timeout)
+
+def close_pool():
+    """Close the idle connections of the process-wide pool"""
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
@@ -1,14 +1,19 @@
+import math
+import datetime
 import pymysql
+import pymysql.cursors
 import logging
-from config import MYSQL_CONFIG
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor
+from config import FETCH_CHUNK_SIZE, FETCH_PARTITIONS, FETCH_CLIENT_AMENITIES, REFRESH_OVERLAP_SECONDS
+from handlers.mysql_data_fetch.connection_pool import get_connection, get_pool
+from handlers.data_handling.amenities import AMENITY_TYPES
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
-# Define the function to fetch data from MySQL
-def fetch_data_from_mysql():
-    """Fetch property listings from MySQL and return as a list of dictionaries."""
-    query = """
+# Columns and joins shared by every listings query
+LISTINGS_COLUMNS = """
         SELECT 
             users.first_name, 
             users.last_name,
@@ -27,33 +32,144 @@ def fetch_data_from_mysql():
             complexes.type AS complex_type, complexes.class AS complex_class, complexes.county AS complex_county, 
             complexes.county_specific AS complex_county_specific, complexes.longitude AS complex_longitude, 
             complexes.latitude AS complex_latitude, complexes.location_description AS complex_location_description, 
-            complexes.available AS complex_available, 
-            GROUP_CONCAT(CONCAT(amenities_dataset.type, ': ', amenities_dataset.amenity) SEPARATOR '; ') AS amenities
+            complexes.available AS complex_available"""
+
+AMENITIES_COLUMN = """, 
+            GROUP_CONCAT(CONCAT(amenities_dataset.type, ': ', amenities_dataset.amenity) SEPARATOR '; ') AS amenities"""
+
+LISTINGS_FROM = """
         FROM listings_datasets 
         LEFT JOIN complexes ON listings_datasets.complex_id = complexes.id 
-        LEFT JOIN amenities_dataset ON listings_datasets.id = amenities_dataset.listing_id
+        {amenities_join}
         LEFT JOIN users ON listings_datasets.user_id = users.id
         LEFT JOIN businesses ON users.id = businesses.user_id
-        WHERE listings_datasets.status = 'Published'
-        GROUP BY listings_datasets.id;
+        WHERE {status_filter}"""
+
+AMENITIES_JOIN = "LEFT JOIN amenities_dataset ON listings_datasets.id = amenities_dataset.listing_id"
+
+# Ids of ingested listings whose row or amenities changed at or after a given updated_at
+CHANGED_LISTINGS_QUERY = """
+        SELECT id, updated_at
+        FROM listings_datasets
+        WHERE updated_at >= %s AND id <= %s
+        UNION ALL
+        SELECT listing_id, MAX(updated_at)
+        FROM amenities_dataset
+        WHERE updated_at >= %s AND listing_id <= %s
+        GROUP BY listing_id;
+"""
+
+# Amenity rows fetched separately when amenities are joined client-side
+AMENITIES_QUERY = """
+        SELECT listing_id, type, amenity
+        FROM amenities_dataset
+        WHERE listing_id BETWEEN %s AND %s
+        ORDER BY listing_id, id;
+"""
+
+# Amenity rows of a sparse set of listings (e.g. a page of changed ones), one placeholder per id
+AMENITIES_BY_IDS_QUERY = """
+        SELECT listing_id, type, amenity
+        FROM amenities_dataset
+        WHERE listing_id IN ({placeholders})
+        ORDER BY listing_id, id;
+"""
+
+def build_listings_query(conditions="", order_by_id=False, client_amenities=FETCH_CLIENT_AMENITIES, published_only=True):
+    """
+    Build the listings query (published listings only, unless `published_only` is False).
+
+    By default amenities are aggregated server-side with GROUP_CONCAT. With
+    `client_amenities` the amenities join is dropped, leaving a flat indexed query;
+    amenities are then added by `attach_amenities`. Both keep one row per listing,
+    since an owner with several businesses would otherwise repeat it.
+
+    :param conditions: Extra SQL appended to the WHERE clause (e.g. "AND listings_datasets.id > %s")
+    :param order_by_id: Whether to order the rows by listing id
+    :param client_amenities: Whether amenities are joined client-side
+    :param published_only: Whether to restrict the query to Published listings
+    :return: SQL query string
+    """
+    status_filter = "listings_datasets.status = 'Published'" if published_only else "1 = 1"
+    if client_amenities:
+        query = LISTINGS_COLUMNS + LISTINGS_FROM.format(amenities_join="", status_filter=status_filter)
+    else:
+        query = LISTINGS_COLUMNS + AMENITIES_COLUMN + LISTINGS_FROM.format(amenities_join=AMENITIES_JOIN, status_filter=status_filter)
+
+    if conditions:
+        query += "\n        " + conditions
+    query += "\n        GROUP BY listings_datasets.id"
+    if order_by_id:
+        query += "\n        ORDER BY listings_datasets.id"
+
+    return query
+
+def attach_amenities(cursor, listings):
     """
+    Join amenities_dataset rows onto listings in Python.
+
+    Each listing gets an `amenities` dict of {'internal': [...], 'external': [...], 'nearby': [...]}
+    built from one indexed query over the listings' ids: a range scan when the ids are
+    mostly contiguous (full and new-listing fetches), an IN list when they are sparse
+    (refresh pages), so the amenity rows read stay proportional to the listings fetched.
+
+    :param cursor: Open cursor on a connection not busy with another result set
+    :param listings: List of listing dictionaries fetched without amenities
+    :return: The same list of listings
+    """
+    if not listings:
+        return listings
+
+    listings_by_id = {}
+    for listing in listings:
+        listing['amenities'] = {key: [] for key in AMENITY_TYPES.values()}
+        listings_by_id[listing['id']] = listing
+
+    min_id, max_id = min(listings_by_id), max(listings_by_id)
+    if max_id - min_id + 1 <= 2 * len(listings_by_id):
+        cursor.execute(AMENITIES_QUERY, (min_id, max_id))
+    else:
+        placeholders = ', '.join(['%s'] * len(listings_by_id))
+        cursor.execute(AMENITIES_BY_IDS_QUERY.format(placeholders=placeholders), list(listings_by_id))
+    for listing_id, amenity_type, amenity in cursor.fetchall():
+        listing = listings_by_id.get(listing_id)
+        key = AMENITY_TYPES.get(amenity_type)
+        if listing is not None and key is not None:
+            listing['amenities'][key].append(amenity)
+
+    return listings
+
+# Define the function to compute the watermark of a batch of listings
+def listings_watermark(listings):
+    """Return the highest (id, updated_at) seen in a batch of listing dictionaries."""
+    last_id = max(listing['id'] for listing in listings)
+    last_updated_at = max((listing['updated_at'] for listing in listings if listing.get('updated_at')), default=None)
+    return last_id, last_updated_at
+
+# Define the function to fetch data from MySQL
+def fetch_data_from_mysql(client_amenities=FETCH_CLIENT_AMENITIES):
+    """Fetch property listings from MySQL and return as a list of dictionaries."""
+    query = build_listings_query(client_amenities=client_amenities)
 
     try:
         logging.info("Connecting to MySQL database...")
         
-        # Use context manager to ensure the connection is properly closed
-        with pymysql.connect(**MYSQL_CONFIG) as mysql_conn:
+        # Use context manager to ensure the connection is returned to the pool
+        with get_connection() as mysql_conn:
             with mysql_conn.cursor() as cursor:
                 cursor.execute(query)
                 rows = cursor.fetchall()
 
-        logging.info(f"Fetched {len(rows)} rows from MySQL.")
+                logging.info(f"Fetched {len(rows)} rows from MySQL.")
 
-        # Extract column names from cursor description
-        column_names = [desc[0] for desc in cursor.description]
-        
-        # Convert to list of dictionaries
-        listings = [dict(zip(column_names, row)) for row in rows]
+                # Extract column names from cursor description
+                column_names = [desc[0] for desc in cursor.description]
+
+                # Convert to list of dictionaries
+                listings = [dict(zip(column_names, row)) for row in rows]
+
+                if client_amenities:
+                    attach_amenities(cursor, listings)
 
         return listings
 
@@ -61,62 +177,251 @@ def fetch_data_from_mysql():
         logging.error(f"Error fetching data from MySQL: {e}")
         raise
 
-# Define the function to fetch new listings from MySQL
-def fetch_new_listings(tracker):
-    """Fetch only new property listings not already in FAISS index."""
-    
-    # Get tracked listing IDs
-    tracked_ids = list(tracker.get_tracked_ids())
-    
-    # Modify query to exclude tracked listings
-    query = """
-        SELECT 
-            users.first_name, 
-            users.last_name,
-            businesses.business_name,
-            businesses.account_type,
-            businesses.business_email,
-            listings_datasets.id, listings_datasets.name, listings_datasets.ref, listings_datasets.slug, listings_datasets.category, 
-            listings_datasets.county, listings_datasets.county_specific, listings_datasets.longitude, listings_datasets.latitude, 
-            listings_datasets.location_description, listings_datasets.type AS listing_type, listings_datasets.class AS listing_class, 
-            listings_datasets.furnishing, listings_datasets.bedrooms, listings_datasets.bathrooms, listings_datasets.sq_area, listings_datasets.amount, 
-            listings_datasets.viewing_fee, listings_datasets.property_description, listings_datasets.status, listings_datasets.availability, 
-            listings_datasets.subscription_status, listings_datasets.complex_id, listings_datasets.user_id, listings_datasets.created_at, 
-            listings_datasets.updated_at, listings_datasets.link, listings_datasets.currency, 
-            complexes.title AS complex_title, complexes.ref_code AS complex_ref_code, complexes.slug AS complex_slug, 
-            complexes.email AS complex_email, complexes.mobile AS complex_mobile, complexes.description AS complex_description, 
-            complexes.type AS complex_type, complexes.class AS complex_class, complexes.county AS complex_county, 
-            complexes.county_specific AS complex_county_specific, complexes.longitude AS complex_longitude, 
-            complexes.latitude AS complex_latitude, complexes.location_description AS complex_location_description, 
-            complexes.available AS complex_available, 
-            GROUP_CONCAT(CONCAT(amenities_dataset.type, ': ', amenities_dataset.amenity) SEPARATOR '; ') AS amenities
-        FROM listings_datasets 
-        LEFT JOIN complexes ON listings_datasets.complex_id = complexes.id 
-        LEFT JOIN amenities_dataset ON listings_datasets.id = amenities_dataset.listing_id
-        LEFT JOIN users ON listings_datasets.user_id = users.id
-        LEFT JOIN businesses ON users.id = businesses.user_id
-        WHERE listings_datasets.status = 'Published'
-        AND listings_datasets.id NOT IN (%s)
-        GROUP BY listings_datasets.id;
+# Define the function to fetch a single listings id range on its own pooled connection
+def _fetch_id_range(query, lower_id, upper_id, client_amenities):
+    """Fetch published listings with ids in [lower_id, upper_id] as a list of dictionaries."""
+    with get_connection() as mysql_conn:
+        with mysql_conn.cursor() as cursor:
+            cursor.execute(query, (lower_id, upper_id))
+            rows = cursor.fetchall()
+            column_names = [desc[0] for desc in cursor.description]
+            listings = [dict(zip(column_names, row)) for row in rows]
+
+            if client_amenities:
+                attach_amenities(cursor, listings)
+
+    return listings
+
+# Define the function to fetch data from MySQL over several connections in parallel
+def fetch_data_partitioned(partitions=FETCH_PARTITIONS, client_amenities=FETCH_CLIENT_AMENITIES):
+    """
+    Fetch property listings by splitting listings_datasets.id into contiguous ranges
+    and querying each range concurrently on its own pooled connection.
+
+    :param partitions: Number of id ranges (and concurrent connections)
+    :param client_amenities: Whether amenities are joined client-side
+    :return: List of listing dictionaries ordered by id
+    """
+    bounds_query = """
+        SELECT MIN(id), MAX(id)
+        FROM listings_datasets
+        WHERE status = 'Published';
     """
-    
+    query = build_listings_query("AND listings_datasets.id BETWEEN %s AND %s", order_by_id=True, client_amenities=client_amenities)
+
     try:
-        logging.info("Fetching new listings from MySQL...")
-        
-        with pymysql.connect(**MYSQL_CONFIG) as mysql_conn:
+        with get_connection() as mysql_conn:
             with mysql_conn.cursor() as cursor:
-                # Format query with tracked IDs or '0' if none exist
-                formatted_query = query % ','.join(map(str, tracked_ids)) if tracked_ids else query.replace("NOT IN (%s)", "NOT IN (0)")
-                cursor.execute(formatted_query)
-                rows = cursor.fetchall()
+                cursor.execute(bounds_query)
+                min_id, max_id = cursor.fetchone()
 
-        logging.info(f"Fetched {len(rows)} new listings_datasets.")
+        if min_id is None:
+            logging.info("Fetched 0 rows from MySQL.")
+            return []
 
-        column_names = [desc[0] for desc in cursor.description]
-        listings = [dict(zip(column_names, row)) for row in rows]
+        partitions = max(1, int(partitions))
+        step = math.ceil((max_id - min_id + 1) / partitions)
+        id_ranges = [
+            (lower_id, min(lower_id + step - 1, max_id))
+            for lower_id in range(min_id, max_id + 1, step)
+        ]
+        logging.info(f"Fetching listings {min_id}-{max_id} from MySQL in {len(id_ranges)} partitions...")
+
+        # map() yields results in submission order, so the merge preserves id order
+        with ThreadPoolExecutor(max_workers=min(len(id_ranges), get_pool().size)) as executor:
+            results = executor.map(lambda id_range: _fetch_id_range(query, *id_range, client_amenities), id_ranges)
+            listings = [listing for partition in results for listing in partition]
+
+        logging.info(f"Fetched {len(listings)} rows from MySQL.")
 
         return listings
 
+    except Exception as e:
+        logging.error(f"Error fetching partitioned data from MySQL: {e}")
+        raise
+
+# Define the function to stream data from MySQL in chunks
+def stream_data_from_mysql(chunk_size=FETCH_CHUNK_SIZE, client_amenities=FETCH_CLIENT_AMENITIES):
+    """
+    Stream property listings from MySQL, yielding lists of at most `chunk_size` dictionaries.
+
+    Rows are read through an unbuffered server-side cursor, so only one chunk is held
+    in memory at a time and callers can start processing before the query finishes.
+    The cursor keeps its connection busy, so client-side amenities need a second
+    pooled connection; with a pool of one, amenities are aggregated server-side instead.
+
+    :param chunk_size: Number of listings per yielded chunk
+    :param client_amenities: Whether amenities are joined client-side
+    :return: Generator of lists of listing dictionaries
+    """
+    if client_amenities and get_pool().size < 2:
+        logging.warning("Streaming with client-side amenities needs a pool of at least 2 connections; using GROUP_CONCAT.")
+        client_amenities = False
+    query = build_listings_query(order_by_id=client_amenities, client_amenities=client_amenities)
+
+    try:
+        logging.info("Streaming listings from MySQL database...")
+        total_rows = 0
+
+        with get_connection() as mysql_conn, ExitStack() as stack:
+            amenities_cursor = None
+            if client_amenities:
+                # The unbuffered cursor keeps its connection busy, so amenities use a second one
+                amenities_conn = stack.enter_context(get_connection())
+                amenities_cursor = stack.enter_context(amenities_conn.cursor())
+
+            with mysql_conn.cursor(pymysql.cursors.SSCursor) as cursor:
+                cursor.execute(query)
+                column_names = [desc[0] for desc in cursor.description]
+
+                while True:
+                    rows = cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    total_rows += len(rows)
+                    listings = [dict(zip(column_names, row)) for row in rows]
+
+                    if client_amenities:
+                        attach_amenities(amenities_cursor, listings)
+
+                    yield listings
+
+        logging.info(f"Streamed {total_rows} rows from MySQL.")
+
+    except Exception as e:
+        logging.error(f"Error streaming data from MySQL: {e}")
+        raise
+
+# Define the function to page through new listings from MySQL
+def iter_new_listings(tracker, page_size=FETCH_CHUNK_SIZE, client_amenities=FETCH_CLIENT_AMENITIES):
+    """
+    Yield pages of property listings not already in FAISS index.
+
+    Listings are selected above the tracker's persisted id watermark and read in
+    keyset-paginated pages, so each poll is an index range scan over new rows only.
+    A draft the watermark moved past and that is Published later has an id below the
+    watermark; publishing it bumps its updated_at, so `fetch_updated_listings` picks it
+    up and the refresh indexes it.
+
+    :param tracker: ListingsTracker holding the watermark of the last ingested row
+    :param page_size: Number of listings fetched per page
+    :param client_amenities: Whether amenities are joined client-side
+    :return: Generator of lists of new listing dictionaries ordered by id
+    """
+    query = build_listings_query("AND listings_datasets.id > %s", order_by_id=True, client_amenities=client_amenities) + """
+        LIMIT %s;
+    """
+
+    try:
+        logging.info(f"Fetching new listings from MySQL after id {tracker.watermark['id']}...")
+        total_rows = 0
+        last_id = tracker.watermark['id']
+
+        with get_connection() as mysql_conn:
+            with mysql_conn.cursor() as cursor:
+                while True:
+                    cursor.execute(query, (last_id, page_size))
+                    rows = cursor.fetchall()
+                    if not rows:
+                        break
+
+                    column_names = [desc[0] for desc in cursor.description]
+                    page = [dict(zip(column_names, row)) for row in rows]
+
+                    if client_amenities:
+                        attach_amenities(cursor, page)
+
+                    total_rows += len(page)
+                    last_id = page[-1]['id']
+                    yield page
+
+                    if len(rows) < page_size:
+                        break
+
+        logging.info(f"Fetched {total_rows} new listings_datasets.")
+
     except Exception as e:
         logging.error(f"Error fetching new listings: {e}")
-        raise
\ No newline at end of file
+        raise
+
+# Define the function to fetch new listings from MySQL
+def fetch_new_listings(tracker, page_size=FETCH_CHUNK_SIZE, client_amenities=FETCH_CLIENT_AMENITIES):
+    """
+    Fetch only new property listings not already in FAISS index.
+
+    :param tracker: ListingsTracker holding the watermark of the last ingested row
+    :param page_size: Number of listings fetched per page
+    :param client_amenities: Whether amenities are joined client-side
+    :return: List of new listing dictionaries ordered by id
+    """
+    listings = []
+    for page in iter_new_listings(tracker, page_size, client_amenities):
+        listings.extend(page)
+    return listings
+
+# Define the function to fetch listings updated since they were indexed
+def fetch_updated_listings(tracker, page_size=FETCH_CHUNK_SIZE, client_amenities=FETCH_CLIENT_AMENITIES, overlap_seconds=REFRESH_OVERLAP_SECONDS):
+    """
+    Fetch already-ingested listings whose row or amenities changed since the tracker's
+    refresh cursor, whatever their current status.
+
+    The refresh cursor is separate from the ingest watermark, which new listings move
+    past edits that have not been refreshed yet. Rows are read from `overlap_seconds`
+    before the cursor, inclusive, so changes committed in the same second as the last
+    refresh are not lost; (listing_id, updated_at) changes the tracker records as already
+    refreshed are skipped, so an idle catalogue yields nothing.
+
+    Listings that are no longer Published are included so callers can remove their
+    vectors, and so are drafts below the id watermark that were Published since (never
+    ingested, so they are added rather than replaced). The cost is proportional to the
+    number of changed rows.
+
+    :param tracker: ListingsTracker holding the watermark and refresh cursor
+    :param page_size: Number of changed listings fetched per query
+    :param client_amenities: Whether amenities are joined client-side
+    :param overlap_seconds: Seconds re-read before the refresh cursor
+    :return: Tuple of (list of changed listing dictionaries, (listing_id, updated_at) changes
+             they cover, for `ListingsTracker.advance_refresh_cursor`)
+    """
+    refreshed_at = tracker.watermark['refreshed_at']
+    last_id = tracker.watermark['id']
+
+    if refreshed_at is None:
+        logging.info("No refresh cursor recorded yet; skipping update detection.")
+        return [], None
+    since = refreshed_at - datetime.timedelta(seconds=overlap_seconds)
+
+    try:
+        logging.info(f"Fetching listings updated since {since} from MySQL...")
+        listings = []
+
+        with get_connection() as mysql_conn:
+            with mysql_conn.cursor() as cursor:
+                cursor.execute(CHANGED_LISTINGS_QUERY, (since, last_id, since, last_id))
+                refreshed = tracker.watermark['refreshed_changes']
+                changes = [(listing_id, updated_at) for listing_id, updated_at in cursor.fetchall() if (listing_id, updated_at) not in refreshed]
+                changed_ids = sorted({listing_id for listing_id, _ in changes})
+
+                for start in range(0, len(changed_ids), page_size):
+                    page_ids = changed_ids[start:start + page_size]
+                    placeholders = ', '.join(['%s'] * len(page_ids))
+                    query = build_listings_query(
+                        f"AND listings_datasets.id IN ({placeholders})", order_by_id=True,
+                        client_amenities=client_amenities, published_only=False
+                    )
+                    cursor.execute(query, page_ids)
+                    column_names = [desc[0] for desc in cursor.description]
+                    page = [dict(zip(column_names, row)) for row in cursor.fetchall()]
+
+                    if client_amenities:
+                        attach_amenities(cursor, page)
+
+                    listings.extend(page)
+
+        logging.info(f"Fetched {len(listings)} updated listings_datasets.")
+
+        return listings, changes
+
+    except Exception as e:
+        logging.error(f"Error fetching updated listings: {e}")
+        raise
@@ -0,0 +1,344 @@
+import os
+import json
+import logging
+import threading
+import numpy as np
+from pathlib import Path
+from config import VECTOR_STORE_DTYPE
+
+# Create vector store directory
+VECTOR_DIR = Path("storage/vectors")
+VECTOR_DIR.mkdir(parents=True, exist_ok=True)
+
+# Rows copied at a time when compacting
+COMPACT_CHUNK = 100000
+
+def stratified_sample(count, size, seed=0):
+    """
+    Positions of a stratified sample of `size` out of `count` items.
+
+    The items are split into `size` equal strata in order and one is drawn from each, so
+    every stretch of the sequence is represented in proportion.
+
+    :return: Sorted int64 array of positions (every position if `size` >= `count`)
+    """
+    if size >= count:
+        return np.arange(count, dtype='int64')
+    bounds = np.linspace(0, count, size + 1).astype('int64')
+    return np.random.default_rng(seed).integers(bounds[:-1], bounds[1:])
+
+class VectorStore:
+    """
+    Append-only store of the exact embeddings behind a FAISS index, keyed by listing id.
+
+    Vectors are appended to a raw float32 (or float16) file that is memory-mapped for
+    reads, with a parallel file of listing ids. Re-adding a listing appends a new row
+    that supersedes the old one; deleting appends (listing_id, row count) to a deletion
+    log. Superseded and deleted rows are dropped by `compact`, which runs automatically
+    once they outnumber the live rows (unless the store is pinned).
+
+    Compaction writes a new generation of the vector, id and deletion files; meta.json
+    names the current generation and is replaced last, so an interrupted compaction
+    leaves the previous generation in use.
+    """
+
+    def __init__(self, name, dtype=VECTOR_STORE_DTYPE):
+        self.name = name
+        self.path = VECTOR_DIR / name
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.meta_file = self.path / "meta.json"
+        self._set_generation(0)
+        self._lock = threading.RLock()
+        self._mapped = None
+        self._pins = 0
+
+        self.dimension = None
+        self.dtype = np.dtype(dtype)
+        self.count = 0
+        self.rows = {}  # listing_id -> row of its live vector
+        self._load()
+
+    def _generation_files(self, generation):
+        """Vector, id and deletion files of a generation (generation 0 predates compaction generations)"""
+        suffix = f".{generation}" if generation else ""
+        return self.path / f"vectors{suffix}.bin", self.path / f"ids{suffix}.bin", self.path / f"deletions{suffix}.bin"
+
+    def _set_generation(self, generation):
+        self.generation = generation
+        self.vectors_file, self.ids_file, self.deletions_file = self._generation_files(generation)
+
+    def _load(self):
+        """Rebuild the id -> row index from the id file and deletion log"""
+        if not self.meta_file.exists():
+            return
+
+        with open(self.meta_file, 'r') as f:
+            meta = json.load(f)
+        self.dimension = meta['dimension']
+        self.dtype = np.dtype(meta['dtype'])
+        self._set_generation(meta.get('generation', 0))
+        self._remove_generations_before(self.generation)
+
+        ids = np.fromfile(self.ids_file, dtype='<i8') if self.ids_file.exists() else np.empty(0, dtype='<i8')
+        vector_rows = self.vectors_file.stat().st_size // self._row_bytes() if self.vectors_file.exists() else 0
+        # Vectors are written before their ids, so a torn append leaves at most unreferenced vectors
+        self.count = min(len(ids), vector_rows)
+        ids = ids[:self.count]
+
+        # The last row written for an id is its live one
+        unique_ids, reversed_rows = np.unique(ids[::-1], return_index=True)
+        latest_rows = self.count - 1 - reversed_rows
+        self.rows = dict(zip(unique_ids.tolist(), latest_rows.tolist()))
+
+        if self.deletions_file.exists():
+            deletions = np.fromfile(self.deletions_file, dtype='<i8').reshape(-1, 2)
+            for listing_id, deleted_at in deletions.tolist():
+                row = self.rows.get(listing_id)
+                if row is not None and row < deleted_at:
+                    del self.rows[listing_id]
+
+        logging.info(f"Loaded vector store {self.name} with {len(self.rows)} live of {self.count} stored vectors")
+
+    def _row_bytes(self):
+        return self.dimension * self.dtype.itemsize
+
+    def _save_meta(self):
+        """Write meta.json atomically; it is what switches the store to a new generation"""
+        temp_meta = self.path / "meta.json.tmp"
+        with open(temp_meta, 'w') as f:
+            json.dump({'dimension': self.dimension, 'dtype': self.dtype.name, 'count': self.count, 'generation': self.generation}, f)
+        os.replace(temp_meta, self.meta_file)
+
+    def _remove_generations_before(self, generation):
+        """Delete the files of older generations, left behind if a compaction stopped after switching"""
+        for old_file in self.path.glob("*.bin"):
+            parts = old_file.name.split('.')
+            old_generation = int(parts[1]) if len(parts) == 3 and parts[1].isdigit() else 0
+            if old_generation < generation:
+                old_file.unlink()
+
+    def _vectors(self):
+        """Memory-map the stored vectors (remapped after appends)"""
+        if self._mapped is None or len(self._mapped) != self.count:
+            self._mapped = np.memmap(self.vectors_file, dtype=self.dtype, mode='r', shape=(self.count, self.dimension))
+        return self._mapped
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, listing_id):
+        return int(listing_id) in self.rows
+
+    def append(self, listing_ids, embeddings):
+        """
+        Store the exact vectors of listings, replacing any previous vector of the same listing.
+
+        :param listing_ids: Listing ids matching the rows of `embeddings`
+        :param embeddings: 2-D array of embeddings
+        """
+        listing_ids = np.asarray(listing_ids, dtype='<i8')
+        embeddings = np.ascontiguousarray(embeddings, dtype=self.dtype)
+        if not len(listing_ids):
+            return
+
+        with self._lock:
+            if self.dimension is None:
+                self.dimension = embeddings.shape[1]
+            elif embeddings.shape[1] != self.dimension:
+                raise ValueError(f"Vector store {self.name} holds {self.dimension}-d vectors, got {embeddings.shape[1]}-d")
+
+            # Discard any tail left by an interrupted append before writing after it
+            if self.vectors_file.exists() and self.vectors_file.stat().st_size != self.count * self._row_bytes():
+                os.truncate(self.vectors_file, self.count * self._row_bytes())
+
+            with open(self.vectors_file, 'ab') as f:
+                f.write(embeddings.tobytes())
+            with open(self.ids_file, 'ab') as f:
+                f.write(listing_ids.tobytes())
+
+            for offset, listing_id in enumerate(listing_ids.tolist()):
+                self.rows[listing_id] = self.count + offset
+            self.count += len(listing_ids)
+            self._save_meta()
+
+            self._maybe_compact()
+
+    def delete(self, listing_ids):
+        """
+        Drop the vectors of listings.
+
+        :param listing_ids: Listing ids to delete
+        :return: Number of live vectors deleted
+        """
+        with self._lock:
+            deleted = [int(listing_id) for listing_id in listing_ids if int(listing_id) in self.rows]
+            if not deleted:
+                return 0
+
+            log = np.array([(listing_id, self.count) for listing_id in deleted], dtype='<i8')
+            with open(self.deletions_file, 'ab') as f:
+                f.write(log.tobytes())
+            for listing_id in deleted:
+                del self.rows[listing_id]
+
+            self._maybe_compact()
+            return len(deleted)
+
+    def get(self, listing_ids):
+        """
+        Read the exact vectors of listings.
+
+        :param listing_ids: Listing ids, all of which must be stored
+        :return: float32 matrix, one row per listing id
+        """
+        with self._lock:
+            rows = [self.rows[int(listing_id)] for listing_id in listing_ids]
+            if not rows:
+                return np.empty((0, self.dimension or 0), dtype='float32')
+            return np.asarray(self._vectors()[rows], dtype='float32')
+
+    def live_rows(self):
+        """
+        Listing ids and rows of every live vector, in row (ingestion) order.
+
+        :return: Tuple of (int64 array of listing ids, int64 array of rows)
+        """
+        with self._lock:
+            listing_ids = np.fromiter(self.rows.keys(), dtype='int64', count=len(self.rows))
+            rows = np.fromiter(self.rows.values(), dtype='int64', count=len(self.rows))
+        order = np.argsort(rows)
+        return listing_ids[order], rows[order]
+
+    def rows_of(self, listing_ids):
+        """Rows of the live vectors of listings, all of which must be stored"""
+        with self._lock:
+            return np.array([self.rows[int(listing_id)] for listing_id in listing_ids], dtype='int64')
+
+    def read_rows(self, rows):
+        """Read vectors by row as a float32 matrix"""
+        with self._lock:
+            if not len(rows):
+                return np.empty((0, self.dimension or 0), dtype='float32')
+            return np.asarray(self._vectors()[rows], dtype='float32')
+
+    def load_all(self):
+        """
+        Read every live vector.
+
+        :return: Tuple of (int64 array of listing ids, float32 matrix of vectors)
+        """
+        listing_ids, rows = self.live_rows()
+        return listing_ids, self.read_rows(rows)
+
+    def iter_chunks(self, chunk_size, listing_ids=None, rows=None):
+        """
+        Read live vectors a chunk at a time, so only `chunk_size` rows are in memory at once.
+
+        :param chunk_size: Vectors per chunk
+        :param listing_ids: Listing ids to read (defaults to every live listing)
+        :param rows: Rows of `listing_ids`, e.g. from `snapshot` (looked up if omitted)
+        :return: Generator of (listing ids, float32 matrix of vectors) tuples
+        """
+        if listing_ids is None:
+            listing_ids, rows = self.live_rows()
+        elif rows is None:
+            rows = self.rows_of(listing_ids)
+        listing_ids = np.asarray(listing_ids, dtype='int64')
+        for start in range(0, len(listing_ids), chunk_size):
+            yield listing_ids[start:start + chunk_size], self.read_rows(rows[start:start + chunk_size])
+
+    def sample(self, size, rows=None, seed=0):
+        """
+        Stratified sample of live vectors, drawn evenly across ingestion order so every
+        period of the catalogue is represented (see `stratified_sample`).
+
+        :param size: Number of vectors to draw (all rows if there are fewer)
+        :param rows: Rows to draw from, e.g. from `snapshot` (defaults to every live row)
+        :param seed: Random seed
+        :return: float32 matrix of sampled vectors, in row order
+        """
+        if rows is None:
+            _, rows = self.live_rows()
+        return self.read_rows(rows[stratified_sample(len(rows), size, seed)])
+
+    def export(self, export_file):
+        """Write every live vector and its listing id to an .npz file"""
+        listing_ids, vectors = self.load_all()
+        np.savez(export_file, listing_ids=listing_ids, vectors=vectors)
+        logging.info(f"Exported {len(listing_ids)} vectors from {self.name} to {export_file}")
+
+    def snapshot(self):
+        """
+        Pin the store, so row numbers stay valid until `unpin`, and list its live vectors.
+
+        :return: Tuple of (listing ids, their rows, row count at the snapshot)
+        """
+        with self._lock:
+            self._pins += 1
+            listing_ids, rows = self.live_rows()
+            return listing_ids, rows, self.count
+
+    def changes_since(self, snapshot_ids, snapshot_count):
+        """
+        Listings added, replaced or deleted since a snapshot taken with `snapshot`.
+
+        :param snapshot_ids: Listing ids live at the snapshot
+        :param snapshot_count: Row count at the snapshot
+        :return: Tuple of (ids whose vector was added or replaced, ids deleted)
+        """
+        with self._lock:
+            changed = np.array([listing_id for listing_id, row in self.rows.items() if row >= snapshot_count], dtype='int64')
+            live = np.fromiter(self.rows.keys(), dtype='int64', count=len(self.rows))
+        deleted = snapshot_ids[~np.isin(snapshot_ids, live)]
+        return changed, deleted
+
+    def unpin(self):
+        """Release a pin taken by `snapshot`"""
+        with self._lock:
+            self._pins -= 1
+            self._maybe_compact()
+
+    def _maybe_compact(self):
+        """Compact once superseded and deleted rows outnumber live ones"""
+        if not self._pins and self.count - len(self.rows) > max(len(self.rows), 1000):
+            self.compact()
+
+    def compact(self):
+        """Rewrite the store with only its live rows, as a new generation without a deletion log"""
+        with self._lock:
+            if self._pins:
+                logging.warning(f"Not compacting vector store {self.name} while a retrain holds a snapshot of it")
+                return
+            listing_ids, rows = self.live_rows()
+            generation = self.generation + 1
+            vectors_file, ids_file, deletions_file = self._generation_files(generation)
+            # Leftovers of a compaction interrupted before it switched generations
+            deletions_file.unlink(missing_ok=True)
+            with open(vectors_file, 'wb') as f:
+                for start in range(0, len(rows), COMPACT_CHUNK):
+                    f.write(np.ascontiguousarray(self._vectors()[rows[start:start + COMPACT_CHUNK]]).tobytes())
+                os.fsync(f.fileno())
+            with open(ids_file, 'wb') as f:
+                f.write(listing_ids.astype('<i8').tobytes())
+                os.fsync(f.fileno())
+
+            # Both files are complete on disk before meta.json points at them
+            self._mapped = None
+            previous_count = self.count
+            self.count = len(listing_ids)
+            self.rows = dict(zip(listing_ids.tolist(), range(self.count)))
+            self._set_generation(generation)
+            self._save_meta()
+            self._remove_generations_before(generation)
+            logging.info(f"Compacted vector store {self.name} from {previous_count} to {self.count} vectors")
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+def get_vector_store(index_file="faiss_index_ivfpq.bin"):
+    """Return the process-wide vector store backing a FAISS index file"""
+    name = Path(index_file).stem
+    with _stores_lock:
+        if name not in _stores:
+            _stores[name] = VectorStore(name)
+        return _stores[name]
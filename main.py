@@ -16,6 +16,18 @@ def load_update_pipeline():
     from pipeline.update_pipeline import update_pipeline
     return update_pipeline
 
+def load_refresh_pipeline():
+    from pipeline.update_pipeline import refresh_pipeline
+    return refresh_pipeline
+
+def load_encoder_daemon():
+    from handlers.embeddings_generation.encoder_daemon import serve_encoder
+    return serve_encoder
+
+def load_vector_store():
+    from handlers.vector_store.vector_store import get_vector_store
+    return get_vector_store
+
 def load_db_watcher():
     from utils.watcher import DBWatcher
     return DBWatcher
@@ -40,7 +52,9 @@ def main():
             "1": "generate_dataset - generate synthetic listing data for training the model. This is the first step in the pipeline",
             "2": "run_pipeline --train-only - only train the model, converts listings to embeddings without storage. This is the second step in the pipeline",
             "3": "run_pipeline --storage-only - only store embeddings, assumes embeddings are already generated. This is the third step in the pipeline",
-            "4": "update_pipeline - this is when you're adding new listings into the FAISS database. This is the fourth step in the pipeline"
+            "4": "update_pipeline - this is when you're adding new listings into the FAISS database and re-embedding updated ones. This is the fourth step in the pipeline",
+            "5": "encoder_daemon - keep the embedding model loaded in a background service that the other options use while it is running",
+            "6": "export_vectors - write the exact stored embeddings and their listing ids to an .npz file"
         }
         for key, value in options.items():
             print(f"  {key}. {value}")
@@ -94,6 +108,18 @@ def main():
             # from pipeline.update_pipeline import update_pipeline
             update_pipeline = load_update_pipeline()
             update_pipeline()
+            refresh_pipeline = load_refresh_pipeline()
+            refresh_pipeline()
+
+        elif choice == '5':
+            # Runs until interrupted with Ctrl+C
+            serve_encoder = load_encoder_daemon()
+            serve_encoder()
+
+        elif choice == '6':
+            get_vector_store = load_vector_store()
+            export_file = input("Export file (default storage/vectors_export.npz): ").strip() or "storage/vectors_export.npz"
+            get_vector_store().export(export_file)
 
         else:
             print("\nInvalid choice. Please run the script again with a valid option.")
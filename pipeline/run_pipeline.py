@@ -1,42 +1,139 @@
 import logging
-import faiss
 import numpy as np
 from utils.logger import setup_logging
-from handlers.mysql_data_fetch.fetch import fetch_data_from_mysql
+from config import FETCH_STREAM, FETCH_CHUNK_SIZE, FETCH_PARTITIONS, FETCH_SNAPSHOT, SHARD_KEY
+from handlers.mysql_data_fetch.fetch import fetch_data_from_mysql, fetch_data_partitioned, stream_data_from_mysql, listings_watermark
 from handlers.data_handling.data_handling  import format_data
 from handlers.embeddings_generation.generate_embeddings  import generate_embeddings
-from handlers.embeddings_storage.embeddings_storage  import train_faiss_index, store_embeddings_in_trained_index
+from handlers.embeddings_storage.embeddings_storage  import train_faiss_index, store_embeddings_in_trained_index, load_index, save_index, live_count
+from handlers.embeddings_storage.sharding import ShardedIndex, store_in_shards
 from handlers.listings_tracker.tracker import ListingsTracker
+from handlers.listings_snapshot.snapshot import load_fresh_snapshot, write_snapshot
+from pipeline.streaming import stream_embeddings, collect_embeddings, index_embeddings_stream
 
-def run_pipeline(train_only=False, storage=False, index_file="faiss_index_ivfpq.bin"):
-    logging.info(f"Arguments passed to function: train_only={train_only}, storage={storage}")
+def embed_listings_stream(chunk_size=FETCH_CHUNK_SIZE):
+    """
+    Fetch, format and embed listings chunk by chunk as they stream from MySQL.
 
-    # Initialize listings tracker
-    tracker = ListingsTracker()
+    The stages overlap (see pipeline.streaming); all embeddings are gathered at the end.
+
+    :param chunk_size: Number of listings formatted and embedded per chunk
+    :return: Tuple of (listing_ids, embeddings, watermark), or (None, None, None) if nothing was fetched
+    """
+    return collect_embeddings(stream_embeddings(stream_data_from_mysql(chunk_size)))
 
-    # Step 1: Fetch data from MySQL
-    logging.info('Fetching Data form MySQL Database')
-    listings  = fetch_data_from_mysql()
+def store_listings_stream(index_file="faiss_index_ivfpq.bin", tracker=None, chunk_size=FETCH_CHUNK_SIZE):
+    """
+    Fetch, format, embed and index listings with all stages running concurrently.
+
+    :param index_file: Path of the FAISS index to add to (a new one is trained if it cannot be loaded)
+    :param tracker: ListingsTracker recording the stored listings
+    :param chunk_size: Number of listings per micro-batch
+    :return: True on success, None otherwise
+    """
+    tracker = tracker or ListingsTracker()
+    index, sharded = None, None
+
+    try:
+        if SHARD_KEY:
+            sharded = ShardedIndex(index_file, tracker)
+        else:
+            index = load_index(index_file, tracker)
+        logging.info("Loaded existing FAISS index.")
+    except Exception as e:
+        logging.warning(f"Could not load FAISS index: {str(e)}. Training a new one from the stream.")
+
+    try:
+        batches = stream_embeddings(stream_data_from_mysql(chunk_size))
+        stored, sample, watermark = index_embeddings_stream(batches, index, index_file, tracker=tracker, sharded=sharded)
+    except Exception as e:
+        logging.error(f"Error streaming listings into FAISS index: {str(e)}")
+        return
 
-    if not listings:
+    if not stored:
         logging.error("No data fetched from MySQL.")
         return
 
-    # Step 2: Format data retrived from MySQL Database
-    logging.info('Formatting Data into narratives')
-    narratives, listing_ids = format_data(listings)
+    tracker.advance_watermark(*watermark)
+    logging.info(f"Tracked {stored} streamed listings in index")
 
-    if narratives is None:
-        logging.error("Failed to generate formatted data.")
+    logging.info('Verifying Embeddings Storage in FAISS')
+    try:
+        if sharded:
+            sharded.verify(sample)
+            return True
+        loaded_index = load_index(index_file, read_only=True)
+        if live_count(loaded_index, index_file) != tracker.total_embeddings:
+            raise ValueError("Stored vector count does not match tracked listings.")
+        _, I = loaded_index.search(np.array([sample]), k=1)  # Check if search works
+        logging.info("Embeddings storage verified.")
+    except Exception as e:
+        logging.error(f"Failed to verify embeddings storage: {str(e)}")
         return
 
-    # Step 3: Convert narratives data to BERT embeddings
-    logging.info('Convert narratives data to BERT embeddings')
-    embeddings = generate_embeddings(narratives)
+    return True
 
-    if embeddings is None:
-        logging.error("Failed to generate embeddings.")
-        return
+def run_pipeline(train_only=False, storage=False, index_file="faiss_index_ivfpq.bin", stream=FETCH_STREAM, partitions=FETCH_PARTITIONS, use_snapshot=FETCH_SNAPSHOT):
+    logging.info(f"Arguments passed to function: train_only={train_only}, storage={storage}, stream={stream}, partitions={partitions}, use_snapshot={use_snapshot}")
+
+    # Initialize listings tracker
+    tracker = ListingsTracker()
+
+    if stream and storage and not train_only:
+        # Steps 1-6: Fetch, format, embed and index micro-batches concurrently
+        logging.info('Streaming Data from MySQL Database into the FAISS index')
+        return store_listings_stream(index_file, tracker)
+
+    if stream:
+        # Steps 1-3: Fetch, format and embed listings chunk by chunk as rows arrive
+        logging.info('Streaming Data from MySQL Database into BERT embeddings')
+        listing_ids, embeddings, watermark = embed_listings_stream()
+
+        if embeddings is None:
+            logging.error("No data fetched from MySQL.")
+            return
+    else:
+        # Step 1: Fetch data from a fresh local snapshot, or from MySQL
+        snapshot, key, listings, narratives = None, None, None, None
+        if use_snapshot:
+            snapshot, key = load_fresh_snapshot()
+            if snapshot is not None:
+                logging.info('Reading Data from local snapshot')
+                listings = snapshot.to_listings()
+                narratives = snapshot.narratives()
+
+        if listings is None:
+            logging.info('Fetching Data form MySQL Database')
+            listings  = fetch_data_partitioned(partitions) if partitions > 1 else fetch_data_from_mysql()
+
+        if not listings:
+            logging.error("No data fetched from MySQL.")
+            return
+
+        watermark = listings_watermark(listings)
+
+        # Step 2: Format data retrived from MySQL Database (unless the snapshot holds the narratives)
+        if narratives is not None:
+            logging.info('Reusing narratives from local snapshot')
+            listing_ids = np.array([narrative[0] for narrative in narratives])
+        else:
+            logging.info('Formatting Data into narratives')
+            narratives, listing_ids = format_data(listings)
+
+        if narratives is None:
+            logging.error("Failed to generate formatted data.")
+            return
+
+        if use_snapshot and snapshot is None:
+            write_snapshot(listings, key, narratives)
+
+        # Step 3: Convert narratives data to BERT embeddings
+        logging.info('Convert narratives data to BERT embeddings')
+        embeddings = generate_embeddings(narratives)
+
+        if embeddings is None:
+            logging.error("Failed to generate embeddings.")
+            return
 
     logging.info(f"Generated {len(embeddings)} embeddings.")
     logging.info(f"Embeddings shape: {embeddings.shape}")
@@ -48,30 +145,38 @@ def run_pipeline(train_only=False, storage=False, index_file="faiss_index_ivfpq.
         logging.info('FAISS index training complete.')
         return  True # Exit after training if in training mode only
  
+    # Steps 5-6: Store the embeddings in the shards of their listings and verify them
+    if storage and SHARD_KEY:
+        if not store_in_shards(embeddings, listing_ids, listings, index_file, tracker):
+            return
+        tracker.advance_watermark(*watermark)
+        logging.info(f"Tracked {len(listing_ids)} listings in shards")
+        return True
+
     # Step 5: Storing Embeddings into FAISS (Local Storage)
     if storage:
         try:
             # Try loading the existing index
             try:
-                index = faiss.read_index(index_file)
+                index = load_index(index_file, tracker)
                 logging.info("Loaded existing FAISS index.")
             except Exception as e:
                 logging.warning(f"Could not load FAISS index: {str(e)}. Training a new one.")
-                index = train_faiss_index(embeddings)
+                index = train_faiss_index(embeddings, index_file=index_file)
 
             # Ensure the index is trained before adding embeddings
             if not index.is_trained:
                 logging.warning("Loaded FAISS index is not trained. Training now...")
                 index.train(embeddings)
-                faiss.write_index(index, index_file)
+                save_index(index, index_file)
                 logging.info("FAISS index training completed and saved.")
 
-            # Store embeddings in the trained index
-            store_embeddings_in_trained_index(embeddings, index, listing_ids, index_file)
+            # Store embeddings in the trained index under their listing ids
+            if store_embeddings_in_trained_index(embeddings, index, listing_ids, index_file, tracker=tracker) is None:
+                raise RuntimeError("Failed to store embeddings.")
 
-            # Track stored listings
-            tracker.initialize_mappings(listing_ids)
-            logging.info(f"Tracked {len(listing_ids)} listings in initial index")
+            tracker.advance_watermark(*watermark)
+            logging.info(f"Tracked {len(listing_ids)} listings in index")
 
             logging.info("Embeddings stored in FAISS.")
 
@@ -82,23 +187,13 @@ def run_pipeline(train_only=False, storage=False, index_file="faiss_index_ivfpq.
     # Step 6: Verify Storage (after storage phase)
     logging.info('Verifying Embeddings Storage in FAISS')
     try:
-        loaded_index = faiss.read_index("faiss_index_ivfpq.bin")
-        if loaded_index.ntotal != embeddings.shape[0]:
-            raise ValueError("Stored vector count does not match input.")
+        loaded_index = load_index(index_file, read_only=True)
+        if live_count(loaded_index, index_file) != tracker.total_embeddings:
+            raise ValueError("Stored vector count does not match tracked listings.")
         _, I = loaded_index.search(np.array([embeddings[0]]), k=1)  # Check if search works
         logging.info("Embeddings storage verified.")
     except Exception as e:
         logging.error(f"Failed to verify embeddings storage: {str(e)}")
         return  # Handle accordingly
 
-    # Step 5: Verify Storage
-    logging.info('Verifying Embeddings Storage in FAISS')
-    try:
-        loaded_index = faiss.read_index("faiss_index_ivfpq.bin")
-        if loaded_index.ntotal != embeddings.shape[0]:
-            raise ValueError("Stored vector count does not match input.")
-        _, I = loaded_index.search(np.array([embeddings[0]]), k=1)  # Check if search works
-        logging.info("Embeddings storage verified.")
-    except Exception as e:
-        logging.error(f"Failed to verify embeddings storage: {str(e)}")
-        return  # Handle accordingly
\ No newline at end of file
+    return True
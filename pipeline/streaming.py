@@ -0,0 +1,254 @@
+import time
+import queue
+import logging
+import threading
+import numpy as np
+from config import STREAM_QUEUE_DEPTH, STREAM_TRAIN_SIZE, SHARD_KEY
+from handlers.mysql_data_fetch.fetch import listings_watermark
+from handlers.data_handling.data_handling import format_data
+from handlers.embeddings_generation.generate_embeddings import generate_embeddings
+from handlers.embeddings_storage.embeddings_storage import (
+    train_faiss_index, store_embeddings_in_trained_index, save_index, check_and_retrain_index, tune_index
+)
+from handlers.embeddings_storage.background_retrain import adopt_retrained_index
+from handlers.embeddings_storage.sharding import listing_shards
+from handlers.listings_tracker.tracker import ListingsTracker
+
+# End-of-stream marker passed down the queues
+_DONE = object()
+
+def _put(outbox, item, abort):
+    """Put `item` on a bounded queue, giving up if the pipeline is aborted"""
+    while not abort.is_set():
+        try:
+            outbox.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def _get(inbox, abort):
+    """Take the next item from a queue, or _DONE if the pipeline is aborted"""
+    while not abort.is_set():
+        try:
+            return inbox.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return _DONE
+
+def _run_source(chunks, outbox, abort, errors, busy):
+    """Fetch stage: pull listing chunks from `chunks` and queue them"""
+    try:
+        iterator = iter(chunks)
+        while not abort.is_set():
+            start = time.perf_counter()
+            listings = next(iterator, None)
+            busy['fetch'] += time.perf_counter() - start
+            if listings is None or not _put(outbox, listings, abort):
+                break
+    except Exception as e:
+        errors.append(e)
+        abort.set()
+    finally:
+        _put(outbox, _DONE, abort)
+
+def _run_stage(name, work, inbox, outbox, abort, errors, busy):
+    """Intermediate stage: apply `work` to each queued item and pass non-None results on"""
+    try:
+        while True:
+            item = _get(inbox, abort)
+            if item is _DONE:
+                break
+            start = time.perf_counter()
+            result = work(item)
+            busy[name] += time.perf_counter() - start
+            if result is not None and not _put(outbox, result, abort):
+                break
+    except Exception as e:
+        errors.append(e)
+        abort.set()
+    finally:
+        _put(outbox, _DONE, abort)
+
+def _format_chunk(listings):
+    """Format stage: listings -> (narratives, listing_ids, watermark, shards)"""
+    formatted = format_data(listings)
+    if formatted is None:
+        return None
+    narratives, listing_ids = formatted
+    shards = listing_shards(listings, listing_ids) if SHARD_KEY else None
+    return narratives, listing_ids, listings_watermark(listings), shards
+
+def _encode_chunk(formatted):
+    """Encode stage: (narratives, listing_ids, watermark, shards) -> (listing_ids, embeddings, watermark, shards)"""
+    narratives, listing_ids, watermark, shards = formatted
+    return listing_ids, generate_embeddings(narratives), watermark, shards
+
+def stream_embeddings(chunks, queue_depth=STREAM_QUEUE_DEPTH):
+    """
+    Fetch, format and encode listing chunks concurrently.
+
+    Each stage runs in its own thread and hands micro-batches to the next through a
+    queue of at most `queue_depth` items, so the stages overlap and no more than a few
+    chunks are held in memory at a time. The caller consumes the encoded batches,
+    typically adding them to an index, while the next ones are being prepared.
+
+    :param chunks: Iterable of lists of listing dictionaries (e.g. stream_data_from_mysql())
+    :param queue_depth: Maximum number of micro-batches waiting between two stages
+    :return: Generator of (listing_ids, embeddings, watermark, shards) tuples; shards holds
+             each listing's shard name when SHARD_KEY is set, else None
+    """
+    abort = threading.Event()
+    errors = []
+    busy = {'fetch': 0.0, 'format': 0.0, 'encode': 0.0}
+    fetched, formatted, encoded = (queue.Queue(maxsize=queue_depth) for _ in range(3))
+
+    threads = [
+        threading.Thread(target=_run_source, args=(chunks, fetched, abort, errors, busy), name="stream-fetch"),
+        threading.Thread(target=_run_stage, args=('format', _format_chunk, fetched, formatted, abort, errors, busy), name="stream-format"),
+        threading.Thread(target=_run_stage, args=('encode', _encode_chunk, formatted, encoded, abort, errors, busy), name="stream-encode"),
+    ]
+    for thread in threads:
+        thread.start()
+
+    start = time.perf_counter()
+    finished = False
+    try:
+        while True:
+            batch = _get(encoded, abort)
+            if batch is _DONE:
+                break
+            yield batch
+        finished = True
+    finally:
+        # Stop the producers if the consumer failed or stopped early
+        if not finished:
+            abort.set()
+        for thread in threads:
+            thread.join()
+
+    logging.info(
+        f"Streamed embeddings in {time.perf_counter() - start:.2f}s "
+        f"(stage busy time: fetch {busy['fetch']:.2f}s, format {busy['format']:.2f}s, encode {busy['encode']:.2f}s)"
+    )
+    if errors:
+        raise errors[0]
+
+def _merge_watermarks(watermarks):
+    """Combine per-batch (last_id, last_updated_at) watermarks"""
+    return (
+        max(last_id for last_id, _ in watermarks),
+        max((updated_at for _, updated_at in watermarks if updated_at), default=None)
+    )
+
+def collect_embeddings(batches):
+    """
+    Gather streamed batches into single arrays (for training, which needs every vector).
+
+    :param batches: Iterable of (listing_ids, embeddings, watermark, shards) tuples
+    :return: Tuple of (listing_ids, embeddings, watermark), or (None, None, None) if empty
+    """
+    id_chunks, embedding_chunks, watermarks = [], [], []
+    for listing_ids, embeddings, watermark, _ in batches:
+        id_chunks.append(listing_ids)
+        embedding_chunks.append(embeddings)
+        watermarks.append(watermark)
+
+    if not embedding_chunks:
+        return None, None, None
+    return np.concatenate(id_chunks), np.vstack(embedding_chunks), _merge_watermarks(watermarks)
+
+def index_embeddings_stream(batches, index=None, index_file="faiss_index_ivfpq.bin", tracker=None, train_size=STREAM_TRAIN_SIZE, sharded=None):
+    """
+    Add streamed embedding batches to a FAISS index as they arrive.
+
+    Without a trained index, batches are buffered until `train_size` vectors (or the end
+    of the stream) are available to train one. The index and tracker are written once
+    at the end rather than per batch.
+
+    :param batches: Iterable of (listing_ids, embeddings, watermark, shards) tuples
+    :param index: Trained FAISS index to add to, or None to train a new one
+    :param index_file: Path to save the index
+    :param tracker: ListingsTracker recording the stored listings
+    :param train_size: Number of vectors buffered to train a new index
+    :param sharded: ShardedIndex to add the batches to instead of `index`
+    :return: Tuple of (number of vectors stored, first stored embedding, watermark), or (0, None, None) if empty
+    """
+    if sharded is not None:
+        return _index_embeddings_sharded(batches, sharded)
+
+    tracker = tracker or ListingsTracker()
+    pending_ids, pending_embeddings, watermarks = [], [], []
+    stored, sample = 0, None
+    index_seconds = 0.0
+
+    def flush(listing_ids, embeddings):
+        nonlocal index, stored, sample
+        if index is None:
+            index = train_faiss_index(embeddings, index_file=index_file)
+        index = store_embeddings_in_trained_index(embeddings, index, listing_ids, index_file, tracker=tracker, persist=False)
+        if index is None:
+            raise RuntimeError("Failed to store streamed embeddings.")
+        stored += len(listing_ids)
+        if sample is None:
+            sample = embeddings[0]
+
+    for listing_ids, embeddings, watermark, _ in batches:
+        start = time.perf_counter()
+        watermarks.append(watermark)
+
+        if index is None:
+            pending_ids.append(listing_ids)
+            pending_embeddings.append(embeddings)
+            if sum(len(chunk) for chunk in pending_ids) >= train_size:
+                flush(np.concatenate(pending_ids), np.vstack(pending_embeddings))
+                pending_ids, pending_embeddings = [], []
+        else:
+            flush(listing_ids, embeddings)
+
+        index_seconds += time.perf_counter() - start
+
+    if pending_ids:
+        flush(np.concatenate(pending_ids), np.vstack(pending_embeddings))
+
+    if not stored:
+        return 0, None, None
+
+    # Let a rebuild triggered while the stream grew the index finish, then rebuild once more
+    # if the stream outgrew that one too, so the saved index is sized for everything stored
+    index = adopt_retrained_index(index, index_file, wait=True)
+    retrained = check_and_retrain_index(np.empty((0, index.d), dtype='float32'), index, index_file)
+    if retrained is not index:
+        tune_index(retrained, index_file)
+        index = retrained
+    save_index(index, index_file)
+    tracker.save_mappings()
+    logging.info(f"Stored {stored} streamed embeddings in {index_file} (index busy time {index_seconds:.2f}s)")
+    return stored, sample, _merge_watermarks(watermarks)
+
+def _index_embeddings_sharded(batches, sharded):
+    """
+    Add streamed batches to the shards of their listings.
+
+    A new shard is built from its first batch; under the 'auto' factory policy that is an
+    exact Flat index, which needs no training, and it is rebuilt as the shard grows.
+    """
+    watermarks = []
+    stored, sample = 0, None
+    index_seconds = 0.0
+
+    for listing_ids, embeddings, watermark, shards in batches:
+        start = time.perf_counter()
+        watermarks.append(watermark)
+        sharded.store(embeddings, listing_ids, shards, persist=False)
+        stored += len(listing_ids)
+        if sample is None:
+            sample = embeddings[0]
+        index_seconds += time.perf_counter() - start
+
+    if not stored:
+        return 0, None, None
+
+    sharded.save()
+    logging.info(f"Stored {stored} streamed embeddings in {len(sharded.shards())} shards (index busy time {index_seconds:.2f}s)")
+    return stored, sample, _merge_watermarks(watermarks)
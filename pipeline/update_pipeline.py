@@ -1,22 +1,73 @@
 import logging
-import faiss
 import numpy as np
 from utils.logger import setup_logging
-from handlers.mysql_data_fetch.fetch import fetch_new_listings
+from config import FETCH_STREAM, SHARD_KEY
+from handlers.mysql_data_fetch.fetch import fetch_new_listings, iter_new_listings, fetch_updated_listings, listings_watermark
 from handlers.data_handling.data_handling import format_data
 from handlers.embeddings_generation.generate_embeddings import generate_embeddings
-from handlers.embeddings_storage.embeddings_storage import store_embeddings_in_trained_index, check_and_retrain_index
+from handlers.embeddings_storage.embeddings_storage import store_embeddings_in_trained_index, remove_listings_from_index, load_index, live_count
+from handlers.embeddings_storage.sharding import ShardedIndex, listing_shards, store_in_shards
 from handlers.listings_tracker.tracker import ListingsTracker
+from pipeline.streaming import stream_embeddings, index_embeddings_stream
 
-def update_pipeline(index_file="faiss_index_ivfpq.bin"):
+def update_pipeline_stream(index_file="faiss_index_ivfpq.bin", tracker=None):
+    """Fetch, format, embed and index new listings page by page with all stages running concurrently."""
+    tracker = tracker or ListingsTracker()
+    index, sharded = None, None
+
+    try:
+        if SHARD_KEY:
+            sharded = ShardedIndex(index_file, tracker)
+        else:
+            index = load_index(index_file, tracker)
+        logging.info("Loaded existing FAISS index.")
+    except Exception as e:
+        logging.error(f"Could not load FAISS index: {str(e)}")
+        return
+
+    try:
+        start_idx = sharded.ntotal if sharded else live_count(index, index_file)
+        batches = stream_embeddings(iter_new_listings(tracker))
+        stored, sample, watermark = index_embeddings_stream(batches, index, index_file, tracker=tracker, sharded=sharded)
+        if not stored:
+            logging.info("No new data fetched from MySQL.")
+            return
+
+        # Only move the watermark once the new rows are safely in the index
+        tracker.advance_watermark(*watermark)
+        logging.info(f"Streamed {stored} new listings into FAISS index.")
+    except Exception as e:
+        logging.error(f"Error streaming new embeddings into FAISS index: {str(e)}")
+        return
+
+    logging.info('Verifying new embeddings storage in FAISS')
+    try:
+        if sharded:
+            sharded.verify(sample)
+            return
+        loaded_index = load_index(index_file, read_only=True)
+        if live_count(loaded_index, index_file) != start_idx + stored:
+            raise ValueError("Stored vector count does not match expected count.")
+        _, I = loaded_index.search(np.array([sample]), k=1)  # Check if search works
+        logging.info("New embeddings storage verified.")
+    except Exception as e:
+        logging.error(f"Failed to verify new embeddings storage: {str(e)}")
+        return
+
+def update_pipeline(index_file="faiss_index_ivfpq.bin", tracker=None, new_listings=None, stream=FETCH_STREAM):
     logging.info("Starting update pipeline...")
 
-    # Initialize listings tracker
-    tracker = ListingsTracker()
+    # Initialize listings tracker (callers such as the watcher share theirs)
+    tracker = tracker or ListingsTracker()
+
+    # Overlap fetching, formatting, embedding and indexing unless the caller already fetched the rows
+    if stream and new_listings is None:
+        return update_pipeline_stream(index_file, tracker)
 
-    # Step 1: Fetch new data from MySQL
-    logging.info('Fetching new data from MySQL Database')
-    new_listings = fetch_new_listings()
+    # Step 1: Fetch new data from MySQL, unless the caller already fetched it
+    if new_listings is None:
+        logging.info('Fetching new data from MySQL Database')
+        new_listings = fetch_new_listings(tracker)
 
     if not new_listings:
         logging.error("No new data fetched from MySQL.")
@@ -41,9 +92,16 @@ def update_pipeline(index_file="faiss_index_ivfpq.bin"):
     logging.info(f"Generated {len(new_embeddings)} new embeddings.")
     logging.info(f"New embeddings shape: {new_embeddings.shape}")
 
+    if SHARD_KEY:
+        # Steps 4-6: Store the new embeddings in the shards of their listings and verify them
+        if store_in_shards(new_embeddings, new_listing_ids, new_listings, index_file, tracker):
+            tracker.advance_watermark(*listings_watermark(new_listings))
+            logging.info("New embeddings stored in FAISS shards.")
+        return
+
     # Step 4: Load existing FAISS index and update with new embeddings
     try:
-        index = faiss.read_index(index_file)
+        index = load_index(index_file, tracker)
         logging.info("Loaded existing FAISS index.")
     except Exception as e:
         logging.error(f"Could not load FAISS index: {str(e)}")
@@ -51,13 +109,14 @@ def update_pipeline(index_file="faiss_index_ivfpq.bin"):
 
     # Step 5: Store new embeddings in the FAISS index
     try:
-        start_idx = index.ntotal
-        store_embeddings_in_trained_index(new_embeddings, index, index_file)
-
-        # Update tracker with new listings
-        tracker.update_mappings(new_listing_ids, start_idx)
+        start_idx = live_count(index, index_file)
+        if store_embeddings_in_trained_index(new_embeddings, index, new_listing_ids, index_file, tracker=tracker) is None:
+            raise RuntimeError("Failed to store new embeddings.")
         logging.info(f"Added {len(new_listing_ids)} listings to tracker")
 
+        # Only move the watermark once the new rows are safely in the index
+        tracker.advance_watermark(*listings_watermark(new_listings))
+
         logging.info("New embeddings stored in FAISS index.")
     except Exception as e:
         logging.error(f"Error storing new embeddings in FAISS index: {str(e)}")
@@ -66,11 +125,76 @@ def update_pipeline(index_file="faiss_index_ivfpq.bin"):
     # Step 6: Verify Storage
     logging.info('Verifying new embeddings storage in FAISS')
     try:
-        loaded_index = faiss.read_index(index_file)
-        if loaded_index.ntotal != index.ntotal + new_embeddings.shape[0]:
+        loaded_index = load_index(index_file, read_only=True)
+        if live_count(loaded_index, index_file) != start_idx + new_embeddings.shape[0]:
             raise ValueError("Stored vector count does not match expected count.")
         _, I = loaded_index.search(np.array([new_embeddings[0]]), k=1)  # Check if search works
         logging.info("New embeddings storage verified.")
     except Exception as e:
         logging.error(f"Failed to verify new embeddings storage: {str(e)}")
-        return
\ No newline at end of file
+        return
+
+def refresh_pipeline(index_file="faiss_index_ivfpq.bin", tracker=None, updated_listings=None, changes=None):
+    """Re-embed indexed listings that changed since ingest and drop those no longer Published."""
+    logging.info("Starting refresh of updated listings...")
+
+    # Initialize listings tracker (callers such as the watcher share theirs)
+    tracker = tracker or ListingsTracker()
+
+    # Step 1: Fetch listings updated since the refresh cursor, unless the caller already fetched them
+    if updated_listings is None:
+        logging.info('Fetching updated data from MySQL Database')
+        updated_listings, changes = fetch_updated_listings(tracker)
+
+    if not updated_listings:
+        logging.info("No updated listings found in MySQL.")
+        # Changes to rows that no longer exist leave nothing to re-embed, but must not be re-read
+        tracker.advance_refresh_cursor(changes or [])
+        return
+
+    published_listings = [listing for listing in updated_listings if listing['status'] == 'Published']
+    unpublished_ids = [listing['id'] for listing in updated_listings if listing['status'] != 'Published']
+    # Drafts published after the id watermark passed them are only seen here, and are added rather than replaced
+    newly_published = sum(not tracker.contains(listing['id']) for listing in published_listings)
+    logging.info(
+        f"Found {len(published_listings) - newly_published} updated, {newly_published} newly published "
+        f"and {len(unpublished_ids)} unpublished listings"
+    )
+
+    # Step 2: Load existing FAISS index (or the shard manifest)
+    index, sharded = None, None
+    try:
+        if SHARD_KEY:
+            sharded = ShardedIndex(index_file, tracker)
+        else:
+            index = load_index(index_file, tracker)
+        logging.info("Loaded existing FAISS index.")
+    except Exception as e:
+        logging.error(f"Could not load FAISS index: {str(e)}")
+        return
+
+    try:
+        # Step 3: Remove listings that are no longer published
+        if unpublished_ids:
+            if sharded:
+                removed = sharded.remove(unpublished_ids)
+            else:
+                removed = remove_listings_from_index(index, unpublished_ids, index_file, tracker=tracker)
+            logging.info(f"Removed {removed} unpublished listings from FAISS index.")
+
+        # Step 4: Re-embed updated listings and replace their vectors in place (moving them if their shard changed)
+        if published_listings:
+            narratives, listing_ids = format_data(published_listings)
+            embeddings = generate_embeddings(narratives)
+
+            if sharded:
+                sharded.store(embeddings, listing_ids, listing_shards(published_listings, listing_ids))
+            elif store_embeddings_in_trained_index(embeddings, index, listing_ids, index_file, tracker=tracker) is None:
+                raise RuntimeError("Failed to store updated embeddings.")
+            logging.info(f"Re-embedded {len(listing_ids)} updated listings.")
+
+        # Only move the refresh cursor once the index reflects the changes
+        tracker.advance_refresh_cursor(changes)
+    except Exception as e:
+        logging.error(f"Error refreshing updated listings in FAISS index: {str(e)}")
+        return
@@ -2,15 +2,17 @@ import time
 import threading
 import logging
 from datetime import datetime
-from handlers.mysql_data_fetch.fetch import fetch_new_listings
-from pipeline.update_pipeline import update_pipeline
+from handlers.mysql_data_fetch.fetch import fetch_new_listings, fetch_updated_listings
+from pipeline.update_pipeline import update_pipeline, refresh_pipeline
+from handlers.embeddings_generation.generate_embeddings import warm_up
 from handlers.listings_tracker.tracker import ListingsTracker
 
 class DBWatcher(threading.Thread):
-    def __init__(self, check_interval=300):  # 5 minutes default
+    def __init__(self, check_interval=300, warm_up_model=True):  # 5 minutes default
         super().__init__()
         self.stop_flag = threading.Event()
         self.check_interval = check_interval
+        self.warm_up_model = warm_up_model
         self.tracker = ListingsTracker()
         
     def check_for_new_listings(self):
@@ -21,14 +23,34 @@ class DBWatcher(threading.Thread):
             logging.error(f"Error checking for new listings: {e}")
             return None
         
+    def check_for_updated_listings(self):
+        """Check database for indexed listings updated since they were embedded"""
+        try:
+            return fetch_updated_listings(self.tracker)
+        except Exception as e:
+            logging.error(f"Error checking for updated listings: {e}")
+            return [], None
+
     def run(self):
         logging.info("Starting DB watcher thread...")
+        if self.warm_up_model:
+            # Load the model in the watcher thread so the first batch of changes is not delayed by it
+            try:
+                warm_up()
+            except Exception as e:
+                logging.error(f"Error warming up embedding model: {e}")
         while not self.stop_flag.is_set():
             try:
                 new_listings = self.check_for_new_listings()
                 if new_listings:
                     logging.info(f"Found {len(new_listings)} new listings")
-                    update_pipeline()
+                    # Reuse the fetched rows and the tracker so the poll is not repeated
+                    update_pipeline(tracker=self.tracker, new_listings=new_listings)
+
+                updated_listings, changes = self.check_for_updated_listings()
+                if changes:
+                    logging.info(f"Found {len(updated_listings)} updated listings")
+                    refresh_pipeline(tracker=self.tracker, updated_listings=updated_listings, changes=changes)
             except Exception as e:
                 logging.error(f"Error in watcher: {e}")
             time.sleep(self.check_interval)